@@ -6,6 +6,7 @@ from pathlib import Path
 from icrms.isolution import ISolution,NeData,NsData,RainfallData,TideData,Gate
 import logging
 from src.nh_resource_server.core.config import settings
+from src.nh_resource_server.core.mesh import is_mesh_file, read_ne, read_ns, ne_from_lists, ns_from_lists
 logger = logging.getLogger(__name__)
 
 @cc.iicrm
@@ -33,6 +34,11 @@ class Solution(ISolution):
         return data
     
     def get_ne(self) -> NeData:
+        # NE files exported by Topo are memory-mapped and returned as column views instead of parsed,
+        # text NE files are parsed into columns of the same types
+        if is_mesh_file(self.ne_path):
+            return read_ne(self.ne_path)
+        
         grid_id_list = [0]
         nsl1_list = [0]
         nsl2_list = [0]
@@ -79,10 +85,15 @@ class Solution(ISolution):
                 ye_list.append(float(row_data[-3]))
                 ze_list.append(float(row_data[-2]))
                 under_suf_list.append(int(row_data[-1]))       
-        ne_data = NeData(grid_id_list,nsl1_list,nsl2_list,nsl3_list,nsl4_list,isl1_list,isl2_list,isl3_list,isl4_list,xe_list,ye_list,ze_list,under_suf_list)
+        ne_data = ne_from_lists(grid_id_list,nsl1_list,nsl2_list,nsl3_list,nsl4_list,isl1_list,isl2_list,isl3_list,isl4_list,xe_list,ye_list,ze_list,under_suf_list)
         return ne_data
     
     def get_ns(self) -> NsData:
+        # NS files exported by Topo are memory-mapped and returned as column views instead of parsed,
+        # text NS files are parsed into columns of the same types
+        if is_mesh_file(self.ns_path):
+            return read_ns(self.ns_path)
+        
         edge_id_list = [0]
         ise_list = [[0,0,0,0,0]]
         dis_list = [0.0]
@@ -107,8 +118,8 @@ class Solution(ISolution):
                 x_side_list.append(float(rowdata[7].strip()))
                 y_side_list.append(float(rowdata[8].strip()))
                 z_side_list.append(float(rowdata[9].strip()))
-                s_type_list.append(float(rowdata[10].strip()))
-        ns_data = NsData(
+                s_type_list.append(int(float(rowdata[10].strip())))
+        ns_data = ns_from_lists(
             edge_id_list,
             ise_list,
             dis_list,
@@ -1,14 +1,20 @@
 import os
+import time
+import bisect
+import struct
 import logging
+import threading
 import c_two as cc
 import numpy as np
 import pandas as pd
 import pyarrow as pa
 import pyarrow.ipc as ipc
 import multiprocessing as mp
-from functools import partial
-from collections import Counter
-from icrms.itopo import ITopo, GridSchema, GridAttribute, TopoSaveInfo
+from pathlib import Path
+from collections import deque
+from functools import partial, wraps
+from icrms.itopo import ITopo, GridSchema, GridAttributes, GridChanges, GridTopology, TopoSaveInfo
+from src.nh_resource_server.core.mesh import build_mesh_tables, write_mesh_table
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +42,50 @@ GRID_SCHEMA: pa.Schema = pa.schema([
     (ATTR_INDEX_KEY, pa.uint64())
 ])
 
+STORAGE_DATAFRAME = 'dataframe'
+STORAGE_BITSET = 'bitset'
+
+FILE_FORMAT_ARROW = 'arrow'
+FILE_FORMAT_SEGMENT = 'segment'
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZSTD = 'zstd'
+COMPRESSION_LZ4 = 'lz4'
+
+META_GENERATION = 'generation'
+
+EDIT_OP_SUBDIVIDE = 1
+EDIT_OP_MERGE = 2
+EDIT_OP_DELETE = 3
+EDIT_OP_RECOVER = 4
+EDIT_OP_RESTORE_INACTIVE = 5 # undo / redo setting grids inactive
+EDIT_OP_RESTORE_ACTIVE = 6 # undo / redo setting grids active
+EDIT_OP_RESTORE_DELETED = 7 # undo / redo setting grids deleted
+EDIT_LOG_COMPACT_THRESHOLD = 1000000 # number of logged keys above which save() compacts the edit log into the grid file
+
+STATE_INACTIVE = 0 # grid state codes: bit 0 for activate, bit 1 for deleted
+STATE_ACTIVE = 1
+STATE_DELETED = 2
+RESTORE_OPS = {STATE_INACTIVE: EDIT_OP_RESTORE_INACTIVE, STATE_ACTIVE: EDIT_OP_RESTORE_ACTIVE, STATE_DELETED: EDIT_OP_RESTORE_DELETED}
+
+HISTORY_BUDGET = 64 * 1024 * 1024 # default memory budget (bytes) of the undo / redo history
+CHANGE_TRACKER_MAX_KEYS = 4 * 1024 * 1024 # number of tracked changed keys above which the oldest edits are forgotten
+
+MAIN_BRANCH = 'main' # branch editing the grid storage itself, other branches keep deltas over it
+
+TILE_RESOLUTION = 256 # number of grids across a tile edge, finer grids are summarised by their ancestors
+
+def _exclusive(method):
+    """Run a Topo method holding the topo lock, so that autosave snapshots never see a half-applied edit"""
+    @wraps(method)
+    def wrapper(self: 'Topo', *args, **kwargs):
+        with self.lock:
+            result = method(self, *args, **kwargs)
+        if self.autosaver is not None:
+            self.autosaver.notify(self._pending_edits())
+        return result
+    return wrapper
+
 @cc.iicrm
 class Topo(ITopo):
     """
@@ -44,7 +94,7 @@ class Topo(ITopo):
     The Grid Resource.  
     Grid is a 2D grid system that can be subdivided into smaller grids by pre-declared subdivide rules.  
     """
-    def __init__(self, epsg: int, bounds: list, first_size: list[float], subdivide_rules: list[list[int]], grid_file_path: str = ''):
+    def __init__(self, epsg: int, bounds: list, first_size: list[float], subdivide_rules: list[list[int]], grid_file_path: str = '', storage: str = STORAGE_DATAFRAME, lazy_load: bool = False, edit_log: bool = False, history_budget: int = HISTORY_BUDGET, file_format: str = FILE_FORMAT_ARROW, compression: str = COMPRESSION_NONE, autosave_interval: float = 0, autosave_edits: int = 0):
         """Method to initialize Grid
 
         Args:
@@ -53,18 +103,33 @@ class Topo(ITopo):
             first_size (list[float]): [width, height] of the first level grid
             subdivide_rules (list[list[int]]): list of subdivision rules per level
             grid_file_path (str, optional): path to .arrow file containing grid data. If provided, grid data will be loaded from this file
+            storage (str, optional): storage engine of grid states, 'dataframe' (default) or 'bitset'
+            lazy_load (bool, optional): memory-map the grid file and materialize levels only when touched (bitset storage only)
+            edit_log (bool, optional): persist edits in an append-only log next to the grid file, compacted into the grid file on save
+            history_budget (int, optional): memory budget (bytes) of the undo / redo history, 0 to disable undo / redo
+            file_format (str, optional): format the grid file is saved in, 'arrow' (default) or 'segment' (per-level compact segments), both formats are loaded
+            compression (str, optional): compression of segments of the 'segment' format, 'none' (default), 'zstd' or 'lz4'
+            autosave_interval (float, optional): seconds between background saves, 0 (default) to disable
+            autosave_edits (int, optional): number of pending edits triggering a background save, 0 (default) to disable
         """
-        self.dirty = False
+        self.lock = threading.RLock() # held by edits, and by autosave while snapshotting
+        self._write_lock = threading.Lock() # serializes writes of the grid file
+        self.autosaver: Autosaver | None = None
         self.epsg: int = epsg
         self.bounds: list = bounds
         self.first_size: list[float] = first_size
         self.subdivide_rules: list[list[int]] = subdivide_rules
         self.grid_file_path = grid_file_path if grid_file_path != '' else None
-        
-        # Initialize grid DataFrame
-        self.grids = pd.DataFrame(columns=[
-            ATTR_DELETED, ATTR_ACTIVATE, ATTR_INDEX_KEY
-        ])
+        self.lazy_load = lazy_load
+        self.file_format = file_format
+        self.compression = compression
+        self.generation: int | None = 0 # generation of the grid file, increased by each compaction of the edit log
+        self.changes = ChangeTracker(base_version=time.time_ns() // 1000) # edit versions keep increasing across restarts
+        self.active_index: ActiveGridIndex | None = None # built on the first bbox query
+        self.main_edits = 0 # number of edits applied to the main branch
+        self.saved_edits: int | None = None # number of main branch edits persisted in the grid file, None if the grid file is not up to date
+        self.history_budget = history_budget
+        self.history: EditHistory | None = EditHistory(history_budget) if history_budget > 0 else None
         
         # Calculate level info for later use
         self.level_info: list[dict[str, int]] = [{'width': 1, 'height': 1}]
@@ -75,6 +140,21 @@ class Topo(ITopo):
                 'height': prev_height * rule[1]
             })
         
+        # Initialize grid storage
+        self.storage = storage
+        if storage == STORAGE_DATAFRAME:
+            self.store: DataFrameStorage | BitsetStorage = DataFrameStorage()
+        elif storage == STORAGE_BITSET:
+            self.store = BitsetStorage(self.level_info)
+        else:
+            raise ValueError(f'Unknown grid storage engine: {storage}')
+        
+        # Branches share the grid storage (the main branch), self.store is the storage of the checked out branch
+        self.base_store = self.store
+        self.branch = MAIN_BRANCH
+        self.branches: dict[str, BranchStorage] = {}
+        self.branch_histories: dict[str, EditHistory | None] = {} # histories of branches not checked out
+        
         self.grid_definition = {
             'epsg': epsg,
             'bounds': bounds,
@@ -87,14 +167,26 @@ class Topo(ITopo):
             try:
                 # Load grid data from Arrow file
                 self._load_grid_from_file()
+                self.saved_edits = self.main_edits
             except Exception as e:
                 logger.error(f'Failed to load grid data from file: {str(e)}, the grid will be initialized using default method')
+                self.generation = None
                 self._initialize_default_grid()
         else:
             # Initialize grid data using default method
             logger.warning('Grid file does not exist, initializing default grid data...')
             self._initialize_default_grid()
             logger.info('Successfully initialized default grid data')
+        
+        # Replay edits logged since the last compaction
+        self.edit_log: EditLog | None = None
+        self._replaying = False
+        if edit_log and self.grid_file_path:
+            self.edit_log = EditLog(Path(self.grid_file_path).with_suffix('.log'))
+            self._replay_edit_log()
+        
+        if self.grid_file_path and (autosave_interval > 0 or autosave_edits > 0):
+            self.autosaver = Autosaver(self, autosave_interval, autosave_edits)
         logger.info('Grid initialized successfully')
     
     def _save(self) -> dict[str, str | bool]:
@@ -103,45 +195,92 @@ class Topo(ITopo):
             return {'success': False, 'message': 'No file path provided for saving grid data'}
 
         try:
-            if self.grids.empty:
+            if len(self.base_store) == 0:
                 return {'success': False, 'message': 'No grid data to save'}
-
-            # Create file
-            with pa.ipc.new_file(save_path, GRID_SCHEMA) as writer:
-                # Process in batches
-                batch_size = 100000
-                for chunk_start in range(0, len(self.grids), batch_size):
-                    chunk_end = min(chunk_start + batch_size, len(self.grids))
-                    
-                    # Get a slice of the dataframe
-                    chunk = self.grids.iloc[chunk_start:chunk_end]
-                    
-                    # Reset index for just this chunk
-                    chunk_reset = chunk.reset_index(drop=False)
-                    
-                    # Convert to Arrow table and write
-                    table_chunk = pa.Table.from_pandas(chunk_reset, schema=GRID_SCHEMA)
-                    writer.write_table(table_chunk)
-                    
-                    # Explicitly delete temporary objects to free memory
-                    del chunk_reset, table_chunk
+            if self.saved_edits == self.main_edits and os.path.exists(save_path):
+                return {'success': True, 'message': 'No changes to save'}
+
+            with self._write_lock:
+                generation = (self.generation or 0) + 1
+                self._write_grid_file(save_path, generation, self.base_store.iter_batches(batch_size=100000))
+                
+                # Edits are now part of the grid file, start a new edit log generation
+                self.generation = generation
+                self.saved_edits = self.main_edits
+                if self.edit_log is not None:
+                    self.edit_log.reset(generation)
 
             return {'success': True, 'message': f"Successfully saved grid data to {save_path}"}
 
         except Exception as e:
             return {'success': False, 'message': f'Failed to save grid data: {str(e)}'}
 
+    def _write_grid_file(self, save_path: str, generation: int, batches):
+        """Write grid records in batches to a temporary file, then replace the grid file with it"""
+        temp_path = f'{save_path}.tmp'
+        if self.file_format == FILE_FORMAT_SEGMENT:
+            SegmentFile.write(temp_path, generation, batches, self.level_info, self.compression)
+        else:
+            with pa.ipc.new_file(temp_path, GRID_SCHEMA.with_metadata({META_GENERATION: str(generation)})) as writer:
+                for batch in batches:
+                    writer.write(batch)
+        os.replace(temp_path, save_path)
+    
+    def _pending_edits(self) -> int:
+        """Number of main branch edits not saved to the grid file yet, edits of other branches are never saved"""
+        return self.main_edits - (self.saved_edits or 0)
+    
+    def _mark_edit(self, keys: np.ndarray):
+        """Mark keys changed by an edit of the checked out branch"""
+        if len(keys) > 0 and self.branch == MAIN_BRANCH:
+            self.main_edits += 1
+        self.changes.mark(keys)
+    
+    def _autosave(self):
+        """Save the grid data from the autosave thread, holding the topo lock only while snapshotting the grid storage"""
+        if self.edit_log is not None:
+            # Compacting the edit log must not interleave with logged edits, save as a regular edit would
+            with self.lock:
+                result = self.save()
+            logger.info(f'Autosaved grid data: {result.message}')
+            return
+        
+        with self.lock:
+            edits = self.main_edits
+            if self.saved_edits == edits or len(self.base_store) == 0:
+                return
+            # Only copy the storage while holding the lock, edits can go on while the copy is converted and written
+            snapshot = self.base_store.snapshot()
+        
+        with self._write_lock:
+            if self.saved_edits is not None and self.saved_edits >= edits:
+                return # a newer state has been saved meanwhile
+            generation = (self.generation or 0) + 1
+            self._write_grid_file(self.grid_file_path, generation, snapshot.iter_batches(batch_size=100000))
+            self.generation = generation
+            self.saved_edits = edits
+        logger.info(f'Autosaved grid data after {edits} edits to {self.grid_file_path}')
+    
     def terminate(self) -> bool:
         """Save the grid data to Arrow file
         Returns:
             bool: Whether the save was successful
         """
+        if self.autosaver is not None:
+            self.autosaver.stop()
+            self.autosaver = None
+        
         try:
-            if not self._save()['success']:
-                raise Exception('Failed to save grid data')
+            # Compact the edit log into the grid file if any edit has been logged
+            if not self._edits_logged() or self.edit_log.record_count > 0:
+                if not self._save()['success']:
+                    raise Exception('Failed to save grid data')
         except Exception as e:
             logger.error(f'Error saving grid data: {str(e)}')
             return False
+        finally:
+            if self.edit_log is not None:
+                self.edit_log.close()
 
     def _load_grid_from_file(self, batch_size: int = 100000):
         """Load grid data from file streaming
@@ -151,41 +290,115 @@ class Topo(ITopo):
         """
         
         try:
-            all_dfs = []
-            arrow_batches_buffer = []
-            current_rows_in_buffer = 0
+            if self.lazy_load and self.storage != STORAGE_BITSET:
+                logger.warning('Lazy loading is only supported by the bitset storage, loading grid data eagerly')
+            
+            if SegmentFile.is_segment_file(self.grid_file_path):
+                segments = SegmentFile(self.grid_file_path)
+                self.generation = segments.generation
+                if self.lazy_load and self.storage == STORAGE_BITSET:
+                    self.store.attach(self.grid_file_path)
+                    segments.close()
+                    logger.info(f'Memory-mapped grid segments from {self.grid_file_path}, levels will be loaded on demand')
+                    return
+                
+                logger.info(f'Loading grid data from {self.grid_file_path}, Total levels: {len(segments.levels())}')
+                self.store.load_segments(segments)
+                segments.close()
+                logger.info(f'Successfully loaded {len(self.store)} grid records from {self.grid_file_path}')
+                return
             
             with pa.ipc.open_file(self.grid_file_path) as reader:
+                self.generation = _read_generation(reader.schema)
+                if self.lazy_load and self.storage == STORAGE_BITSET:
+                    self.store.attach(self.grid_file_path)
+                    logger.info(f'Memory-mapped grid data from {self.grid_file_path}, levels will be loaded on demand')
+                    return
+                
                 logger.info(f'Loading grid data from {self.grid_file_path}, Total Arrow batches: {reader.num_record_batches}')
-                for i in range(reader.num_record_batches):
-                    batch = reader.get_batch(i)
-                    arrow_batches_buffer.append(batch)
-                    current_rows_in_buffer += batch.num_rows
-                    
-                    if current_rows_in_buffer >= batch_size or (i == reader.num_record_batches - 1 and arrow_batches_buffer):
-                        if arrow_batches_buffer:
-                            logger.debug(f'Processing {len(arrow_batches_buffer)} Arrow batches with {current_rows_in_buffer} rows.')
-                            partial_table = pa.Table.from_batches(arrow_batches_buffer, schema=GRID_SCHEMA)
-                            arrow_batches_buffer = []
-                            current_rows_in_buffer = 0
-                            
-                            partial_df = partial_table.to_pandas(use_threads=True, split_blocks=True, self_destruct=True)
-                            partial_df.set_index(ATTR_INDEX_KEY, inplace=True)
-                            all_dfs.append(partial_df)
-                            logger.debug(f'Append DataFrame chunk. Number of chunks: {len(all_dfs)}')
-                            
-            if all_dfs:
-                logger.info(f'Concatenating {len(all_dfs)} DataFrame chunks...')
-                self.grids = pd.concat(all_dfs, copy=False)
-                self.grids = self.grids.sort_index()
-                logger.info(f'Successfully loaded {len(self.grids)} grid records from {self.grid_file_path}')
+                self.store.load(reader, batch_size)
+                logger.info(f'Successfully loaded {len(self.store)} grid records from {self.grid_file_path}')
             
         except Exception as e:
             logger.error(f'Error loading grid data from file: {str(e)}')
             raise e
 
+    def _replay_edit_log(self):
+        """Replay edits logged against the loaded grid file generation, then open the log for appending"""
+        if self.generation is None:
+            # Grid file failed to load, logged edits can not be applied to the default grid
+            if self.edit_log.exists():
+                orphan_path = self.edit_log.path.with_suffix('.log.orphan')
+                os.replace(self.edit_log.path, orphan_path)
+                logger.error(f'Grid file could not be loaded, edit log moved to {orphan_path}')
+            self.generation = 0
+            self.edit_log.reset(self.generation)
+            return
+        
+        replayed = 0
+        restore_states = {op: state for state, op in RESTORE_OPS.items()}
+        edit_methods = {
+            EDIT_OP_SUBDIVIDE: self.subdivide_grids,
+            EDIT_OP_MERGE: self.merge_multi_grids,
+            EDIT_OP_DELETE: self.delete_grids,
+            EDIT_OP_RECOVER: self.recover_multi_grids,
+        }
+        if self.edit_log.exists() and self.edit_log.read_generation() == self.generation:
+            self._replaying = True
+            try:
+                for op, keys in self.edit_log.read():
+                    if op in restore_states:
+                        self._restore_states(keys, np.full(len(keys), restore_states[op], dtype=np.uint8))
+                    else:
+                        edit_methods[op](*_decode_index_batch(keys))
+                    replayed += 1
+            finally:
+                self._replaying = False
+            self.edit_log.open()
+            logger.info(f'Replayed {replayed} edits from {self.edit_log.path}')
+        else:
+            # No log yet, or a log already compacted into the grid file
+            self.edit_log.reset(self.generation)
+    
+    def _edits_logged(self) -> bool:
+        """Whether edits are persisted by the edit log on top of an existing grid file"""
+        return self.edit_log is not None and os.path.exists(self.grid_file_path)
+    
+    def _record_edit(self, op: int, keys: np.ndarray):
+        """Append an applied edit to the edit log, edits of branches other than main are not persisted"""
+        if self.edit_log is not None and not self._replaying and self.branch == MAIN_BRANCH:
+            self.edit_log.append(op, keys)
+    
+    def _get_state_codes(self, keys: np.ndarray) -> np.ndarray:
+        """Return state codes (bit 0 activate, bit 1 deleted) of keys, STATE_INACTIVE for keys not in the storage"""
+        codes = np.zeros(len(keys), dtype=np.uint8)
+        existing = self.store.contains(keys)
+        if existing.any():
+            activates, deleteds = self.store.get_states(keys[existing])
+            codes[existing] = activates.astype(np.uint8) | (deleteds.astype(np.uint8) << 1)
+        return codes
+    
+    def _begin_edit(self, keys: np.ndarray) -> np.ndarray | None:
+        """Capture states of the keys an edit is about to touch, None if the edit is not recorded in the history"""
+        if self.history is None or self._replaying:
+            return None
+        return self._get_state_codes(keys)
+    
+    def _end_edit(self, keys: np.ndarray, before: np.ndarray | None):
+        """Push the keys flipped by an applied edit to the history"""
+        if before is not None:
+            self.history.push(keys, before, self._get_state_codes(keys))
+    
+    def _restore_states(self, keys: np.ndarray, codes: np.ndarray):
+        """Set states of keys to state codes, as undo / redo and branch commits do, adding keys not in the storage yet"""
+        for code in np.unique(codes):
+            code_keys = keys[codes == code]
+            self.store.add(code_keys, activate=bool(code & STATE_ACTIVE), deleted=bool(code & STATE_DELETED))
+            self._record_edit(RESTORE_OPS[int(code)], code_keys)
+        self._mark_edit(keys)
+    
     def _initialize_default_grid(self):
-        """Initialize grid data (ONLY Level 1) as pandas DataFrame"""
+        """Initialize grid data (ONLY Level 1) in the grid storage"""
         level = 1
         total_width = self.level_info[level]['width']
         total_height = self.level_info[level]['height']
@@ -195,17 +408,7 @@ class Topo(ITopo):
         global_ids = np.arange(num_grids, dtype=np.uint32)
         encoded_indices = _encode_index_batch(levels, global_ids)
         
-        grid_data = {
-            ATTR_ACTIVATE: np.full(num_grids, True),
-            ATTR_DELETED: np.full(num_grids, False, dtype=np.bool_),
-            ATTR_INDEX_KEY: encoded_indices
-        }
-
-        df = pd.DataFrame(grid_data)
-        df.set_index([ATTR_INDEX_KEY], inplace=True)
-
-        self.grids = df
-        self.dirty = True
+        self.store.add(encoded_indices, activate=True, deleted=False)
         print(f'Successfully initialized grid data with {num_grids} grids at level 1')
    
     def _get_local_ids(self, level: int, global_ids: np.ndarray) -> np.ndarray:
@@ -242,6 +445,24 @@ class Topo(ITopo):
         v = global_id // total_width
         return (v // sub_height) * self.level_info[level - 1]['width'] + (u // sub_width)
     
+    def _get_parent_global_ids_batch(self, level: int, global_ids: np.ndarray) -> np.ndarray:
+        """Method to get parent global ids for provided grids having same level
+        
+        Args:
+            level (int): level of provided grids
+            global_ids (np.ndarray): global_ids of provided grids
+        
+        Returns:
+            parent_global_ids (np.ndarray): parent global ids of provided grids
+        """
+        total_width = self.level_info[level]['width']
+        sub_width = self.subdivide_rules[level - 1][0]
+        sub_height = self.subdivide_rules[level - 1][1]
+        global_ids = global_ids.astype(np.int64, copy=False)
+        u = global_ids % total_width
+        v = global_ids // total_width
+        return ((v // sub_height) * self.level_info[level - 1]['width'] + (u // sub_width)).astype(np.uint32)
+    
     def _get_subdivide_rule(self, level: int) -> tuple[int, int]:
         subdivide_rule = self.subdivide_rules[level - 1]
         return subdivide_rule[0], subdivide_rule[1]
@@ -269,7 +490,8 @@ class Topo(ITopo):
         return (min_xs, min_ys, max_xs, max_ys)
 
     def _get_grid_children_global_ids(self, level: int, global_id: int) -> list[int] | None:
-        if (level < 0) or (level >= len(self.level_info)):
+        # Grids of the finest level have no children (the last subdivide rule is always [1, 1])
+        if (level < 0) or (level >= len(self.level_info) - 1):
             return None
         
         width = self.level_info[level]['width']
@@ -291,6 +513,30 @@ class Topo(ITopo):
         
         return child_global_ids
     
+    def _get_children_global_ids_batch(self, level: int, global_ids: np.ndarray) -> np.ndarray:
+        """Method to calculate children global ids for provided grids having same level
+        
+        Args:
+            level (int): level of provided grids
+            global_ids (np.ndarray): global_ids of provided grids
+        
+        Returns:
+            child_global_ids (np.ndarray): array shaped (len(global_ids), sub_width * sub_height), row i holds children of global_ids[i] ordered by local id
+        """
+        width = self.level_info[level]['width']
+        sub_width, sub_height = self.subdivide_rules[level]
+        global_ids = global_ids.astype(np.int64, copy=False)
+        global_us = global_ids % width
+        global_vs = global_ids // width
+        
+        local_ids = np.arange(sub_width * sub_height, dtype=np.int64)
+        local_us = local_ids % sub_width
+        local_vs = local_ids // sub_width
+        
+        sub_global_us = global_us[:, None] * sub_width + local_us[None, :]
+        sub_global_vs = global_vs[:, None] * sub_height + local_vs[None, :]
+        return (sub_global_vs * (width * sub_width) + sub_global_us).astype(np.uint32)
+    
     def get_schema(self) -> GridSchema:
         """Method to get grid schema
 
@@ -305,29 +551,35 @@ class Topo(ITopo):
         )
 
     def get_parents(self, levels: list[int], global_ids: list[int]) -> tuple[list[int], list[int]]:
-        """Method to get parent keys for provided grids having same level
+        """Method to get unique parents of provided grids, grids of level 1 being their own parents
 
         Args:
-            levels (list[int]): levels of provided grids
-            global_ids (list[int]): global_ids of provided grids
+            levels (np.ndarray): levels of provided grids
+            global_ids (np.ndarray): global_ids of provided grids
 
         Returns:
-            multi_parent_info (tuple[list[int], list[int]]): parent levels and global_ids of provided grids
+            multi_parent_info (tuple[np.ndarray, np.ndarray]): parent levels and global_ids of provided grids, deduplicated and sorted by level and global id
         """
-        parent_set: set[tuple[int, int]] = set()
-        for level, global_id in zip(levels, global_ids):
-            if level == 1:
-                parent_set.add((level, global_id))
+        if len(levels) == 0 or len(global_ids) == 0:
+            return _empty_grid_infos()
+        
+        levels_np = np.array(levels, dtype=np.uint8)
+        global_ids_np = np.array(global_ids, dtype=np.uint32)
+        parent_levels = levels_np.copy()
+        parent_global_ids = global_ids_np.copy()
+        
+        # Process according to levels
+        for level in np.unique(levels_np):
+            level = int(level)
+            if level <= 1:
                 continue
-            
-            parent_global_id = self._get_parent_global_id(level, global_id)
-            parent_set.add((level - 1, parent_global_id))
-        if not parent_set:
-            return ([], [])
+            levels_mask = levels_np == level
+            parent_levels[levels_mask] = level - 1
+            parent_global_ids[levels_mask] = self._get_parent_global_ids_batch(level, global_ids_np[levels_mask])
         
-        return tuple(map(list, zip(*parent_set)))
+        return _decode_index_batch(np.unique(_encode_index_batch(parent_levels, parent_global_ids)))
 
-    def get_grid_infos(self, level: int, global_ids: list[int]) -> list[GridAttribute]:
+    def get_grid_infos(self, level: int, global_ids: list[int]) -> GridAttributes:
         """Method to get all attributes for provided grids having same level
 
         Args:
@@ -335,198 +587,365 @@ class Topo(ITopo):
             global_ids (list[int]): global_ids of provided grids
 
         Returns:
-            grid_infos (list[GridAttribute]): grid infos organized by GridAttribute objects with attributes: 
-            level, global_id, local_id, type, elevation, deleted, activate, min_x, min_y, max_x, max_y
+            grid_infos (GridAttributes): columnar grid infos of the existing grids with attributes: 
+            levels, global_ids, local_ids, types, elevations, deleted, activate, min_xs, min_ys, max_xs, max_ys
         """
-        index_keys = [(level, global_id) for global_id in global_ids]
-        filtered_grids = self.grids.loc[self.grids.index.isin(index_keys)]
-        if filtered_grids.empty:
-            return []
+        index_keys = _encode_index_batch(np.full(len(global_ids), level, dtype=np.uint8), np.array(global_ids, dtype=np.uint32))
+        existing_keys = self.store.filter_existing(index_keys)
         
-        global_ids_np = filtered_grids[ATTR_GLOBAL_ID].to_numpy()
+        activates, deleteds = self.store.get_states(existing_keys)
+        _, global_ids_np = _decode_index_batch(existing_keys)
         local_ids = self._get_local_ids(level, global_ids_np)
         min_xs, min_ys, max_xs, max_ys = self._get_coordinates(level, global_ids_np)
         
-        filtered_grids = filtered_grids.copy()
-        filtered_grids[ATTR_LOCAL_ID] = local_ids
-        filtered_grids[ATTR_MIN_X] = min_xs
-        filtered_grids[ATTR_MIN_Y] = min_ys
-        filtered_grids[ATTR_MAX_X] = max_xs
-        filtered_grids[ATTR_MAX_Y] = max_ys
-        
-        levels, global_ids = _decode_index_batch(filtered_grids.index.values)
-        self.dirty = True
-        return [
-            GridAttribute(
-                deleted=row[ATTR_DELETED],
-                activate=row[ATTR_ACTIVATE],
-                type=0,
-                level=levels[i],
-                global_id=global_ids[i],
-                local_id=row[ATTR_LOCAL_ID],
-                elevation=-9999.9,
-                min_x=row[ATTR_MIN_X],
-                min_y=row[ATTR_MIN_Y],
-                max_x=row[ATTR_MAX_X],
-                max_y=row[ATTR_MAX_Y]
-            )
-            for i, (_, row) in enumerate(filtered_grids.iterrows())
-        ]
+        grid_num = len(existing_keys)
+        return GridAttributes(
+            levels=np.full(grid_num, level, dtype=np.uint8),
+            types=np.zeros(grid_num, dtype=np.uint8),
+            activate=activates,
+            deleted=deleteds,
+            elevations=np.full(grid_num, -9999.9, dtype=np.float64),
+            global_ids=global_ids_np,
+            local_ids=local_ids.astype(np.uint32),
+            min_xs=min_xs,
+            min_ys=min_ys,
+            max_xs=max_xs,
+            max_ys=max_ys
+        )
     
+    @_exclusive
     def subdivide_grids(self, levels: list[int], global_ids: list[int]) -> tuple[list[int], list[int]]:
         """
         Subdivide grids by turning off parent grids' activate flag and activating children's activate flags
         if the parent grid is activate and not deleted.
 
         Args:
-            levels (list[int]): Array of levels for each grid to subdivide
-            global_ids (list[int]): Array of global IDs for each grid to subdivide
+            levels (np.ndarray): Array of levels for each grid to subdivide
+            global_ids (np.ndarray): Array of global IDs for each grid to subdivide
 
         Returns:
-            tuple[list[int], list[int]]: The levels and global IDs of the subdivided grids.
+            tuple[np.ndarray, np.ndarray]: The levels and global IDs of the subdivided grids.
         """
-        if not levels or not global_ids:
-            return [], []
+        if len(levels) == 0 or len(global_ids) == 0:
+            return _empty_grid_infos()
         
-        # Get all parents
-        parent_indices = _encode_index_batch(np.array(levels, dtype=np.uint8), np.array(global_ids, dtype=np.uint32))
-        existing_parents = [idx for idx in parent_indices if idx in self.grids.index]
+        # Get all parents (grids of the finest level can not be subdivided)
+        parent_levels = np.array(levels, dtype=np.uint8)
+        parent_global_ids = np.array(global_ids, dtype=np.uint32)
+        subdividable = parent_levels < len(self.level_info) - 1
+        parent_indices = np.unique(_encode_index_batch(parent_levels[subdividable], parent_global_ids[subdividable]))
+        existing_parents = self.store.filter_existing(parent_indices)
         
-        if not existing_parents:
-            return [], []
+        if len(existing_parents) == 0:
+            return _empty_grid_infos()
         
         # Filter for valid parents (activated and not deleted)
-        valid_parents = self.grids.loc[existing_parents]
-        valid_parents = valid_parents[(valid_parents[ATTR_ACTIVATE]) & (~valid_parents[ATTR_DELETED])]
-        if valid_parents.empty:
-            return [], []
-
-        # Collect all child grid information
-        total_children_count = 0
-        for encoded_idx in valid_parents.index:
-            level, _ = _decode_index(encoded_idx)
-            rule = self.subdivide_rules[level]
-            total_children_count += rule[0] * rule[1]
-        
-        # Pre-allocate arrays for all child data
-        all_child_levels = np.empty(total_children_count, dtype=np.uint8)
-        all_child_global_ids = np.empty(total_children_count, dtype=np.uint32)
-        all_child_indices = np.empty(total_children_count, dtype=np.uint64)
-        all_deleted = np.full(total_children_count, False, dtype=np.bool_)
-        all_activate = np.full(total_children_count, True, dtype=np.bool_)
-        
-        # Process each parent grid
-        child_index = 0
-        for encoded_idx in valid_parents.index:
-            level, global_id = _decode_index(encoded_idx)
-            child_global_ids = self._get_grid_children_global_ids(level, global_id)
-            if not child_global_ids:
-                continue
-            
-            child_level = level + 1
-            child_count = len(child_global_ids)
-            end_index = child_index + child_count
-            
-            all_child_levels[child_index:end_index] = child_level
-            all_child_global_ids[child_index:end_index] = child_global_ids
-            child_encoded_indices = _encode_index_batch(
-                np.full(child_count, child_level, dtype=np.uint8),
-                np.array(child_global_ids, dtype=np.uint32)
-            )
-            all_child_indices[child_index:end_index] = child_encoded_indices
-            
-            # Update the current position
-            child_index = end_index
-        
-        # If no children were added, return early
-        if child_index == 0:
-            return [], []
-        
-        # Trim arrays to actual size used
-        if child_index < total_children_count:
-            all_child_levels = all_child_levels[:child_index]
-            all_child_global_ids = all_child_global_ids[:child_index]
-            all_child_indices = all_child_indices[:child_index]
-            all_deleted = all_deleted[:child_index]
-            all_activate = all_activate[:child_index]
-        
-        # Create data for DataFrame construction
-        child_data = {
-            ATTR_DELETED: all_deleted,
-            ATTR_ACTIVATE: all_activate,
-            ATTR_INDEX_KEY: all_child_indices
-        }
+        activates, deleteds = self.store.get_states(existing_parents)
+        valid_parents = existing_parents[activates & ~deleteds]
+        if len(valid_parents) == 0:
+            return _empty_grid_infos()
+
+        # Compute children of all valid parents level by level
+        child_levels_list: list[np.ndarray] = []
+        child_global_ids_list: list[np.ndarray] = []
+        parent_levels, parent_global_ids = _decode_index_batch(valid_parents)
+        for level in np.unique(parent_levels):
+            level = int(level)
+            child_global_ids = self._get_children_global_ids_batch(level, parent_global_ids[parent_levels == level]).ravel()
+            child_levels_list.append(np.full(len(child_global_ids), level + 1, dtype=np.uint8))
+            child_global_ids_list.append(child_global_ids)
         
-        # Make child DataFrame
-        children = pd.DataFrame(child_data, columns=[
-            ATTR_DELETED, ATTR_ACTIVATE, ATTR_INDEX_KEY
-        ])
-        children.set_index(ATTR_INDEX_KEY, inplace=True)
-
-        # Update existing children and add new ones
-        existing_mask = children.index.isin(self.grids.index)
+        all_child_levels = np.concatenate(child_levels_list)
+        all_child_global_ids = np.concatenate(child_global_ids_list)
+        all_child_indices = _encode_index_batch(all_child_levels, all_child_global_ids)
+        touched_indices = np.concatenate([valid_parents, all_child_indices])
+        before = self._begin_edit(touched_indices)
         
-        if existing_mask.any():
-            # Update existing children attributes
-            existing_indices = children.index[existing_mask]
-            self.grids.loc[existing_indices, ATTR_ACTIVATE] = True
-            self.grids.loc[existing_indices, ATTR_DELETED] = False
-            
-            # Add only new children
-            new_children = children.loc[~existing_mask]
-            if not new_children.empty:
-                self.grids = pd.concat([self.grids, new_children])
-        else:
-            # All children are new
-            self.grids = pd.concat([self.grids, children])
+        # Activate children (existing ones are updated, new ones are added)
+        self.store.add(all_child_indices, activate=True, deleted=False)
 
         # Deactivate parent grids
-        self.grids.loc[valid_parents.index, ATTR_ACTIVATE] = False
+        self.store.update(valid_parents, activate=False)
+        self._record_edit(EDIT_OP_SUBDIVIDE, valid_parents)
+        self._end_edit(touched_indices, before)
+        self._mark_edit(touched_indices)
 
-        return all_child_levels.tolist(), all_child_global_ids.tolist()
+        return all_child_levels, all_child_global_ids
     
+    @_exclusive
     def delete_grids(self, levels: list[int], global_ids: list[int]):
         """Method to delete grids.
 
         Args:
-            levels (list[int]): levels of grids to delete
-            global_ids (list[int]): global_ids of grids to delete
+            levels (np.ndarray): levels of grids to delete
+            global_ids (np.ndarray): global_ids of grids to delete
         """
         encoded_indices = _encode_index_batch(np.array(levels, dtype=np.uint8), np.array(global_ids, dtype=np.uint32))
-        existing_grids = [idx for idx in encoded_indices if idx in self.grids.index]
+        existing_grids = self.store.filter_existing(encoded_indices)
         
         if len(existing_grids) == 0:
             return
         
         # Filter for valid grids
-        valid_grids = self.grids.loc[existing_grids]
-        valid_grids = valid_grids[valid_grids[ATTR_ACTIVATE] & (~valid_grids[ATTR_DELETED])]
-        if valid_grids.empty:
+        activates, deleteds = self.store.get_states(existing_grids)
+        valid_grids = existing_grids[activates & ~deleteds]
+        if len(valid_grids) == 0:
             return
         
         # Update deleted status
-        self.grids.loc[valid_grids.index, ATTR_DELETED] = True
-        self.grids.loc[valid_grids.index, ATTR_ACTIVATE] = False
+        before = self._begin_edit(valid_grids)
+        self.store.update(valid_grids, activate=False, deleted=True)
+        self._record_edit(EDIT_OP_DELETE, valid_grids)
+        self._end_edit(valid_grids, before)
+        self._mark_edit(valid_grids)
     
     def get_active_grid_infos(self) -> tuple[list[int], list[int]]:
         """Method to get all active grids' global ids and levels
 
         Returns:
-            tuple[list[int], list[int]]: active grids' global ids and levels
+            tuple[np.ndarray, np.ndarray]: active grids' global ids and levels
         """
-        active_grids = self.grids[self.grids[ATTR_ACTIVATE] == True]
-        levels, global_ids = _decode_index_batch(active_grids.index.values)
-        return levels.tolist(), global_ids.tolist()
+        return _decode_index_batch(self.store.active_keys())
     
     def get_deleted_grid_infos(self) -> tuple[list[int], list[int]]:
         """Method to get all deleted grids' global ids and levels
 
         Returns:
-            tuple[list[int], list[int]]: deleted grids' global ids and levels
+            tuple[np.ndarray, np.ndarray]: deleted grids' global ids and levels
+        """
+        return _decode_index_batch(self.store.deleted_keys())
+    
+    def get_active_grid_infos_in_bbox(self, bbox: list[float]) -> tuple[list[int], list[int]]:
+        """Method to get active grids intersecting a bounding box
+
+        Args:
+            bbox (list[float]): bounding box to query (organized as [min_x, min_y, max_x, max_y])
+        
+        Returns:
+            tuple[np.ndarray, np.ndarray]: levels and global ids of active grids intersecting the bounding box
+        """
+        # The index is refreshed holding the topo lock, so that it never misses an edit applied meanwhile
+        with self.lock:
+            if self.active_index is None or not self.changes.tracks(self.active_index.version):
+                self.active_index = ActiveGridIndex(self.store.active_keys(), self.changes.version)
+            else:
+                changed_keys = self.changes.changed_since(self.active_index.version)
+                activates = (self._get_state_codes(changed_keys) & STATE_ACTIVE) != 0
+                self.active_index.update(changed_keys, activates, self.changes.version)
+            active_index, index_levels = self.active_index, self.active_index.levels()
+        
+        # Clip the bounding box to the grid extent
+        min_x, min_y = max(bbox[0], self.bounds[0]), max(bbox[1], self.bounds[1])
+        max_x, max_y = min(bbox[2], self.bounds[2]), min(bbox[3], self.bounds[3])
+        if min_x > max_x or min_y > max_y:
+            return _empty_grid_infos()
+        
+        levels_list: list[np.ndarray] = []
+        global_ids_list: list[np.ndarray] = []
+        extent_x = self.bounds[2] - self.bounds[0]
+        extent_y = self.bounds[3] - self.bounds[1]
+        for level in index_levels:
+            # Range of global x and y of grids covering the bounding box
+            width = self.level_info[level]['width']
+            height = self.level_info[level]['height']
+            x_start = min(int(np.floor((min_x - self.bounds[0]) / extent_x * width)), width - 1)
+            y_start = min(int(np.floor((min_y - self.bounds[1]) / extent_y * height)), height - 1)
+            x_stop = max(int(np.ceil((max_x - self.bounds[0]) / extent_x * width)), x_start + 1)
+            y_stop = max(int(np.ceil((max_y - self.bounds[1]) / extent_y * height)), y_start + 1)
+            
+            global_ids = active_index.query(level, width, x_start, x_stop, y_start, y_stop)
+            levels_list.append(np.full(len(global_ids), level, dtype=np.uint8))
+            global_ids_list.append(global_ids)
+        
+        if not levels_list:
+            return _empty_grid_infos()
+        return np.concatenate(levels_list), np.concatenate(global_ids_list)
+    
+    def get_active_grid_infos_in_tile(self, z: int, x: int, y: int) -> tuple[list[int], list[int]]:
+        """Method to get active grids intersecting a tile, at the level of detail of the tile
+        
+        Tiles split the grid bounds in 2^z x 2^z tiles at zoom z, x counted from min_x and y counted from max_y.  
+        Active grids finer than the level of detail of the tile (the finest level having at most TILE_RESOLUTION grids across the tile)
+        are summarised by their ancestors at that level.
+
+        Args:
+            z (int): zoom of the tile
+            x (int): column of the tile
+            y (int): row of the tile
+        
+        Returns:
+            tuple[np.ndarray, np.ndarray]: levels and global ids of grids to render in the tile
+        """
+        tile_count = 1 << z
+        tile_width = (self.bounds[2] - self.bounds[0]) / tile_count
+        tile_height = (self.bounds[3] - self.bounds[1]) / tile_count
+        bbox = [
+            self.bounds[0] + x * tile_width,
+            self.bounds[3] - (y + 1) * tile_height,
+            self.bounds[0] + (x + 1) * tile_width,
+            self.bounds[3] - y * tile_height
+        ]
+        levels, global_ids = self.get_active_grid_infos_in_bbox(bbox)
+        
+        # Find the level of detail of the tile
+        lod_level = 1
+        for level in range(1, len(self.level_info)):
+            if max(self.level_info[level]['width'], self.level_info[level]['height']) > TILE_RESOLUTION * tile_count:
+                break
+            lod_level = level
+        
+        fine = levels > lod_level
+        if not fine.any():
+            return levels, global_ids
+        
+        # Replace grids finer than the level of detail with their ancestors
+        fine_levels = levels[fine]
+        fine_global_ids = global_ids[fine]
+        for level in range(int(fine_levels.max()), lod_level, -1):
+            level_mask = fine_levels == level
+            fine_global_ids[level_mask] = self._get_parent_global_ids_batch(level, fine_global_ids[level_mask])
+            fine_levels[level_mask] = level - 1
+        ancestor_keys = np.unique(_encode_index_batch(fine_levels, fine_global_ids))
+        ancestor_levels, ancestor_global_ids = _decode_index_batch(ancestor_keys)
+        
+        return np.concatenate([levels[~fine], ancestor_levels]), np.concatenate([global_ids[~fine], ancestor_global_ids])
+    
+    def get_grid_changes(self, version: int) -> GridChanges:
+        """Method to get grids changed since an edit version
+
+        Args:
+            version (int): edit version the caller is synchronized to
+        
+        Returns:
+            changes (GridChanges): current states of grids changed after the version, 
+            or states of all active and deleted grids (full=True) if the version is not tracked by this topo
+        """
+        full = not self.changes.tracks(version)
+        if full:
+            keys = np.union1d(self.store.active_keys(), self.store.deleted_keys())
+        else:
+            keys = self.changes.changed_since(version)
+        
+        # Grids changed on a branch that is no longer checked out may not exist in the current storage
+        codes = self._get_state_codes(keys)
+        activates, deleteds = (codes & STATE_ACTIVE) != 0, (codes & STATE_DELETED) != 0
+        levels, global_ids = _decode_index_batch(keys)
+        return GridChanges(
+            version=self.changes.version,
+            full=full,
+            levels=levels,
+            global_ids=global_ids,
+            activate=activates,
+            deleted=deleteds
+        )
+    
+    @_exclusive
+    def create_branch(self, name: str) -> TopoSaveInfo:
+        """Method to create a branch of the main branch
+
+        A branch shares the grid storage of the main branch and only keeps the states of grids edited on it.  
+        Branches are kept in memory, edits on them are neither logged nor saved until they are committed.
+
+        Args:
+            name (str): name of the branch
+
+        Returns:
+            TopoSaveInfo: success and message of the operation
+        """
+        if name == MAIN_BRANCH or name in self.branches:
+            return TopoSaveInfo(success=False, message=f'Branch {name} already exists')
+        
+        self.branches[name] = BranchStorage(self.base_store, self.main_edits)
+        self.branch_histories[name] = EditHistory(self.history_budget) if self.history_budget > 0 else None
+        return TopoSaveInfo(success=True, message=f'Branch {name} created')
+    
+    @_exclusive
+    def checkout_branch(self, name: str) -> TopoSaveInfo:
+        """Method to make a branch (or the main branch) the target of all following queries and edits
+
+        Args:
+            name (str): name of the branch
+
+        Returns:
+            TopoSaveInfo: success and message of the operation
+        """
+        if name != MAIN_BRANCH and name not in self.branches:
+            return TopoSaveInfo(success=False, message=f'Branch {name} does not exist')
+        
+        self._switch_branch(name)
+        return TopoSaveInfo(success=True, message=f'Branch {name} checked out')
+    
+    @_exclusive
+    def commit_branch(self, name: str) -> TopoSaveInfo:
+        """Method to apply the edits of a branch to the main branch and remove the branch
+
+        The commit is a single edit of the main branch, which can be undone, and is persisted by the next save.  
+        Other branches see the committed grids they have not edited themselves.  
+        The main branch is checked out if the committed branch was checked out.  
+        A branch whose base is stale (the main branch has been edited since the branch was created) is not committed and kept as is.
+
+        Args:
+            name (str): name of the branch
+
+        Returns:
+            TopoSaveInfo: success and message of the operation
+        """
+        if name not in self.branches:
+            return TopoSaveInfo(success=False, message=f'Branch {name} does not exist')
+        if self.branches[name].base_edits != self.main_edits:
+            return TopoSaveInfo(success=False, message=f'Branch {name} is stale, the main branch has been edited since it was created')
+        
+        current = self.branch if self.branch != name else MAIN_BRANCH
+        self._switch_branch(MAIN_BRANCH)
+        branch = self.branches.pop(name)
+        self.branch_histories.pop(name, None)
+        
+        keys, codes = branch.delta()
+        before = self._begin_edit(keys)
+        self._restore_states(keys, codes)
+        self._end_edit(keys, before)
+        
+        self._switch_branch(current)
+        return TopoSaveInfo(success=True, message=f'Branch {name} committed with {len(keys)} changed grids')
+    
+    @_exclusive
+    def discard_branch(self, name: str) -> TopoSaveInfo:
+        """Method to remove a branch without applying its edits, the main branch is checked out if the branch was checked out
+
+        Args:
+            name (str): name of the branch
+
+        Returns:
+            TopoSaveInfo: success and message of the operation
         """
-        deleted_grids = self.grids[self.grids[ATTR_DELETED] == True]
-        levels, global_ids = _decode_index_batch(deleted_grids.index.values)
-        return levels.tolist(), global_ids.tolist()
+        if name not in self.branches:
+            return TopoSaveInfo(success=False, message=f'Branch {name} does not exist')
+        
+        if self.branch == name:
+            self._switch_branch(MAIN_BRANCH)
+        self.branches.pop(name)
+        self.branch_histories.pop(name, None)
+        return TopoSaveInfo(success=True, message=f'Branch {name} discarded')
+    
+    def get_branches(self) -> list[str]:
+        """Method to get names of all branches, the checked out branch first"""
+        return [self.branch] + [name for name in [MAIN_BRANCH, *self.branches] if name != self.branch]
+    
+    def _switch_branch(self, name: str):
+        """Check out a branch, marking grids whose visible state may change as changed"""
+        if name == self.branch:
+            return
+        
+        switched_keys = [self.store.delta()[0]] if self.branch != MAIN_BRANCH else []
+        self.branch_histories[self.branch] = self.history
+        self.branch = name
+        self.store = self.branches[name] if name != MAIN_BRANCH else self.base_store
+        self.history = self.branch_histories.pop(name)
+        if name != MAIN_BRANCH:
+            switched_keys.append(self.store.delta()[0])
+        
+        if switched_keys:
+            self.changes.mark(np.unique(np.concatenate(switched_keys)))
     
     def get_grid_center(self, level: int, global_id: int) -> tuple[float, float]:
         """Method to get center coordinates of a grid
@@ -541,18 +960,18 @@ class Topo(ITopo):
         min_xs, min_ys, max_xs, max_ys = self._get_coordinates(level, np.array([global_id]))
         return (min_xs[0] + max_xs[0]) / 2, (min_ys[0] + max_ys[0]) / 2
     
-    def get_multi_grid_bboxes(self, levels: list[int], global_ids: list[int]) -> list[float]:
+    def get_multi_grid_bboxes(self, levels: list[int], global_ids: list[int]) -> np.ndarray:
         """Method to get bounding boxes of multiple grids
 
         Args:
-            levels (list[int]): levels of the grids
-            global_ids (list[int]): global ids of the grids
+            levels (np.ndarray): levels of the grids
+            global_ids (np.ndarray): global ids of the grids
 
         Returns:
-            list[float]: list of bounding boxes of the grids, formatted as [grid1_min_x, grid1_min_y, grid1_max_x, grid1_max_y, grid2_min_x, grid2_min_y, grid2_max_x, grid2_max_y, ...]
+            np.ndarray: flat array of bounding boxes of the grids, formatted as [grid1_min_x, grid1_min_y, grid1_max_x, grid1_max_y, grid2_min_x, grid2_min_y, grid2_max_x, grid2_max_y, ...]
         """
-        if not levels or not global_ids:
-            return []
+        if len(levels) == 0 or len(global_ids) == 0:
+            return np.empty(0, dtype=np.float64)
         
         levels_np = np.array(levels, dtype=np.uint8)
         global_ids_np = np.array(global_ids, dtype=np.uint32)
@@ -568,50 +987,28 @@ class Topo(ITopo):
             min_xs, min_ys, max_xs, max_ys = self._get_coordinates(level, current_global_ids)
             result_array[original_indices] = np.column_stack((min_xs, min_ys, max_xs, max_ys))
             
-        return result_array.flatten().tolist()
+        return result_array.ravel()
 
     def get_multi_grid_centers(self, levels: list[int], global_ids: list[int]) -> list[tuple[float, float]]:
         """Method to get center coordinates of multiple grids
 
         Args:
-            levels (list[int]): levels of the grids
-            global_ids (list[int]): global ids of the grids
+            levels (np.ndarray): levels of the grids
+            global_ids (np.ndarray): global ids of the grids
 
         Returns:
-            list[tuple[float, float]]: list of center coordinates of the grids
+            np.ndarray: (n, 2) array of center coordinates of the grids, one (x, y) row per grid, serialized by MultiGridCenters
         """
+        if len(levels) == 0 or len(global_ids) == 0:
+            return np.empty((0, 2), dtype=np.float64)
+        
+        bboxes = self.get_multi_grid_bboxes(levels, global_ids).reshape(-1, 4)
+        centers = np.empty((len(bboxes), 2), dtype=np.float64)
+        centers[:, 0] = (bboxes[:, 0] + bboxes[:, 2]) / 2.0
+        centers[:, 1] = (bboxes[:, 1] + bboxes[:, 3]) / 2.0
+        return centers
 
-        # Group global_ids and their original indices by level
-        level_data_map = {}
-        for i, (level, global_id) in enumerate(zip(levels, global_ids)):
-            if level not in level_data_map:
-                level_data_map[level] = {'ids': [], 'indices': []}
-            level_data_map[level]['ids'].append(global_id)
-            level_data_map[level]['indices'].append(i)
-
-        # Pre-allocate a list to store results in the original order
-        results: list[tuple[float, float]] = [None] * len(levels)
-
-        # Process each group (level)
-        for level, data in level_data_map.items():
-            # Convert the list of global_ids for the current level to a NumPy array
-            g_ids_np = np.array(data['ids'], dtype=np.uint32)
-
-            # Call _get_coordinates once for all global_ids in the current level group
-            min_xs, min_ys, max_xs, max_ys = self._get_coordinates(level, g_ids_np)
-
-            # Calculate center coordinates for all grids in this batch (vectorized operation)
-            center_xs = (min_xs + max_xs) / 2.0
-            center_ys = (min_ys + max_ys) / 2.0
-
-            # Distribute the calculated centers back to the results list
-            # according to their original indices
-            for i in range(len(data['ids'])): # Iterate through items in the current group
-                original_index = data['indices'][i]
-                results[original_index] = (center_xs[i], center_ys[i])
-
-        return results
-
+    @_exclusive
     def merge_multi_grids(self, levels: list[int], global_ids: list[int]) -> tuple[list[int], list[int]]:
         """Merges multiple child grids into their respective parent grid
 
@@ -620,115 +1017,1272 @@ class Topo(ITopo):
         Merging is only possible if all child grids are provided.
 
         Args:
-            levels (list[int]): The levels of the child grids to be merged.
-            global_ids (list[int]): The global IDs of the child grids to be merged.
+            levels (np.ndarray): The levels of the child grids to be merged.
+            global_ids (np.ndarray): The global IDs of the child grids to be merged.
 
         Returns:
-            tuple[list[int], list[int]]: The levels and global IDs of the activated parent grids.
+            tuple[np.ndarray, np.ndarray]: The levels and global IDs of the activated parent grids.
         """
-        if not levels or not global_ids:
-            return [], []
+        if len(levels) == 0 or len(global_ids) == 0:
+            return _empty_grid_infos()
         
-        # Get all parent candidates from the provided child grids
-        parent_candidates: list[tuple[int, int]] = []
-        for level, global_id in zip(levels, global_ids):
-            if level == 1:
-                continue
-            else:
-                parent_level = level - 1
-                parent_global_id = self._get_parent_global_id(level, global_id)
-                parent_candidates.append((parent_level, parent_global_id))
-        if not parent_candidates:
-            return [], []
+        # Get all parent candidates from the provided child grids (grids of level 1 have no parent to merge into)
+        child_levels = np.array(levels, dtype=np.uint8)
+        child_global_ids = np.array(global_ids, dtype=np.uint32)
+        mergeable = child_levels > 1
+        child_indices = np.unique(_encode_index_batch(child_levels[mergeable], child_global_ids[mergeable]))
+        if len(child_indices) == 0:
+            return _empty_grid_infos()
+        
+        child_levels, child_global_ids = _decode_index_batch(child_indices)
+        parent_candidates = np.empty(len(child_indices), dtype=np.uint64)
+        for level in np.unique(child_levels):
+            level = int(level)
+            level_mask = child_levels == level
+            parent_global_ids = self._get_parent_global_ids_batch(level, child_global_ids[level_mask])
+            parent_candidates[level_mask] = _encode_index_batch(np.full(len(parent_global_ids), level - 1, dtype=np.uint8), parent_global_ids)
         
         # Get parents indicies if all children are provided
-        parent_indices_to_activate = []
-        parent_count = Counter(parent_candidates)
-        activated_parents: list[tuple[int, int]] = []
-        for (parent_level, parent_global_id), count in parent_count.items():
-            sub_width, sub_height = self.subdivide_rules[parent_level]
-            expected_children_count = sub_width * sub_height
-            
-            if count == expected_children_count:
-                encoded_idx = _encode_index(parent_level, parent_global_id)
-                if encoded_idx in self.grids.index:
-                    parent_indices_to_activate.append(encoded_idx)
-                    activated_parents.append((parent_level, parent_global_id))
-
-        if not activated_parents:
-            return [], []
+        parent_indices, parent_counts = np.unique(parent_candidates, return_counts=True)
+        parent_levels, _ = _decode_index_batch(parent_indices)
+        expected_children_counts = np.array([rule[0] * rule[1] for rule in self.subdivide_rules], dtype=np.int64)
+        complete_parents = parent_indices[parent_counts == expected_children_counts[parent_levels]]
+        activated_parents = self.store.filter_existing(complete_parents)
+        if len(activated_parents) == 0:
+            return _empty_grid_infos()
+        
+        # Find all existing children of activated parents
+        parent_levels, parent_global_ids = _decode_index_batch(activated_parents)
+        children_indices_list: list[np.ndarray] = []
+        for level in np.unique(parent_levels):
+            level = int(level)
+            theoretical_child_global_ids = self._get_children_global_ids_batch(level, parent_global_ids[parent_levels == level]).ravel()
+            children_indices_list.append(_encode_index_batch(np.full(len(theoretical_child_global_ids), level + 1, dtype=np.uint8), theoretical_child_global_ids))
+        children_indices_to_deactivate = self.store.filter_existing(np.concatenate(children_indices_list))
+        touched_indices = np.concatenate([activated_parents, children_indices_to_deactivate])
+        before = self._begin_edit(touched_indices)
         
         # Batch activate parent grids
-        if parent_indices_to_activate:
-            self.grids.loc[parent_indices_to_activate, ATTR_ACTIVATE] = True
-        
-        # Get all children of activated parents
-        children_indices_to_deactivate = []
-        for parent_level, parent_global_id in activated_parents:
-            child_level_of_activated_parent = parent_level + 1
-            theoretical_child_global_ids = self._get_grid_children_global_ids(parent_level, parent_global_id)
-            if theoretical_child_global_ids:
-                for child_global_id in theoretical_child_global_ids:
-                    encoded_idx = _encode_index(child_level_of_activated_parent, child_global_id)
-                    if encoded_idx in self.grids.index:
-                        children_indices_to_deactivate.append(encoded_idx)
-        
-        # Batch deactivate child grids
-        if children_indices_to_deactivate:
-            unique_children_indices = list(set(children_indices_to_deactivate))
-            if unique_children_indices:
-                 self.grids.loc[unique_children_indices, ATTR_ACTIVATE] = False
-        
-        result_levels, result_global_ids = zip(*activated_parents)
-        return list(result_levels), list(result_global_ids)
+        self.store.update(activated_parents, activate=True)
+        
+        # Batch deactivate all existing children of activated parents
+        if len(children_indices_to_deactivate) > 0:
+            self.store.update(children_indices_to_deactivate, activate=False)
+        self._record_edit(EDIT_OP_MERGE, child_indices)
+        self._end_edit(touched_indices, before)
+        self._mark_edit(touched_indices)
+        
+        return parent_levels, parent_global_ids
     
+    @_exclusive
     def recover_multi_grids(self, levels: list[int], global_ids: list[int]):
         """Recovers multiple deleted grids by activating them
 
         Args:
-            levels (list[int]): The levels of the grids to be recovered.
-            global_ids (list[int]): The global IDs of the grids to be recovered.
+            levels (np.ndarray): The levels of the grids to be recovered.
+            global_ids (np.ndarray): The global IDs of the grids to be recovered.
         """
-        if not levels or not global_ids:
+        if len(levels) == 0 or len(global_ids) == 0:
             return
         
         # Get all indices to recover
         encoded_indices = _encode_index_batch(np.array(levels, dtype=np.uint8), np.array(global_ids, dtype=np.uint32))
-        existing_grids = [idx for idx in encoded_indices if idx in self.grids.index]
+        existing_grids = self.store.filter_existing(encoded_indices)
         
         if len(existing_grids) == 0:
             return
         
         # Activate these grids
-        self.grids.loc[existing_grids, ATTR_ACTIVATE] = True
-        self.grids.loc[existing_grids, ATTR_DELETED] = False
+        before = self._begin_edit(existing_grids)
+        self.store.update(existing_grids, activate=True, deleted=False)
+        self._record_edit(EDIT_OP_RECOVER, existing_grids)
+        self._end_edit(existing_grids, before)
+        self._mark_edit(existing_grids)
+    
+    @_exclusive
+    def undo(self) -> GridChanges:
+        """Method to revert the last edit (subdivide, merge, delete or recover) kept in the history
+
+        Returns:
+            changes (GridChanges): grids flipped back by the undo with their current states, empty if there is nothing to undo
+        """
+        entry = self.history.pop_undo() if self.history is not None else None
+        if entry is None:
+            return self._get_flipped_changes(np.empty(0, dtype=np.uint64))
+        
+        keys, before, _ = entry
+        self._restore_states(keys, before)
+        return self._get_flipped_changes(keys)
+    
+    @_exclusive
+    def redo(self) -> GridChanges:
+        """Method to reapply the last undone edit, the redo history is cleared by any new edit
+
+        Returns:
+            changes (GridChanges): grids flipped again by the redo with their current states, empty if there is nothing to redo
+        """
+        entry = self.history.pop_redo() if self.history is not None else None
+        if entry is None:
+            return self._get_flipped_changes(np.empty(0, dtype=np.uint64))
+        
+        keys, _, after = entry
+        self._restore_states(keys, after)
+        return self._get_flipped_changes(keys)
+    
+    def _get_flipped_changes(self, keys: np.ndarray) -> GridChanges:
+        codes = self._get_state_codes(keys)
+        levels, global_ids = _decode_index_batch(keys)
+        return GridChanges(
+            version=self.changes.version,
+            full=False,
+            levels=levels,
+            global_ids=global_ids,
+            activate=(codes & STATE_ACTIVE) != 0,
+            deleted=(codes & STATE_DELETED) != 0
+        )
 
+    @_exclusive
     def save(self) -> TopoSaveInfo:
         """
         Save the grid data to an Arrow file with optimized memory usage.
-        This method writes the grid dataframe to disk using Apache Arrow format.
+        This method writes the grid storage to disk using Apache Arrow format.
         It processes the data in batches to minimize memory consumption during saving.
         Returns:
             SaveInfo: An object containing:
                 - 'success': Boolean indicating success (True) or failure (False)
                 - 'message': A string with details about the operation result
+        When the edit log is enabled, edits are already persisted by the log, so the grid file is only
+        rewritten (compacting the log) once the log holds more than EDIT_LOG_COMPACT_THRESHOLD keys.
         Error conditions:
             - Returns failure if no file path is set
-            - Returns failure if the grid dataframe is empty
+            - Returns failure if the grid storage is empty
             - Returns failure with exception details if any error occurs during saving
         """
+        if self._edits_logged() and self.edit_log.key_count < EDIT_LOG_COMPACT_THRESHOLD:
+            self.edit_log.sync()
+            return TopoSaveInfo(
+                success=True,
+                message=f'{self.edit_log.record_count} edits are persisted in edit log {self.edit_log.path}'
+            )
+        
         save_info_dict = self._save()
         save_info = TopoSaveInfo(
             success=save_info_dict.get('success', False),
             message=save_info_dict.get('message', '')
         )
         return save_info
+    
+    def get_topology(self) -> GridTopology:
+        """Method to get neighbours and shared edges of all active grids across levels
+
+        Grids are placed on the integer lattice of the finest level, where a side of a grid spans [start, stop) on a vertical or horizontal line.  
+        Lines are cut into segments at every side end, each segment is matched to the grid ending on its line (west / south side)
+        and to the grid starting on it (east / north side), and consecutive segments shared by the same pair of grids are merged into an edge.  
+        Active grids may overlap, e.g. a parent recovered while some of its children are still active.
+        The coarsest active grid wins: active grids lying inside another active grid are left out of the topology.
+
+        Returns:
+            topology (GridTopology): active grids and their edges, edges refer to grids by position, -1 standing for no grid
+        """
+        levels, global_ids = self.get_active_grid_infos()
+        covered = self._covered_by_active_ancestors(levels, global_ids)
+        if covered.any():
+            logger.warning(f'Leaving {int(covered.sum())} active grids covered by active ancestors out of the topology')
+            levels, global_ids = levels[~covered], global_ids[~covered]
+        
+        # Extents of grids in units of finest level grids
+        finest_info = self.level_info[-1]
+        scale_xs = np.array([finest_info['width'] // info['width'] for info in self.level_info], dtype=np.int64)
+        scale_ys = np.array([finest_info['height'] // info['height'] for info in self.level_info], dtype=np.int64)
+        widths = np.array([info['width'] for info in self.level_info], dtype=np.int64)
+        global_xs = global_ids.astype(np.int64) % widths[levels]
+        global_ys = global_ids.astype(np.int64) // widths[levels]
+        min_xs, max_xs = global_xs * scale_xs[levels], (global_xs + 1) * scale_xs[levels]
+        min_ys, max_ys = global_ys * scale_ys[levels], (global_ys + 1) * scale_ys[levels]
+        grids = np.arange(len(levels), dtype=np.int64)
+        
+        # Vertical edges lie on east sides of west grids and west sides of east grids, horizontal edges likewise
+        v_lines, v_starts, v_stops, v_grids_a, v_grids_b = _match_sides(max_xs, min_ys, max_ys, min_xs, min_ys, max_ys, grids)
+        h_lines, h_starts, h_stops, h_grids_a, h_grids_b = _match_sides(max_ys, min_xs, max_xs, min_ys, min_xs, max_xs, grids)
+        
+        unit_x = (self.bounds[2] - self.bounds[0]) / finest_info['width']
+        unit_y = (self.bounds[3] - self.bounds[1]) / finest_info['height']
+        return GridTopology(
+            levels=levels,
+            global_ids=global_ids,
+            edge_directions=np.concatenate([np.zeros(len(v_lines), dtype=np.uint8), np.ones(len(h_lines), dtype=np.uint8)]),
+            edge_grids_a=np.concatenate([v_grids_a, h_grids_a]).astype(np.int32),
+            edge_grids_b=np.concatenate([v_grids_b, h_grids_b]).astype(np.int32),
+            edge_min_xs=self.bounds[0] + np.concatenate([v_lines, h_starts]) * unit_x,
+            edge_min_ys=self.bounds[1] + np.concatenate([v_starts, h_lines]) * unit_y,
+            edge_max_xs=self.bounds[0] + np.concatenate([v_lines, h_stops]) * unit_x,
+            edge_max_ys=self.bounds[1] + np.concatenate([v_stops, h_lines]) * unit_y
+        )
+
+    def _covered_by_active_ancestors(self, levels: np.ndarray, global_ids: np.ndarray) -> np.ndarray:
+        """Return a boolean mask telling which of the given grids have an active ancestor"""
+        active_keys = self.store.active_keys()
+        covered = np.zeros(len(levels), dtype=np.bool_)
+        ancestor_levels = levels.astype(np.int64)
+        ancestor_ids = global_ids.astype(np.uint32)
+        for level in range(len(self.level_info) - 1, 0, -1):
+            at_level = ancestor_levels == level
+            if not at_level.any():
+                continue
+            ancestor_ids[at_level] = self._get_parent_global_ids_batch(level, ancestor_ids[at_level])
+            ancestor_levels[at_level] = level - 1
+            ancestor_keys = _encode_index_batch(np.full(at_level.sum(), level - 1, dtype=np.uint8), ancestor_ids[at_level])
+            covered[at_level] |= np.isin(ancestor_keys, active_keys, assume_unique=True)
+        return covered
+
+    def export_mesh(self, ne_path: str, ns_path: str) -> TopoSaveInfo:
+        """Method to write the NE (grid) and NS (edge) tables of active grids for solutions
+
+        Tables are built from the topology of active grids and written as Arrow IPC files, which Solution memory-maps in place of text NE / NS files.
+
+        Args:
+            ne_path (str): path of the NE file to write
+            ns_path (str): path of the NS file to write
+
+        Returns:
+            TopoSaveInfo: success and message of the export
+        """
+        try:
+            topology = self.get_topology()
+            bboxes = self.get_multi_grid_bboxes(topology.levels, topology.global_ids)
+            ne_table, ns_table = build_mesh_tables(topology, bboxes)
+            write_mesh_table(ne_table, ne_path)
+            write_mesh_table(ns_table, ns_path)
+            return TopoSaveInfo(
+                success=True,
+                message=f'Exported {ne_table.num_rows - 1} grids to {ne_path} and {ns_table.num_rows - 1} edges to {ns_path}'
+            )
+        
+        except Exception as e:
+            return TopoSaveInfo(success=False, message=f'Failed to export mesh: {str(e)}')
+
+# Storage ##################################################
+
+class DataFrameStorage:
+    """
+    Grid states kept in a pandas DataFrame indexed by encoded index keys.  
+    Only grids that have ever been created (by initialization or subdivision) have a row.
+    """
+    def __init__(self):
+        self.grids = pd.DataFrame(
+            {ATTR_DELETED: pd.Series(dtype=np.bool_), ATTR_ACTIVATE: pd.Series(dtype=np.bool_)},
+            index=pd.Index([], dtype=np.uint64, name=ATTR_INDEX_KEY)
+        )
+    
+    def __len__(self) -> int:
+        return len(self.grids)
+    
+    def __contains__(self, key: np.uint64) -> bool:
+        return key in self.grids.index
+    
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """Return row positions of keys, -1 for keys not in the storage (uses the hash engine cached by the index)"""
+        return self.grids.index.get_indexer(np.asarray(keys, dtype=np.uint64))
+    
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Return a boolean mask telling which keys have a record in the storage"""
+        if len(keys) == 0 or self.grids.empty:
+            return np.zeros(len(keys), dtype=np.bool_)
+        return self._positions(keys) >= 0
+    
+    def filter_existing(self, keys: np.ndarray) -> np.ndarray:
+        """Return the keys that have a record in the storage"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        return keys[self.contains(keys)]
+    
+    def get_states(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return (activate, deleted) flags of existing keys"""
+        positions = self._positions(keys)
+        return self.grids[ATTR_ACTIVATE].to_numpy(dtype=np.bool_)[positions], self.grids[ATTR_DELETED].to_numpy(dtype=np.bool_)[positions]
+    
+    def update(self, keys: np.ndarray, activate: bool | None = None, deleted: bool | None = None):
+        """Update flags of existing keys, flags set to None are left unchanged"""
+        positions = self._positions(keys)
+        if activate is not None:
+            self.grids.iloc[positions, self.grids.columns.get_loc(ATTR_ACTIVATE)] = activate
+        if deleted is not None:
+            self.grids.iloc[positions, self.grids.columns.get_loc(ATTR_DELETED)] = deleted
+    
+    def add(self, keys: np.ndarray, activate: bool, deleted: bool):
+        """Set flags of keys, adding records for keys not in the storage yet"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        existing_mask = self.contains(keys)
+        if existing_mask.any():
+            self.update(keys[existing_mask], activate=activate, deleted=deleted)
+        
+        new_keys = keys[~existing_mask]
+        if len(new_keys) == 0:
+            return
+        
+        new_grids = pd.DataFrame(
+            {
+                ATTR_DELETED: np.full(len(new_keys), deleted, dtype=np.bool_),
+                ATTR_ACTIVATE: np.full(len(new_keys), activate, dtype=np.bool_)
+            },
+            index=pd.Index(new_keys, dtype=np.uint64, name=ATTR_INDEX_KEY)
+        )
+        self.grids = new_grids if self.grids.empty else pd.concat([self.grids, new_grids])
+    
+    def active_keys(self) -> np.ndarray:
+        return self.grids.index.values[self.grids[ATTR_ACTIVATE].to_numpy(dtype=np.bool_)]
+    
+    def deleted_keys(self) -> np.ndarray:
+        return self.grids.index.values[self.grids[ATTR_DELETED].to_numpy(dtype=np.bool_)]
+    
+    def snapshot(self) -> 'DataFrameStorage':
+        """Return a copy of the storage sharing no data with it"""
+        copied = DataFrameStorage()
+        copied.grids = self.grids.copy()
+        return copied
+    
+    def load(self, reader: ipc.RecordBatchFileReader, batch_size: int):
+        """Load grid records from an Arrow file reader"""
+        all_dfs = []
+        arrow_batches_buffer = []
+        current_rows_in_buffer = 0
+        
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            arrow_batches_buffer.append(batch)
+            current_rows_in_buffer += batch.num_rows
+            
+            if current_rows_in_buffer >= batch_size or (i == reader.num_record_batches - 1 and arrow_batches_buffer):
+                if arrow_batches_buffer:
+                    logger.debug(f'Processing {len(arrow_batches_buffer)} Arrow batches with {current_rows_in_buffer} rows.')
+                    partial_table = pa.Table.from_batches(arrow_batches_buffer, schema=GRID_SCHEMA)
+                    arrow_batches_buffer = []
+                    current_rows_in_buffer = 0
+                    
+                    partial_df = partial_table.to_pandas(use_threads=True, split_blocks=True, self_destruct=True)
+                    partial_df.set_index(ATTR_INDEX_KEY, inplace=True)
+                    all_dfs.append(partial_df)
+                    logger.debug(f'Append DataFrame chunk. Number of chunks: {len(all_dfs)}')
+        
+        if all_dfs:
+            logger.info(f'Concatenating {len(all_dfs)} DataFrame chunks...')
+            self.grids = pd.concat(all_dfs)
+            self.grids = self.grids.sort_index()
+    
+    def load_segments(self, segments: 'SegmentFile'):
+        """Load grid records from a segment file"""
+        level_dfs = []
+        for level in segments.levels():
+            ids, activates, deleteds = segments.read_level(level)
+            level_dfs.append(pd.DataFrame(
+                {ATTR_DELETED: deleteds, ATTR_ACTIVATE: activates},
+                index=pd.Index(_encode_index_batch(np.full(len(ids), level, dtype=np.uint8), ids), dtype=np.uint64, name=ATTR_INDEX_KEY)
+            ))
+        if level_dfs:
+            self.grids = pd.concat(level_dfs)
+    
+    def iter_batches(self, batch_size: int):
+        """Yield grid records as Arrow tables of GRID_SCHEMA"""
+        for chunk_start in range(0, len(self.grids), batch_size):
+            chunk_end = min(chunk_start + batch_size, len(self.grids))
+            
+            # Get a slice of the dataframe and reset index for just this chunk
+            chunk_reset = self.grids.iloc[chunk_start:chunk_end].reset_index(drop=False)
+            yield pa.Table.from_pandas(chunk_reset, schema=GRID_SCHEMA, preserve_index=False)
+
+class Bitset:
+    """Dense bitset over the id space [0, size), packed 8 ids per byte"""
+    def __init__(self, size: int):
+        self.size = size
+        self.words = np.zeros((size + 7) >> 3, dtype=np.uint8)
+    
+    def get(self, ids: np.ndarray) -> np.ndarray:
+        ids = ids.astype(np.int64, copy=False)
+        return ((self.words[ids >> 3] >> (ids & 7).astype(np.uint8)) & 1).astype(np.bool_)
+    
+    def set(self, ids: np.ndarray):
+        ids = ids.astype(np.int64, copy=False)
+        np.bitwise_or.at(self.words, ids >> 3, np.left_shift(1, ids & 7).astype(np.uint8))
+    
+    def clear(self, ids: np.ndarray):
+        ids = ids.astype(np.int64, copy=False)
+        np.bitwise_and.at(self.words, ids >> 3, ~np.left_shift(1, ids & 7).astype(np.uint8))
+    
+    def assign(self, ids: np.ndarray, value: bool):
+        if value:
+            self.set(ids)
+        else:
+            self.clear(ids)
+    
+    def count(self) -> int:
+        return int(np.bitwise_count(self.words).sum())
+    
+    def copy(self) -> 'Bitset':
+        copied = Bitset(0)
+        copied.size, copied.words = self.size, self.words.copy()
+        return copied
+    
+    def nonzero(self) -> np.ndarray:
+        """Return the sorted ids of all set bits"""
+        non_empty = np.flatnonzero(self.words)
+        if len(non_empty) == 0:
+            return np.empty(0, dtype=np.int64)
+        bits = np.unpackbits(self.words[non_empty, None], axis=1, bitorder='little')
+        rows, cols = np.nonzero(bits)
+        return non_empty[rows] * 8 + cols
+
+class BitsetStorage:
+    """
+    Grid states kept in dense per-level bitsets sized by the level's width x height.  
+    Each level has a `present` bitset (the grid has been created), an `activate` bitset and a `deleted` bitset,
+    so that membership tests and state changes are bit operations without any reindexing.  
+    Bitsets of a level are allocated the first time a grid of the level is created.  
+    When attached to a memory-mapped grid file, a level is only materialized into bitsets when it is first touched.  
+    Levels may be materialized by readers running concurrently with the topo lock holder (e.g. autosave),
+    so the level tables and the source are guarded by the storage lock, and the source is only released once no reader holds it.
+    """
+    def __init__(self, level_info: list[dict[str, int]]):
+        self.level_info = level_info
+        self.lock = threading.RLock() # guards level tables and the memory-mapped source
+        self.present: dict[int, Bitset] = {}
+        self.activate: dict[int, Bitset] = {}
+        self.deleted: dict[int, Bitset] = {}
+        
+        # Memory-mapped source of levels not materialized yet
+        self.source: ipc.RecordBatchFileReader | None = None
+        self.source_file: pa.MemoryMappedFile | None = None
+        self.source_batches: dict[int, list[int]] = {} # level -> indices of source batches holding records of the level
+        self.source_segments: SegmentFile | None = None # segment file source, read per level
+        self.source_counts: dict[int, int] = {} # level -> record count of the level in source
+    
+    def __len__(self) -> int:
+        with self.lock:
+            return sum(bits.count() for bits in self.present.values()) + sum(self.source_counts.values())
+    
+    def __contains__(self, key: np.uint64) -> bool:
+        level, global_id = _decode_index(key)
+        self._materialize(level)
+        bits = self.present.get(level)
+        return bits is not None and global_id < bits.size and bool(bits.get(np.array([global_id]))[0])
+    
+    def _ensure_level(self, level: int):
+        if level in self.present:
+            return
+        if level < 0 or level >= len(self.level_info):
+            raise ValueError(f'Level {level} is out of the grid hierarchy')
+        size = self.level_info[level]['width'] * self.level_info[level]['height']
+        with self.lock:
+            if level in self.present:
+                return
+            # activate and deleted bitsets exist before the level shows up in present
+            self.activate[level] = Bitset(size)
+            self.deleted[level] = Bitset(size)
+            self.present[level] = Bitset(size)
+    
+    def _group_by_level(self, keys: np.ndarray):
+        """Yield (level, positions in keys, global ids) for each level in keys, materializing touched levels"""
+        levels, global_ids = _decode_index_batch(keys)
+        for level in np.unique(levels):
+            level = int(level)
+            self._materialize(level)
+            positions = np.flatnonzero(levels == level)
+            yield level, positions, global_ids[positions].astype(np.int64)
+    
+    def _read_source(self, level: int):
+        """Yield (global ids, activate flags, deleted flags) of records of a level stored in the memory-mapped source"""
+        if self.source_segments is not None:
+            yield self.source_segments.read_level(level)
+            return
+        
+        for batch_index in self.source_batches[level]:
+            batch = self.source.get_batch(batch_index)
+            keys = batch.column(ATTR_INDEX_KEY).to_numpy()
+            level_mask = (keys >> np.uint64(32)) == level
+            yield (
+                (keys[level_mask] & np.uint64(0xFFFFFFFF)).astype(np.int64),
+                batch.column(ATTR_ACTIVATE).to_numpy(zero_copy_only=False)[level_mask],
+                batch.column(ATTR_DELETED).to_numpy(zero_copy_only=False)[level_mask]
+            )
+    
+    def _materialize(self, level: int):
+        """Fill bitsets of a level from the memory-mapped source if it has not been touched yet"""
+        if level not in self.source_counts:
+            return
+        
+        with self.lock:
+            if level not in self.source_counts:
+                return # materialized by another thread meanwhile
+            
+            self._ensure_level(level)
+            for ids, activates, deleteds in self._read_source(level):
+                self.present[level].set(ids)
+                self.activate[level].set(ids[activates])
+                self.deleted[level].set(ids[deleteds])
+            self.source_batches.pop(level, None)
+            del self.source_counts[level]
+            logger.debug(f'Materialized grid level {level} from memory-mapped source')
+            
+            if not self.source_counts:
+                self._release_source()
+    
+    def _release_source(self):
+        """Close the memory-mapped source, called holding the storage lock"""
+        self.source = None
+        if self.source_file is not None:
+            self.source_file.close()
+            self.source_file = None
+        if self.source_segments is not None:
+            self.source_segments.close()
+            self.source_segments = None
+        self.source_batches.clear()
+        self.source_counts.clear()
+    
+    def attach(self, file_path: str):
+        """Memory-map a grid file as the lazy source of grid records
+        
+        Only the index keys (or the level table of a segment file) are scanned to know which batches hold which levels, no level is materialized.
+        """
+        if SegmentFile.is_segment_file(file_path):
+            self.source_segments = SegmentFile(file_path)
+            for level in self.source_segments.levels():
+                if level >= len(self.level_info):
+                    logger.warning(f'Skipping {self.source_segments.count(level)} grid records of level {level} beyond the grid hierarchy')
+                    continue
+                self.source_counts[level] = self.source_segments.count(level)
+            if not self.source_counts:
+                self._release_source()
+            return
+        
+        self.source_file = pa.memory_map(str(file_path), 'r')
+        self.source = ipc.open_file(self.source_file)
+        for batch_index in range(self.source.num_record_batches):
+            keys = self.source.get_batch(batch_index).column(ATTR_INDEX_KEY).to_numpy()
+            level_counts = np.bincount((keys >> np.uint64(32)).astype(np.int64))
+            for level in np.flatnonzero(level_counts):
+                level = int(level)
+                if level >= len(self.level_info):
+                    logger.warning(f'Skipping {level_counts[level]} grid records of level {level} beyond the grid hierarchy')
+                    continue
+                self.source_batches.setdefault(level, []).append(batch_index)
+                self.source_counts[level] = self.source_counts.get(level, 0) + int(level_counts[level])
+        
+        if not self.source_counts:
+            self._release_source()
+    
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Return a boolean mask telling which keys have been created in the storage"""
+        mask = np.zeros(len(keys), dtype=np.bool_)
+        for level, positions, ids in self._group_by_level(keys):
+            bits = self.present.get(level)
+            if bits is None:
+                continue
+            in_range = ids < bits.size
+            mask[positions[in_range]] = bits.get(ids[in_range])
+        return mask
+    
+    def filter_existing(self, keys: np.ndarray) -> np.ndarray:
+        """Return the keys that have been created in the storage"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        return keys[self.contains(keys)]
+    
+    def get_states(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return (activate, deleted) flags of existing keys"""
+        activates = np.zeros(len(keys), dtype=np.bool_)
+        deleteds = np.zeros(len(keys), dtype=np.bool_)
+        for level, positions, ids in self._group_by_level(keys):
+            activates[positions] = self.activate[level].get(ids)
+            deleteds[positions] = self.deleted[level].get(ids)
+        return activates, deleteds
+    
+    def update(self, keys: np.ndarray, activate: bool | None = None, deleted: bool | None = None):
+        """Update flags of existing keys, flags set to None are left unchanged"""
+        for level, _, ids in self._group_by_level(keys):
+            if activate is not None:
+                self.activate[level].assign(ids, activate)
+            if deleted is not None:
+                self.deleted[level].assign(ids, deleted)
+    
+    def add(self, keys: np.ndarray, activate: bool, deleted: bool):
+        """Set flags of keys, creating keys not in the storage yet"""
+        for level, _, ids in self._group_by_level(keys):
+            self._ensure_level(level)
+            self.present[level].set(ids)
+            self.activate[level].assign(ids, activate)
+            self.deleted[level].assign(ids, deleted)
+    
+    def _keys_of(self, attr: str) -> np.ndarray:
+        bitsets = self.activate if attr == ATTR_ACTIVATE else self.deleted
+        all_keys = []
+        with self.lock:
+            levels = sorted(set(self.present) | set(self.source_counts))
+        for level in levels:
+            with self.lock:
+                # Serve levels not materialized yet straight from the memory-mapped source
+                source_ids = [
+                    ids[activates if attr == ATTR_ACTIVATE else deleteds]
+                    for ids, activates, deleteds in self._read_source(level)
+                ] if level in self.source_counts else None
+            ids = np.sort(np.concatenate(source_ids)) if source_ids is not None else bitsets[level].nonzero()
+            all_keys.append(_encode_index_batch(np.full(len(ids), level, dtype=np.uint8), ids))
+        return np.concatenate(all_keys) if all_keys else np.empty(0, dtype=np.uint64)
+    
+    def active_keys(self) -> np.ndarray:
+        return self._keys_of(ATTR_ACTIVATE)
+    
+    def deleted_keys(self) -> np.ndarray:
+        return self._keys_of(ATTR_DELETED)
+    
+    def load(self, reader: ipc.RecordBatchFileReader, batch_size: int):
+        """Load grid records from an Arrow file reader"""
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            keys = batch.column(ATTR_INDEX_KEY).to_numpy()
+            activates = batch.column(ATTR_ACTIVATE).to_numpy(zero_copy_only=False)
+            deleteds = batch.column(ATTR_DELETED).to_numpy(zero_copy_only=False)
+            
+            for level, positions, ids in self._group_by_level(keys):
+                if level >= len(self.level_info):
+                    logger.warning(f'Skipping {len(ids)} grid records of level {level} beyond the grid hierarchy')
+                    continue
+                self._ensure_level(level)
+                self.present[level].set(ids)
+                self.activate[level].set(ids[activates[positions]])
+                self.deleted[level].set(ids[deleteds[positions]])
+    
+    def load_segments(self, segments: 'SegmentFile'):
+        """Load grid records from a segment file"""
+        for level in segments.levels():
+            if level >= len(self.level_info):
+                logger.warning(f'Skipping {segments.count(level)} grid records of level {level} beyond the grid hierarchy')
+                continue
+            ids, activates, deleteds = segments.read_level(level)
+            self._ensure_level(level)
+            self.present[level].set(ids)
+            self.activate[level].set(ids[activates])
+            self.deleted[level].set(ids[deleteds])
+    
+    def snapshot(self) -> 'BitsetStorage':
+        """Return a copy of the storage sharing no data with it, all levels materialized"""
+        copied = BitsetStorage(self.level_info)
+        with self.lock:
+            # Materialize all levels first, so that the memory-mapped source is released before the grid file is replaced
+            for level in list(self.source_counts):
+                self._materialize(level)
+            for level in self.present:
+                copied.present[level] = self.present[level].copy()
+                copied.activate[level] = self.activate[level].copy()
+                copied.deleted[level] = self.deleted[level].copy()
+        return copied
+    
+    def iter_batches(self, batch_size: int):
+        """Yield grid records as Arrow record batches of GRID_SCHEMA, sorted by index key"""
+        # Materialize all levels first, so that the memory-mapped source is released before the grid file is replaced
+        with self.lock:
+            for level in list(self.source_counts):
+                self._materialize(level)
+        
+        for level in sorted(self.present):
+            ids = self.present[level].nonzero()
+            for chunk_start in range(0, len(ids), batch_size):
+                chunk = ids[chunk_start:chunk_start + batch_size]
+                keys = _encode_index_batch(np.full(len(chunk), level, dtype=np.uint8), chunk)
+                yield pa.RecordBatch.from_arrays(
+                    [
+                        pa.array(self.deleted[level].get(chunk)),
+                        pa.array(self.activate[level].get(chunk)),
+                        pa.array(keys, type=pa.uint64())
+                    ],
+                    schema=GRID_SCHEMA
+                )
+
+class BranchStorage:
+    """
+    Copy-on-write view of a grid storage for a Topo branch.  
+    States of grids edited on the branch are kept as a delta (sorted index keys and state codes) over the base storage,
+    which the branch never writes, so that branches only cost memory for the grids they edit.
+    """
+    def __init__(self, base: DataFrameStorage | BitsetStorage, base_edits: int):
+        self.base = base
+        self.base_edits = base_edits # number of main branch edits when the branch was created
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.codes = np.empty(0, dtype=np.uint8)
+    
+    def __len__(self) -> int:
+        return len(self.base) + int((~self.base.contains(self.keys)).sum())
+    
+    def __contains__(self, key: np.uint64) -> bool:
+        return bool(self.contains(np.array([key], dtype=np.uint64))[0])
+    
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """Return positions of keys in the delta, -1 for keys not edited on the branch"""
+        positions = np.searchsorted(self.keys, keys)
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        clipped = np.minimum(positions, len(self.keys) - 1)
+        return np.where(self.keys[clipped] == keys, clipped, -1)
+    
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        keys = np.asarray(keys, dtype=np.uint64)
+        return self.base.contains(keys) | (self._positions(keys) >= 0)
+    
+    def filter_existing(self, keys: np.ndarray) -> np.ndarray:
+        keys = np.asarray(keys, dtype=np.uint64)
+        return keys[self.contains(keys)]
+    
+    def _get_codes(self, keys: np.ndarray) -> np.ndarray:
+        """Return state codes of existing keys, from the delta if edited on the branch, from the base otherwise"""
+        positions = self._positions(keys)
+        codes = np.zeros(len(keys), dtype=np.uint8)
+        edited = positions >= 0
+        codes[edited] = self.codes[positions[edited]]
+        if not edited.all():
+            activates, deleteds = self.base.get_states(keys[~edited])
+            codes[~edited] = activates.astype(np.uint8) | (deleteds.astype(np.uint8) << 1)
+        return codes
+    
+    def get_states(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        codes = self._get_codes(np.asarray(keys, dtype=np.uint64))
+        return (codes & STATE_ACTIVE) != 0, (codes & STATE_DELETED) != 0
+    
+    def _set_codes(self, keys: np.ndarray, codes: np.ndarray):
+        """Write state codes of keys into the delta"""
+        keys, first = np.unique(keys, return_index=True)
+        codes = codes[first]
+        positions = self._positions(keys)
+        edited = positions >= 0
+        self.codes[positions[edited]] = codes[edited]
+        if not edited.all():
+            merged_keys = np.concatenate([self.keys, keys[~edited]])
+            merged_codes = np.concatenate([self.codes, codes[~edited]])
+            order = np.argsort(merged_keys, kind='stable')
+            self.keys, self.codes = merged_keys[order], merged_codes[order]
+    
+    def update(self, keys: np.ndarray, activate: bool | None = None, deleted: bool | None = None):
+        """Update flags of existing keys, flags set to None are left unchanged"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        codes = self._get_codes(keys)
+        if activate is not None:
+            codes = (codes & ~np.uint8(STATE_ACTIVE)) | np.uint8(STATE_ACTIVE if activate else 0)
+        if deleted is not None:
+            codes = (codes & ~np.uint8(STATE_DELETED)) | np.uint8(STATE_DELETED if deleted else 0)
+        self._set_codes(keys, codes)
+    
+    def add(self, keys: np.ndarray, activate: bool, deleted: bool):
+        """Set flags of keys, keys not in the base storage are only added to the delta"""
+        code = (STATE_ACTIVE if activate else 0) | (STATE_DELETED if deleted else 0)
+        keys = np.asarray(keys, dtype=np.uint64)
+        self._set_codes(keys, np.full(len(keys), code, dtype=np.uint8))
+    
+    def _keys_with(self, state: int, base_keys: np.ndarray) -> np.ndarray:
+        base_keys = np.asarray(base_keys, dtype=np.uint64)
+        return np.concatenate([base_keys[self._positions(base_keys) < 0], self.keys[(self.codes & state) != 0]])
+    
+    def active_keys(self) -> np.ndarray:
+        return self._keys_with(STATE_ACTIVE, self.base.active_keys())
+    
+    def deleted_keys(self) -> np.ndarray:
+        return self._keys_with(STATE_DELETED, self.base.deleted_keys())
+    
+    def delta(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return keys edited on the branch and their state codes"""
+        return self.keys, self.codes
+
+# Spatial Index ##################################################
+
+class ActiveGridIndex:
+    """
+    Spatial index of active grids.  
+    Global ids of a level are row-major (global_id = global_y * width + global_x), so active global ids of a level kept sorted
+    lay out the level row by row, and grids of a rectangular range of global x and y are found by a binary search per row,
+    costing O(rows * log(active grids)) plus the grids returned instead of a scan over all grids.  
+    The index is built once from the active keys and then kept up to date with grids changed since its edit version.
+    """
+    def __init__(self, active_keys: np.ndarray, version: int):
+        self.version = version
+        self.global_ids: dict[int, np.ndarray] = {} # level -> sorted active global ids
+        levels, global_ids = _decode_index_batch(np.sort(active_keys))
+        for level in np.unique(levels):
+            self.global_ids[int(level)] = global_ids[levels == level]
+    
+    def levels(self) -> list[int]:
+        return sorted(level for level, ids in self.global_ids.items() if len(ids) > 0)
+    
+    def update(self, changed_keys: np.ndarray, activates: np.ndarray, version: int):
+        """Apply the current activate flags of changed keys"""
+        levels, global_ids = _decode_index_batch(changed_keys)
+        for level in np.unique(levels):
+            level = int(level)
+            level_mask = levels == level
+            ids = self.global_ids.get(level, np.empty(0, dtype=np.uint32))
+            ids = ids[~np.isin(ids, global_ids[level_mask])]
+            self.global_ids[level] = np.union1d(ids, global_ids[level_mask & activates]).astype(np.uint32)
+        self.version = version
+    
+    def query(self, level: int, width: int, x_start: int, x_stop: int, y_start: int, y_stop: int) -> np.ndarray:
+        """Return active global ids of a level within [x_start, x_stop) x [y_start, y_stop)"""
+        ids = self.global_ids.get(level)
+        if ids is None or len(ids) == 0:
+            return np.empty(0, dtype=np.uint32)
+        
+        # Binary search the span of each row
+        row_starts = np.arange(y_start, y_stop, dtype=np.int64) * width
+        starts = np.searchsorted(ids, row_starts + x_start)
+        stops = np.searchsorted(ids, row_starts + x_stop)
+        
+        # Gather positions of all spans
+        counts = stops - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.uint32)
+        span_offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return ids[np.arange(total) + span_offsets]
+
+# Change Tracking ##################################################
+
+class ChangeTracker:
+    """
+    Append-only record of grids changed by edits.  
+    Each edit increases the edit version and appends the changed keys along with it, so that grids changed since any version can be queried.  
+    Keys are only merged and deduplicated when queried.
+    Once more than `max_keys` keys are tracked the oldest edits are forgotten,
+    callers synchronized to a version before `oldest_version` then need a full refresh.
+    """
+    def __init__(self, base_version: int = 0, max_keys: int = CHANGE_TRACKER_MAX_KEYS):
+        self.base_version = base_version # version before the first tracked edit
+        self.version = base_version
+        self.oldest_version = base_version # changes before it are unknown
+        self.max_keys = max_keys
+        self.versions: list[int] = [] # version of each tracked edit, increasing
+        self.keys: list[np.ndarray] = [] # keys changed by each tracked edit
+        self.key_count = 0
+    
+    def __len__(self) -> int:
+        return self.key_count
+    
+    def tracks(self, version: int) -> bool:
+        """Tell if grids changed since the version are known"""
+        return self.oldest_version <= version <= self.version
+    
+    def mark(self, keys: np.ndarray) -> int:
+        """Record changed keys with a new edit version and return it, nothing is recorded if keys are empty"""
+        if len(keys) == 0:
+            return self.version
+        
+        self.version += 1
+        self.versions.append(self.version)
+        self.keys.append(np.array(keys, dtype=np.uint64))
+        self.key_count += len(keys)
+        
+        # Forget the oldest edits, keeping at least the last one
+        pruned = 0
+        while self.key_count > self.max_keys and pruned < len(self.keys) - 1:
+            self.key_count -= len(self.keys[pruned])
+            self.oldest_version = self.versions[pruned]
+            pruned += 1
+        if pruned:
+            del self.versions[:pruned]
+            del self.keys[:pruned]
+        return self.version
+    
+    def changed_since(self, version: int) -> np.ndarray:
+        """Return index keys of grids changed after the given version, sorted by key"""
+        start = bisect.bisect_right(self.versions, version)
+        if start == len(self.keys):
+            return np.empty(0, dtype=np.uint64)
+        return np.unique(np.concatenate(self.keys[start:]))
+
+# Edit Log ##################################################
+
+class EditLog:
+    """
+    Append-only log of Topo edits kept next to the grid file.  
+    The log starts with a header [magic: 4 bytes][generation: uint64] binding it to the grid file generation it applies to,
+    followed by one record per edit: [op: uint8][key count: uint32][index keys: uint64 x key count], all little-endian.  
+    Each record is flushed and fsynced when appended, a torn record at the end of the log is dropped.
+    """
+    MAGIC = b'NHTL'
+    HEADER = struct.Struct('<4sQ')
+    RECORD = struct.Struct('<BI')
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+        self.record_count = 0
+        self.key_count = 0
+        self._valid_size = 0
+    
+    def exists(self) -> bool:
+        return self.path.exists()
+    
+    def read_generation(self) -> int | None:
+        """Return the grid file generation of the log, None if the header is invalid"""
+        with open(self.path, 'rb') as f:
+            header = f.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            return None
+        magic, generation = self.HEADER.unpack(header)
+        return generation if magic == self.MAGIC else None
+    
+    def read(self):
+        """Yield (op, index keys) of all complete records"""
+        self.record_count = 0
+        self.key_count = 0
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        
+        offset = self.HEADER.size
+        while offset + self.RECORD.size <= len(data):
+            op, count = self.RECORD.unpack_from(data, offset)
+            end = offset + self.RECORD.size + count * 8
+            if end > len(data):
+                logger.warning(f'Dropping torn record at the end of edit log {self.path}')
+                break
+            keys = np.frombuffer(data, dtype='<u8', count=count, offset=offset + self.RECORD.size)
+            self.record_count += 1
+            self.key_count += count
+            offset = end
+            yield op, keys.astype(np.uint64)
+        self._valid_size = offset
+    
+    def open(self):
+        """Open the log for appending after the last complete record"""
+        self.file = open(self.path, 'r+b')
+        self.file.truncate(self._valid_size)
+        self.file.seek(self._valid_size)
+    
+    def reset(self, generation: int):
+        """Empty the log and bind it to a grid file generation"""
+        self.close()
+        self.file = open(self.path, 'w+b')
+        self.file.write(self.HEADER.pack(self.MAGIC, generation))
+        self.sync()
+        self.record_count = 0
+        self.key_count = 0
+        self._valid_size = self.HEADER.size
+    
+    def append(self, op: int, keys: np.ndarray):
+        self.file.write(self.RECORD.pack(op, len(keys)))
+        self.file.write(np.ascontiguousarray(keys, dtype='<u8').data)
+        self.sync()
+        self.record_count += 1
+        self.key_count += len(keys)
+    
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# Edit History ##################################################
+
+class EditHistory:
+    """
+    Bounded undo / redo history of Topo edits.  
+    An edit is kept as the keys whose states it flipped, with their state codes before and after the edit (10 bytes per key),
+    so that undo and redo only rewrite these keys.  
+    Once the history holds more than budget bytes, the oldest undo entries are evicted first, then the furthest redo entries.
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.undo_entries: deque[tuple[np.ndarray, np.ndarray, np.ndarray]] = deque()
+        self.redo_entries: deque[tuple[np.ndarray, np.ndarray, np.ndarray]] = deque()
+        self.nbytes = 0
+    
+    def __len__(self) -> int:
+        return len(self.undo_entries)
+    
+    def push(self, keys: np.ndarray, before: np.ndarray, after: np.ndarray):
+        """Record an applied edit, dropping the redo history"""
+        flipped = before != after
+        if not flipped.any():
+            return
+        
+        for entry in self.redo_entries:
+            self.nbytes -= _entry_nbytes(entry)
+        self.redo_entries.clear()
         
+        entry = (keys[flipped], before[flipped], after[flipped])
+        self.undo_entries.append(entry)
+        self.nbytes += _entry_nbytes(entry)
+        self._evict()
+    
+    def pop_undo(self) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """Move the last edit to the redo history and return it"""
+        if not self.undo_entries:
+            return None
+        entry = self.undo_entries.pop()
+        self.redo_entries.append(entry)
+        return entry
+    
+    def pop_redo(self) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """Move the last undone edit back to the undo history and return it"""
+        if not self.redo_entries:
+            return None
+        entry = self.redo_entries.pop()
+        self.undo_entries.append(entry)
+        return entry
+    
+    def _evict(self):
+        while self.nbytes > self.budget and (self.undo_entries or self.redo_entries):
+            entry = self.undo_entries.popleft() if self.undo_entries else self.redo_entries.popleft()
+            self.nbytes -= _entry_nbytes(entry)
 
-    # def parseTopology(self):
+# Autosave ##################################################
+
+class Autosaver:
+    """
+    Background thread saving a Topo at a fixed interval and / or as soon as enough edits are pending.  
+    Saves run on the thread, edits only wait for the grid storage to be snapshotted.
+    """
+    def __init__(self, topo: 'Topo', interval: float, edit_threshold: int):
+        self.topo = topo
+        self.interval = interval
+        self.edit_threshold = edit_threshold
+        self._wake = threading.Event()
+        self._stopping = False
+        self.thread = threading.Thread(target=self._run, name='topo-autosave', daemon=True)
+        self.thread.start()
+    
+    def notify(self, pending_edits: int):
+        """Wake the thread up if the edit threshold is reached"""
+        if self.edit_threshold > 0 and pending_edits >= self.edit_threshold:
+            self._wake.set()
+    
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.topo._autosave()
+            except Exception as e:
+                logger.error(f'Failed to autosave grid data: {str(e)}')
+    
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        self.thread.join()
+
+# Segment File ##################################################
+
+class SegmentFile:
+    """
+    Compact grid file storing each level as a separate segment, readable lazily per level.  
+    The file starts with a header [magic: 4 bytes][format version: uint16][codec: uint8][reserved: uint8][generation: uint64][level count: uint16],
+    followed by one entry per level [level: uint8][encoding: uint8][grid count: uint64][offset: uint64][stored size: uint64][raw size: uint64]
+    and the segments, all little-endian.  
+    A segment holds a 4-bit state per grid (bit 0 present, bit 1 activate, bit 2 deleted, 0 for absent grids) over the level's dense id space, encoded as
+    - runs: starts (uint32 x n), lengths (uint32 x n) and states (uint8 x n) of runs of present grids with the same state, or
+    - bitmap: states of all ids packed 2 per byte,
+    whichever is smaller, then optionally compressed with zstd or lz4.  
+    Files of version 1 held a 2-bit state (0 absent, 1 inactive, 2 active, 3 deleted) packed 4 per byte, they are still read.
+    """
+    MAGIC = b'NHTS'
+    FORMAT_VERSION = 2
+    STATE_PRESENT = 1
+    STATE_ACTIVATE = 2
+    STATE_DELETED = 4
+    HEADER = struct.Struct('<4sHBBQH')
+    ENTRY = struct.Struct('<BBQQQQ')
+    CODECS = {COMPRESSION_NONE: 0, COMPRESSION_ZSTD: 1, COMPRESSION_LZ4: 2}
+    ENCODING_RUNS = 0
+    ENCODING_BITMAP = 1
+    
+    def __init__(self, file_path: str):
+        self.file = pa.memory_map(str(file_path), 'r')
+        magic, self.version, codec_id, _, self.generation, level_count = self.HEADER.unpack(self._read(self.HEADER.size, 0))
+        if magic != self.MAGIC or not 1 <= self.version <= self.FORMAT_VERSION:
+            raise ValueError(f'Not a grid segment file of version up to {self.FORMAT_VERSION}: {file_path}')
+        
+        codec_names = {codec_id: name for name, codec_id in self.CODECS.items()}
+        self.codec = pa.Codec(codec_names[codec_id]) if codec_id != 0 else None
+        table = self._read(self.ENTRY.size * level_count, self.HEADER.size)
+        self.entries: dict[int, tuple[int, int, int, int, int]] = {}
+        for i in range(level_count):
+            level, encoding, count, offset, stored_size, raw_size = self.ENTRY.unpack_from(table, i * self.ENTRY.size)
+            self.entries[level] = (encoding, count, offset, stored_size, raw_size)
+    
+    @staticmethod
+    def is_segment_file(file_path: str) -> bool:
+        with open(file_path, 'rb') as f:
+            return f.read(len(SegmentFile.MAGIC)) == SegmentFile.MAGIC
+    
+    def levels(self) -> list[int]:
+        return sorted(self.entries)
+    
+    def count(self, level: int) -> int:
+        return self.entries[level][1]
+    
+    def read_level(self, level: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Decode the segment of a level into sorted global ids and their activate and deleted flags"""
+        encoding, _, offset, stored_size, raw_size = self.entries[level]
+        payload = self._read(stored_size, offset)
+        if self.codec is not None:
+            payload = self.codec.decompress(payload, decompressed_size=raw_size)
+        data = np.frombuffer(payload, dtype=np.uint8)
+        
+        if encoding == self.ENCODING_RUNS:
+            run_count = raw_size // 9
+            starts = data[:run_count * 4].view('<u4').astype(np.int64)
+            lengths = data[run_count * 4:run_count * 8].view('<u4').astype(np.int64)
+            run_states = data[run_count * 8:]
+            run_offsets = np.cumsum(lengths) - lengths
+            ids = np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(starts - run_offsets, lengths)
+            states = np.repeat(run_states, lengths)
+        elif self.version == 1:
+            states = np.column_stack([(data >> shift) & 3 for shift in (0, 2, 4, 6)]).ravel()
+            ids = np.flatnonzero(states)
+            states = states[ids]
+        else:
+            states = np.column_stack([data & 15, data >> 4]).ravel()
+            ids = np.flatnonzero(states)
+            states = states[ids]
+        
+        if self.version == 1:
+            return ids, states == 2, states == 3
+        return ids, (states & self.STATE_ACTIVATE) != 0, (states & self.STATE_DELETED) != 0
+    
+    def _read(self, size: int, offset: int) -> pa.Buffer:
+        """Return a zero-copy buffer of a range of the memory-mapped file"""
+        self.file.seek(offset)
+        return self.file.read_buffer(size)
+    
+    def close(self):
+        self.file.close()
+    
+    @staticmethod
+    def write(file_path: str, generation: int, batches, level_info: list[dict[str, int]], compression: str = COMPRESSION_NONE):
+        """Write grid records (Arrow batches of GRID_SCHEMA) as a segment file"""
+        if compression not in SegmentFile.CODECS:
+            raise ValueError(f'Unknown grid file compression: {compression}')
+        codec = pa.Codec(compression) if compression != COMPRESSION_NONE else None
+        
+        batches = list(batches)
+        column = lambda name, dtype: np.concatenate([np.asarray(batch.column(name), dtype=dtype) for batch in batches]) if batches else np.empty(0, dtype=dtype)
+        keys = column(ATTR_INDEX_KEY, np.uint64)
+        states = (
+            SegmentFile.STATE_PRESENT
+            | np.where(column(ATTR_ACTIVATE, np.bool_), SegmentFile.STATE_ACTIVATE, 0)
+            | np.where(column(ATTR_DELETED, np.bool_), SegmentFile.STATE_DELETED, 0)
+        ).astype(np.uint8)
+        order = np.argsort(keys, kind='stable')
+        keys, states = keys[order], states[order]
+        levels, global_ids = _decode_index_batch(keys)
+        level_starts = np.searchsorted(levels, np.arange(len(level_info) + 1))
+        
+        entries = []
+        segments = []
+        offset = SegmentFile.HEADER.size
+        for level in range(len(level_info)):
+            start, stop = level_starts[level], level_starts[level + 1]
+            if start == stop:
+                continue
+            encoding, raw = SegmentFile._encode(global_ids[start:stop].astype(np.int64), states[start:stop], level_info[level])
+            stored = codec.compress(raw, asbytes=True) if codec is not None else raw
+            entries.append((level, encoding, stop - start, len(stored), len(raw)))
+            segments.append(stored)
+        
+        offset += SegmentFile.ENTRY.size * len(entries)
+        with open(file_path, 'wb') as f:
+            f.write(SegmentFile.HEADER.pack(SegmentFile.MAGIC, SegmentFile.FORMAT_VERSION, SegmentFile.CODECS[compression], 0, generation, len(entries)))
+            for level, encoding, count, stored_size, raw_size in entries:
+                f.write(SegmentFile.ENTRY.pack(level, encoding, count, offset, stored_size, raw_size))
+                offset += stored_size
+            for stored in segments:
+                f.write(stored)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    @staticmethod
+    def _encode(ids: np.ndarray, states: np.ndarray, info: dict[str, int]) -> tuple[int, bytes]:
+        """Encode sorted ids and states of a level as runs or as a bitmap, whichever is smaller"""
+        breaks = np.flatnonzero((np.diff(ids) != 1) | (np.diff(states) != 0)) + 1
+        run_starts = np.concatenate([[0], breaks])
+        run_lengths = np.diff(np.concatenate([run_starts, [len(ids)]]))
+        
+        size = info['width'] * info['height']
+        if len(run_starts) * 9 <= (size + 1) // 2:
+            raw = b''.join([
+                ids[run_starts].astype('<u4').tobytes(),
+                run_lengths.astype('<u4').tobytes(),
+                states[run_starts].astype(np.uint8).tobytes()
+            ])
+            return SegmentFile.ENCODING_RUNS, raw
+        
+        dense = np.zeros(((size + 1) // 2) * 2, dtype=np.uint8)
+        dense[ids] = states
+        pairs = dense.reshape(-1, 2)
+        packed = pairs[:, 0] | (pairs[:, 1] << 4)
+        return SegmentFile.ENCODING_BITMAP, packed.astype(np.uint8).tobytes()
 
 # Helpers ##################################################
 
+def _entry_nbytes(entry: tuple[np.ndarray, np.ndarray, np.ndarray]) -> int:
+    return sum(array.nbytes for array in entry)
+
+def _read_generation(schema: pa.Schema) -> int:
+    """Read the generation of a grid file from its schema metadata, 0 for files written without one"""
+    metadata = schema.metadata or {}
+    return int(metadata.get(META_GENERATION.encode(), b'0'))
+
+def _match_sides(
+    lines_a: np.ndarray, starts_a: np.ndarray, stops_a: np.ndarray,
+    lines_b: np.ndarray, starts_b: np.ndarray, stops_b: np.ndarray,
+    grids: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Match sides of grids ending on lines (a) with sides of grids starting on lines (b)
+    
+    Sides of the same kind never overlap since grids passed in do not overlap (get_topology leaves out grids covered by active ancestors).  
+    Returns (lines, starts, stops, grids_a, grids_b) of the edges, grids being -1 where a side has no counterpart.
+    """
+    span = int(max(stops_a.max(initial=0), stops_b.max(initial=0))) + 1
+    
+    # Cut lines into segments at all side ends
+    cuts = np.unique(np.concatenate([
+        lines_a * span + starts_a, lines_a * span + stops_a,
+        lines_b * span + starts_b, lines_b * span + stops_b
+    ]))
+    same_line = (cuts[:-1] // span) == (cuts[1:] // span)
+    segment_starts, segment_stops = cuts[:-1][same_line], cuts[1:][same_line]
+    
+    # Find the side covering each segment, sides being sorted by their start
+    def cover(lines: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+        if len(lines) == 0:
+            return np.full(len(segment_starts), -1, dtype=np.int64)
+        side_starts = lines * span + starts
+        order = np.argsort(side_starts)
+        positions = np.searchsorted(side_starts[order], segment_starts, side='right') - 1
+        positions = np.maximum(positions, 0)
+        sides = order[positions]
+        covered = (side_starts[sides] <= segment_starts) & (lines[sides] * span + stops[sides] >= segment_stops)
+        return np.where(covered, grids[sides], -1)
+    
+    grids_a = cover(lines_a, starts_a, stops_a)
+    grids_b = cover(lines_b, starts_b, stops_b)
+    bordered = (grids_a >= 0) | (grids_b >= 0)
+    segment_starts, segment_stops = segment_starts[bordered], segment_stops[bordered]
+    grids_a, grids_b = grids_a[bordered], grids_b[bordered]
+    if len(segment_starts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty, empty
+    
+    # Merge consecutive segments bordered by the same pair of grids
+    edge_heads = np.ones(len(segment_starts), dtype=np.bool_)
+    edge_heads[1:] = (segment_starts[1:] != segment_stops[:-1]) | (grids_a[1:] != grids_a[:-1]) | (grids_b[1:] != grids_b[:-1])
+    head_positions = np.flatnonzero(edge_heads)
+    tail_positions = np.append(head_positions[1:], len(segment_starts)) - 1
+    
+    edge_starts, edge_stops = segment_starts[head_positions], segment_stops[tail_positions]
+    return edge_starts // span, edge_starts % span, edge_stops - (edge_starts // span) * span, grids_a[head_positions], grids_b[head_positions]
+
+def _empty_grid_infos() -> tuple[np.ndarray, np.ndarray]:
+    """Empty levels and global_ids arrays"""
+    return np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.uint32)
+
 def _encode_index(level: int, global_id: int) -> np.uint64:
     """Encode level and global_id into a single index key"""
     return np.uint64(level) << 32 | np.uint64(global_id)
@@ -1,34 +1,66 @@
 import c_two as cc
+import numpy as np
 from dataclasses import dataclass
 from enum import Enum
 from typing import Any, Union
 from pydantic import BaseModel
 
+class ListColumn:
+    """
+    Column of int lists kept as flat values and offsets, row i being values[offsets[i]:offsets[i + 1]]
+    ---
+    Rows are NumPy views, no list is built per row.
+    """
+    def __init__(self, offsets: np.ndarray, values: np.ndarray):
+        self.offsets = offsets
+        self.values = values
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
 @dataclass
 class NeData:
-    grid_id_list: list[int]
-    nsl1_list:list[int]
-    nsl2_list:list[int]
-    nsl3_list:list[int]
-    nsl4_list:list[int]
-    isl1_list:list[list[int]]
-    isl2_list:list[list[int]]
-    isl3_list:list[list[int]]
-    isl4_list:list[list[int]]
-    xe_list:list[float]
-    ye_list:list[float]
-    ze_list:list[float]
-    under_suf_list:list[int]
+    """
+    NE (grid) data of a solution, each column being indexed by grid id (index 0 is a placeholder)
+    ---
+    Columns are NumPy arrays (ListColumn for isl1..isl4), whether read from a text or a binary NE file.
+    Columns read from a binary NE file are read-only views over the memory-mapped file.
+    """
+    grid_id_list: np.ndarray
+    nsl1_list: np.ndarray
+    nsl2_list: np.ndarray
+    nsl3_list: np.ndarray
+    nsl4_list: np.ndarray
+    isl1_list: ListColumn
+    isl2_list: ListColumn
+    isl3_list: ListColumn
+    isl4_list: ListColumn
+    xe_list: np.ndarray
+    ye_list: np.ndarray
+    ze_list: np.ndarray
+    under_suf_list: np.ndarray
 
 @dataclass
 class NsData:
-    edge_id_list: list[int]
-    ise_list: list[list[int]]
-    dis_list: list[float]
-    x_side_list: list[float]
-    y_side_list: list[float]
-    z_side_list: list[float]
-    s_type_list: list[int]
+    """
+    NS (edge) data of a solution, each column being indexed by edge id (index 0 is a placeholder)
+    ---
+    Columns are NumPy arrays (ise as an (n, 5) array), whether read from a text or a binary NS file.
+    Columns read from a binary NS file are read-only views over the memory-mapped file.
+    """
+    edge_id_list: np.ndarray
+    ise_list: np.ndarray
+    dis_list: np.ndarray
+    x_side_list: np.ndarray
+    y_side_list: np.ndarray
+    z_side_list: np.ndarray
+    s_type_list: np.ndarray
 
 @dataclass
 class RainfallData:
@@ -1,4 +1,5 @@
 import c_two as cc
+import numpy as np
 import pyarrow as pa
 
 # Define transferables ##################################################
@@ -156,6 +157,13 @@ class PeerGridInfos:
 
 @cc.transferable
 class GridInfos:
+    """
+    Levels (uint8) and global ids (uint32) of multiple grids
+    ---
+    Both ends work on NumPy arrays: serialization wraps the arrays as Arrow buffers without copying,
+    and deserialization returns read-only NumPy views over the received buffers.
+    Parameters are annotated as list[int] so that c-two can match them with ICRM method signatures.
+    """
     def serialize(levels: list[int], global_ids: list[int]) -> bytes:
         schema = pa.schema([
             pa.field('levels', pa.uint8()),
@@ -163,39 +171,205 @@ class GridInfos:
         ])
         table = pa.Table.from_arrays(
             [
-                pa.array(levels, type=pa.uint8()), 
-                pa.array(global_ids, type=pa.uint32())
+                pa.array(np.asarray(levels, dtype=np.uint8), type=pa.uint8()), 
+                pa.array(np.asarray(global_ids, dtype=np.uint32), type=pa.uint32())
             ],
             schema=schema
         )
         return serialize_from_table(table)
 
-    def deserialize(arrow_bytes: bytes) -> tuple[list[int], list[list[int]]]:
-        table = deserialize_to_table(arrow_bytes)
-        levels = table.column('levels').to_pylist()
-        global_ids = table.column('global_ids').to_pylist()
+    def deserialize(arrow_bytes: bytes) -> tuple[np.ndarray, np.ndarray]:
+        table = deserialize_to_table(arrow_bytes).combine_chunks()
+        levels = table.column('levels').to_numpy()
+        global_ids = table.column('global_ids').to_numpy()
         return levels, global_ids
 
 @cc.transferable
 class GridAttributes:
-    def serialize(data: list[GridAttribute]) -> bytes:
+    """
+    Columnar Attributes of Multiple Grids
+    ---
+    All attributes are NumPy arrays of the same length, row i describing the i-th grid.
+    - levels (uint8): the levels of the grids
+    - types (uint8): the types of the grids
+    - activate (bool): the subdivision status of the grids
+    - deleted (bool): the deletion status of the grids
+    - elevations (float64): the elevations of the grids
+    - global_ids (uint32): the global ids of the grids
+    - local_ids (uint32): the local ids of the grids
+    - min_xs, min_ys, max_xs, max_ys (float64): the bounding boxes of the grids
+    """
+    levels: np.ndarray
+    types: np.ndarray
+    activate: np.ndarray
+    deleted: np.ndarray
+    elevations: np.ndarray
+    global_ids: np.ndarray
+    local_ids: np.ndarray
+    min_xs: np.ndarray
+    min_ys: np.ndarray
+    max_xs: np.ndarray
+    max_ys: np.ndarray
+    
+    def serialize(data: 'GridAttributes') -> bytes:
         schema = pa.schema([
-            pa.field('attribute_bytes', pa.list_(pa.binary())),
+            pa.field('deleted', pa.bool_()),
+            pa.field('activate', pa.bool_()),
+            pa.field('type', pa.uint8()),
+            pa.field('level', pa.uint8()),
+            pa.field('global_id', pa.uint32()),
+            pa.field('local_id', pa.uint32()),
+            pa.field('elevation', pa.float64()),
+            pa.field('min_x', pa.float64()),
+            pa.field('min_y', pa.float64()),
+            pa.field('max_x', pa.float64()),
+            pa.field('max_y', pa.float64()),
         ])
-
-        data_dict = {
-            'attribute_bytes': [GridAttribute.serialize(grid) for grid in data]
-        }
         
-        table = pa.Table.from_pylist([data_dict], schema=schema)
-        return serialize_from_table(table)
+        batch = pa.RecordBatch.from_arrays(
+            [
+                pa.array(data.deleted, type=pa.bool_()),
+                pa.array(data.activate, type=pa.bool_()),
+                pa.array(data.types, type=pa.uint8()),
+                pa.array(data.levels, type=pa.uint8()),
+                pa.array(data.global_ids, type=pa.uint32()),
+                pa.array(data.local_ids, type=pa.uint32()),
+                pa.array(data.elevations, type=pa.float64()),
+                pa.array(data.min_xs, type=pa.float64()),
+                pa.array(data.min_ys, type=pa.float64()),
+                pa.array(data.max_xs, type=pa.float64()),
+                pa.array(data.max_ys, type=pa.float64()),
+            ],
+            schema=schema
+        )
+        return serialize_from_table(pa.Table.from_batches([batch]))
 
-    def deserialize(arrow_bytes: bytes) -> list[GridAttribute]:
-        table = deserialize_to_table(arrow_bytes)
-        
-        grid_bytes = table.column('attribute_bytes').to_pylist()[0]
+    def deserialize(arrow_bytes: bytes) -> 'GridAttributes':
+        table = deserialize_to_table(arrow_bytes).combine_chunks()
+        return GridAttributes(
+            levels=table.column('level').to_numpy(),
+            types=table.column('type').to_numpy(),
+            activate=table.column('activate').to_numpy(zero_copy_only=False),
+            deleted=table.column('deleted').to_numpy(zero_copy_only=False),
+            elevations=table.column('elevation').to_numpy(),
+            global_ids=table.column('global_id').to_numpy(),
+            local_ids=table.column('local_id').to_numpy(),
+            min_xs=table.column('min_x').to_numpy(),
+            min_ys=table.column('min_y').to_numpy(),
+            max_xs=table.column('max_x').to_numpy(),
+            max_ys=table.column('max_y').to_numpy()
+        )
+
+@cc.transferable
+class GridChanges:
+    """
+    Grids Changed Since an Edit Version
+    ---
+    - version (int): the edit version of the topo when the changes were collected
+    - full (bool): whether the changes are the complete grid state rather than a delta,
+      returned when the requested version is unknown to the topo (e.g. issued before a restart)
+    - levels (uint8): the levels of the changed grids
+    - global_ids (uint32): the global ids of the changed grids
+    - activate (bool): the current subdivision status of the changed grids
+    - deleted (bool): the current deletion status of the changed grids
+    """
+    version: int
+    full: bool
+    levels: np.ndarray
+    global_ids: np.ndarray
+    activate: np.ndarray
+    deleted: np.ndarray
+    
+    def serialize(data: 'GridChanges') -> bytes:
+        schema = pa.schema(
+            [
+                pa.field('level', pa.uint8()),
+                pa.field('global_id', pa.uint32()),
+                pa.field('activate', pa.bool_()),
+                pa.field('deleted', pa.bool_()),
+            ],
+            metadata={'version': str(data.version), 'full': str(data.full)}
+        )
         
-        return [GridAttribute.deserialize(grid_byte) for grid_byte in grid_bytes]
+        batch = pa.RecordBatch.from_arrays(
+            [
+                pa.array(np.asarray(data.levels, dtype=np.uint8), type=pa.uint8()),
+                pa.array(np.asarray(data.global_ids, dtype=np.uint32), type=pa.uint32()),
+                pa.array(data.activate, type=pa.bool_()),
+                pa.array(data.deleted, type=pa.bool_()),
+            ],
+            schema=schema
+        )
+        return serialize_from_table(pa.Table.from_batches([batch]))
+    
+    def deserialize(arrow_bytes: bytes) -> 'GridChanges':
+        table = deserialize_to_table(arrow_bytes).combine_chunks()
+        metadata = table.schema.metadata
+        return GridChanges(
+            version=int(metadata[b'version']),
+            full=metadata[b'full'] == b'True',
+            levels=table.column('level').to_numpy(),
+            global_ids=table.column('global_id').to_numpy(),
+            activate=table.column('activate').to_numpy(zero_copy_only=False),
+            deleted=table.column('deleted').to_numpy(zero_copy_only=False)
+        )
+
+@cc.transferable
+class GridTopology:
+    """
+    Columnar Topology of Active Grids
+    ---
+    Grids:
+    - levels (uint8), global_ids (uint32): the active grids, edges refer to grids by their positions in these arrays
+    Edges (sides shared by two grids of any levels, or sides on the border of the active grids with a grid on one side only):
+    - edge_directions (uint8): 0 for vertical edges (between a west and an east grid), 1 for horizontal edges (between a south and a north grid)
+    - edge_grids_a (int32): position of the west / south grid of the edges, -1 if none
+    - edge_grids_b (int32): position of the east / north grid of the edges, -1 if none
+    - edge_min_xs, edge_min_ys, edge_max_xs, edge_max_ys (float64): end points of the edges
+    """
+    levels: np.ndarray
+    global_ids: np.ndarray
+    edge_directions: np.ndarray
+    edge_grids_a: np.ndarray
+    edge_grids_b: np.ndarray
+    edge_min_xs: np.ndarray
+    edge_min_ys: np.ndarray
+    edge_max_xs: np.ndarray
+    edge_max_ys: np.ndarray
+    
+    def serialize(data: 'GridTopology') -> bytes:
+        # Grids and edges have different lengths, each column is stored as a single list value
+        columns = {
+            'levels': pa.array(np.asarray(data.levels, dtype=np.uint8), type=pa.uint8()),
+            'global_ids': pa.array(np.asarray(data.global_ids, dtype=np.uint32), type=pa.uint32()),
+            'edge_directions': pa.array(np.asarray(data.edge_directions, dtype=np.uint8), type=pa.uint8()),
+            'edge_grids_a': pa.array(np.asarray(data.edge_grids_a, dtype=np.int32), type=pa.int32()),
+            'edge_grids_b': pa.array(np.asarray(data.edge_grids_b, dtype=np.int32), type=pa.int32()),
+            'edge_min_xs': pa.array(data.edge_min_xs, type=pa.float64()),
+            'edge_min_ys': pa.array(data.edge_min_ys, type=pa.float64()),
+            'edge_max_xs': pa.array(data.edge_max_xs, type=pa.float64()),
+            'edge_max_ys': pa.array(data.edge_max_ys, type=pa.float64()),
+        }
+        table = pa.Table.from_pydict({
+            name: pa.ListArray.from_arrays(pa.array([0, len(values)], type=pa.int32()), values)
+            for name, values in columns.items()
+        })
+        return serialize_from_table(table)
+    
+    def deserialize(arrow_bytes: bytes) -> 'GridTopology':
+        table = deserialize_to_table(arrow_bytes).combine_chunks()
+        column = lambda name: table.column(name).chunk(0).flatten().to_numpy()
+        return GridTopology(
+            levels=column('levels'),
+            global_ids=column('global_ids'),
+            edge_directions=column('edge_directions'),
+            edge_grids_a=column('edge_grids_a'),
+            edge_grids_b=column('edge_grids_b'),
+            edge_min_xs=column('edge_min_xs'),
+            edge_min_ys=column('edge_min_ys'),
+            edge_max_xs=column('edge_max_xs'),
+            edge_max_ys=column('edge_max_ys')
+        )
 
 @cc.transferable
 class GridKeys:
@@ -235,18 +409,25 @@ class GridCenter:
 
 @cc.transferable
 class MultiGridCenters:
+    """
+    Center coordinates (lon, lat) of multiple grids
+    ---
+    Serialization also takes an (n, 2) NumPy array of centers, whose columns are wrapped as Arrow arrays without building tuples.
+    """
     def serialize(centers: list[tuple[float, float]]) -> bytes:
         schema = pa.schema([
             pa.field('lon', pa.float64()),
             pa.field('lat', pa.float64()),
         ])
         
-        data = {
-            'lon': [center[0] for center in centers],
-            'lat': [center[1] for center in centers],
-        }
-        
-        table = pa.Table.from_pydict(data, schema=schema)
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        table = pa.Table.from_arrays(
+            [
+                pa.array(centers[:, 0], type=pa.float64()),
+                pa.array(centers[:, 1], type=pa.float64())
+            ],
+            schema=schema
+        )
         return serialize_from_table(table)
 
     def deserialize(arrow_bytes: bytes) -> list[tuple[float, float]]:
@@ -257,17 +438,16 @@ class MultiGridCenters:
 
 @cc.transferable
 class FloatArray:
-    def serialize(data: list[float]) -> bytes:
+    def serialize(data: np.ndarray) -> bytes:
         schema = pa.schema([
             pa.field('data', pa.float64())
         ])
-        data = {'data': data}
-        table = pa.Table.from_pydict(data, schema=schema)
+        table = pa.Table.from_arrays([pa.array(np.asarray(data, dtype=np.float64), type=pa.float64())], schema=schema)
         return serialize_from_table(table)
 
-    def deserialize(arrow_bytes: bytes) -> list[float]:
-        table = deserialize_to_table(arrow_bytes)
-        data = table.column('data').to_pylist()
+    def deserialize(arrow_bytes: bytes) -> np.ndarray:
+        table = deserialize_to_table(arrow_bytes).combine_chunks()
+        data = table.column('data').to_numpy()
         return data
 
 @cc.transferable
@@ -312,7 +492,7 @@ class ITopo:
     def get_parents(self, levels: list[int], global_ids: list[int]) -> tuple[list[int], list[int]]:
         ...
 
-    def get_grid_infos(self, level: int, global_ids: list[int]) -> list[GridAttribute]:
+    def get_grid_infos(self, level: int, global_ids: list[int]) -> GridAttributes:
         ...
     
     def get_active_grid_infos(self) -> tuple[list[int], list[int]]:
@@ -321,13 +501,28 @@ class ITopo:
     def get_deleted_grid_infos(self) -> tuple[list[int], list[int]]:
         ...
     
+    def get_active_grid_infos_in_bbox(self, bbox: list[float]) -> tuple[list[int], list[int]]:
+        ...
+    
+    def get_active_grid_infos_in_tile(self, z: int, x: int, y: int) -> tuple[list[int], list[int]]:
+        ...
+    
+    def get_grid_changes(self, version: int) -> GridChanges:
+        ...
+    
+    def get_topology(self) -> GridTopology:
+        ...
+    
+    def export_mesh(self, ne_path: str, ns_path: str) -> TopoSaveInfo:
+        ...
+    
     def get_grid_center(self, level: int, global_id: int) -> tuple[float, float]:
         ...
     
     def get_multi_grid_centers(self, levels: list[int], global_ids: list[int]) -> list[tuple[float, float]]:
         ...
     
-    def get_multi_grid_bboxes(self, levels: list[int], global_ids: list[int]) -> list[float]:
+    def get_multi_grid_bboxes(self, levels: list[int], global_ids: list[int]) -> np.ndarray:
         ...
         
     def merge_multi_grids(self, levels: list[int], global_ids: list[int]) -> tuple[list[int], list[int]]:
@@ -335,6 +530,27 @@ class ITopo:
         
     def recover_multi_grids(self, levels: list[int], global_ids: list[int]):
         ...
+    
+    def undo(self) -> GridChanges:
+        ...
+    
+    def redo(self) -> GridChanges:
+        ...
+    
+    def create_branch(self, name: str) -> TopoSaveInfo:
+        ...
+    
+    def checkout_branch(self, name: str) -> TopoSaveInfo:
+        ...
+    
+    def commit_branch(self, name: str) -> TopoSaveInfo:
+        ...
+    
+    def discard_branch(self, name: str) -> TopoSaveInfo:
+        ...
+    
+    def get_branches(self) -> list[str]:
+        ...
         
     def save(self) -> TopoSaveInfo:
         ...
@@ -21,6 +21,14 @@ if __name__ == '__main__':
     parser.add_argument('--schema_file_path', type=str, required=True, help='Path to the schema file')
     parser.add_argument('--grid_project_path', type=str, required=True, help='Path to the resource directory of grid project')
     parser.add_argument('--meta_file_name', type=str, required=True,  help='Name of the meta information file of the grid project')
+    parser.add_argument('--storage', type=str, default='dataframe', choices=['dataframe', 'bitset'], help='Storage engine of grid states')
+    parser.add_argument('--lazy_load', type=str, default='False', help='Memory-map the grid file and load levels on demand (bitset storage only)')
+    parser.add_argument('--edit_log', type=str, default='False', help='Persist edits in an append-only log, compacted into the grid file on save')
+    parser.add_argument('--file_format', type=str, default='arrow', choices=['arrow', 'segment'], help='Format the grid file is saved in')
+    parser.add_argument('--compression', type=str, default='none', choices=['none', 'zstd', 'lz4'], help='Compression of grid file segments (segment format only)')
+    parser.add_argument('--autosave_interval', type=float, default=0, help='Seconds between background saves of the grid file, 0 to disable')
+    parser.add_argument('--autosave_edits', type=int, default=0, help='Number of pending edits triggering a background save of the grid file, 0 to disable')
+    parser.add_argument('--history_budget', type=int, default=64 * 1024 * 1024, help='Memory budget (bytes) of the undo / redo history, 0 to disable undo / redo')
     args = parser.parse_args()
     
     # Rename
@@ -30,6 +38,14 @@ if __name__ == '__main__':
     schema_file_path = args.schema_file_path
     grid_project_path = args.grid_project_path
     meta_file_name = args.meta_file_name
+    storage = args.storage
+    lazy_load = args.lazy_load == 'True'
+    edit_log = args.edit_log == 'True'
+    history_budget = args.history_budget
+    file_format = args.file_format
+    compression = args.compression
+    autosave_interval = args.autosave_interval
+    autosave_edits = args.autosave_edits
     
     # Get info from schema file
     schema = json.load(open(schema_file_path, 'r'))
@@ -68,7 +84,8 @@ if __name__ == '__main__':
     
     # Init CRM
     crm = Topo(
-        epsg, bounds, first_size, subdivide_rules, grid_file_path
+        epsg, bounds, first_size, subdivide_rules, grid_file_path, storage, lazy_load, edit_log, history_budget, file_format, compression,
+        autosave_interval, autosave_edits
     )
     
     # Launch CRM server
@@ -68,6 +68,14 @@ def create_patch(project_name: str, patch_data: PatchMeta):
                     'schema_file_path': str(schema_file_path),
                     'grid_project_path': str(project_path / patch_data.name),
                     'meta_file_name': settings.GRID_PATCH_META_FILE_NAME,
+                    'storage': settings.GRID_PATCH_STORAGE,
+                    'lazy_load': settings.GRID_PATCH_LAZY_LOAD,
+                    'edit_log': settings.GRID_PATCH_EDIT_LOG,
+                    'history_budget': settings.GRID_PATCH_HISTORY_BUDGET,
+                    'file_format': settings.GRID_PATCH_FILE_FORMAT,
+                    'compression': settings.GRID_PATCH_COMPRESSION,
+                    'autosave_interval': settings.GRID_PATCH_AUTOSAVE_INTERVAL,
+                    'autosave_edits': settings.GRID_PATCH_AUTOSAVE_EDITS,
                 }
             )
             # - feature
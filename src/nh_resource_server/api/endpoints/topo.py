@@ -1,18 +1,16 @@
 import logging
 import c_two as cc
-import multiprocessing as mp
 
 from pathlib import Path
-from osgeo import ogr, osr
-from functools import partial
 from fastapi import APIRouter, Response, HTTPException, Body
 
 from ...schemas import grid, base
 from ...core.bootstrapping_treeger import BT
+from ...core.picking import pick_grids, pick_active_grids
 from ...core.config import settings, APP_CONTEXT
 from ...schemas.project import ResourceCRMStatus
 
-from icrms.itopo import ITopo, GridSchema, TopoSaveInfo
+from icrms.itopo import ITopo, GridChanges, TopoSaveInfo
 
 # APIs for grid topology operations ################################################
 
@@ -117,6 +115,70 @@ def deleted_grid_infos():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Failed to get deleted grid information: {str(e)}')
 
+@router.get('/bbox-info', response_class=Response, response_description='Returns active grid information within a bounding box in bytes. Format: [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
+def bbox_grid_info(min_x: float, min_y: float, max_x: float, max_y: float):
+    """
+    Description
+    --
+    Get active grids intersecting a bounding box (e.g. the map viewport), in the coordinate system of the grid.
+    """
+    if min_x > max_x or min_y > max_y:
+        raise HTTPException(status_code=400, detail=f'Invalid bounding box: [{min_x}, {min_y}, {max_x}, {max_y}]')
+    
+    try:
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            levels, global_ids = topo.get_active_grid_infos_in_bbox([min_x, min_y, max_x, max_y])
+        grid_infos = grid.MultiGridInfo(levels=levels, global_ids=global_ids)
+        
+        return Response(
+            content=grid_infos.combine_bytes(),
+            media_type='application/octet-stream'
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to get active grid information within bounding box: {str(e)}')
+
+@router.get('/tile/{z}/{x}/{y}', response_class=Response, response_description='Returns grid information of a tile in bytes. Format: [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
+def tile_grid_info(z: int, x: int, y: int):
+    """
+    Description
+    --
+    Get active grids intersecting a tile, tiles split the grid bounds in 2^z x 2^z tiles (x counted from west, y counted from north).  
+    Grids too fine to be seen at the zoom of the tile are summarised by their ancestors.
+    """
+    if z < 0 or not (0 <= x < (1 << z)) or not (0 <= y < (1 << z)):
+        raise HTTPException(status_code=400, detail=f'Invalid tile: {z}/{x}/{y}')
+    
+    try:
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            levels, global_ids = topo.get_active_grid_infos_in_tile(z, x, y)
+        grid_infos = grid.MultiGridInfo(levels=levels, global_ids=global_ids)
+        
+        return Response(
+            content=grid_infos.combine_bytes(),
+            media_type='application/octet-stream'
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to get grid information of tile {z}/{x}/{y}: {str(e)}')
+
+@router.get('/delta-info', response_class=Response, response_description='Returns grids changed since a version in bytes. Format: activated, deactivated and deleted grids one after another, each as [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
+def delta_grid_info(version: int = -1):
+    """
+    Description
+    --
+    Get grids activated, deactivated and deleted since the provided edit version.  
+    The edit version of the returned changes is set in the `X-Topo-Version` header, pass it as `version` in the next call.  
+    If the version is unknown to the topo (e.g. omitted, or issued before the topo restarted), 
+    the complete active and deleted grid sets are returned and the `X-Topo-Delta-Full` header is `true`, 
+    clients should then replace their local grid sets instead of patching them.
+    """
+    try:
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            changes: GridChanges = topo.get_grid_changes(version)
+        return _changes_response(changes)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to get grid changes: {str(e)}')
+
 @router.post('/subdivide', response_class=Response, response_description='Returns subdivided grid information in bytes. Format: [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
 def subdivide_grids(grid_info_bytes: bytes = Body(..., description='Grid information in bytes. Format: [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')):
     try:
@@ -191,131 +253,144 @@ def pick_grids_by_feature(feature_dir: str):
     Pick grids based on features from a .shp or .geojson file.
     The feature_dir parameter should be a path to the feature file accessible by the server.
     """
-    # Validate the feature_dir parameter
-    feature_file = Path(feature_dir)
-    file_extension = feature_file.suffix.lower()
-    if file_extension not in ['.shp', '.geojson']:
-        raise HTTPException(status_code=400, detail=f'Unsupported file type: {file_extension}. Must be .shp or .geojson.')
-    if not feature_file.exists() or not feature_file.is_file():
-        raise HTTPException(status_code=404, detail=f'Feature file not found: {feature_dir}')
-
+    feature_file = _get_feature_file(feature_dir)
     try:
-        # Step 1: Prepare target spatial reference
-        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
-            schema: GridSchema = topo.get_schema()
-        target_epsg: int = schema.epsg
-        target_sr = osr.SpatialReference()
-        target_sr.ImportFromEPSG(target_epsg)
-        # Ensure axis order is as expected by WKT (typically X, Y or Lon, Lat)
-        # For EPSG > 4000, it's often Lat, Lon. For WKT, it's usually Lon, Lat.
-        # OGR/GDAL 3+ handles this better, but being explicit can help.
-        if int(osr.GetPROJVersionMajor()) >= 3:
-            target_sr.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-        
-        # Step 2: Get all features from the file
-        ogr_features = []
-        ogr_geometries = []
+        # Pick active grids touched by the features, reusing the result of previous picks with the same feature file
+        topo_node = _get_current_topo_node()
+        with BT.instance.connect(topo_node, ITopo) as topo:
+            picked_levels, picked_global_ids = pick_active_grids(topo, topo_node, feature_file)
+        if len(picked_levels) == 0:
+            logging.info(f'No active grids found within the features from {feature_dir}')
+
+        picked_info = grid.MultiGridInfo(levels=picked_levels, global_ids=picked_global_ids)
+        return Response(
+            content=picked_info.combine_bytes(),
+            media_type='application/octet-stream'
+        )
         
-        # Set up GDAL/OGR data source
-        data_source = ogr.Open(str(feature_file))
-        if data_source is None:
-            logging.error(f'GDAL/OGR could not open feature file: {feature_dir}')
-            raise HTTPException(status_code=500, detail=f'Could not open feature file: {feature_dir}')
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to pick grids by feature: {str(e)}')
 
-        for i in range(data_source.GetLayerCount()):
-            layer = data_source.GetLayer(i)
-            if layer is None:
-                logging.warning(f'Could not get layer {i} from {feature_dir}')
-                continue
-            
-            # Check if the layer has a same spatial reference as the target EPSG
-            source_sr = layer.GetSpatialRef()
-            if source_sr and target_sr:
-                if not source_sr.IsSame(target_sr):
-                    raise HTTPException(status_code=500, detail=f'Provided feature file has different EPSG {source_sr.GetAttrValue("AUTHORITY", 1)} than the target EPSG: {target_epsg}')
-            elif not source_sr:
-                raise HTTPException(status_code=500, detail=f'Layer {i} in {feature_dir} has no spatial reference.')
+@router.post('/pick/{operation}', response_class=Response, response_description='Returns grid information changed by the operation in bytes. Format: [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
+def pick_and_apply(operation: str, feature_dir: str):
+    """
+    Description
+    --
+    Pick grids based on features from a .shp or .geojson file and apply an operation to them, without sending picked grids to the client.  
+    Operations:
+    - subdivide: subdivide picked active grids, returns the created children
+    - delete: delete picked active grids, returns the deleted grids
+    - merge: merge picked active grids into their parents, returns the activated parents
+    - recover: recover picked deleted grids, returns the recovered grids
+    """
+    if operation not in ('subdivide', 'delete', 'merge', 'recover'):
+        raise HTTPException(status_code=400, detail=f'Unsupported operation: {operation}. Must be subdivide, delete, merge or recover.')
+    feature_file = _get_feature_file(feature_dir)
+    
+    try:
+        topo_node = _get_current_topo_node()
+        with BT.instance.connect(topo_node, ITopo) as topo:
+            if operation == 'recover':
+                deleted_levels, deleted_global_ids = topo.get_deleted_grid_infos()
+                levels, global_ids = pick_grids(feature_file, topo.get_schema(), deleted_levels, deleted_global_ids)
+            else:
+                levels, global_ids = pick_active_grids(topo, topo_node, feature_file)
             
-            # Iterate through features in the layer and extract geometries
-            feature = layer.GetNextFeature()
-            while feature:
-                geom = feature.GetGeometryRef()
-                if geom:
-                    ogr_geometries.append(geom)
-                ogr_features.append(feature)
-                feature = layer.GetNextFeature()
+            if len(levels) > 0:
+                if operation == 'subdivide':
+                    levels, global_ids = topo.subdivide_grids(levels, global_ids)
+                elif operation == 'merge':
+                    levels, global_ids = topo.merge_multi_grids(levels, global_ids)
+                elif operation == 'delete':
+                    topo.delete_grids(levels, global_ids)
+                else:
+                    topo.recover_multi_grids(levels, global_ids)
+        
+        changed_info = grid.MultiGridInfo(levels=levels, global_ids=global_ids)
+        return Response(
+            content=changed_info.combine_bytes(),
+            media_type='application/octet-stream'
+        )
         
-        if not ogr_geometries:
-            logging.warning(f'No geometries found or extracted from feature file: {feature_dir}')
-            raise HTTPException(status_code=400, detail=f'No geometries found in feature file: {feature_dir}')
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to {operation} grids picked by feature: {str(e)}')
 
-        # Step 3: Get centers of all active grids
+@router.post('/undo', response_class=Response, response_description='Returns grids flipped back by the undo in bytes. Format: activated, deactivated and deleted grids one after another, each as [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
+def undo_edit():
+    """
+    Description
+    --
+    Revert the last edit (subdivide, merge, delete or recover) of the topo.  
+    The response has the same format and headers as `/topo/delta-info`, all blocks are empty if there is nothing to undo.
+    """
+    try:
         with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
-            active_levels, active_global_ids = topo.get_active_grid_infos()
-            
-            if not active_levels or not active_global_ids:
-                logging.info(f'No active grids found to check against features from {feature_dir}')
-                return Response(
-                    content=grid.MultiGridInfo(levels=[], global_ids=[]).combine_bytes(),
-                    media_type='application/octet-stream'
-                )
-            bboxes: list[float]  = topo.get_multi_grid_bboxes(active_levels, active_global_ids)
+            changes: GridChanges = topo.undo()
+        return _changes_response(changes)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to undo edit: {str(e)}')
 
-        # Step 3: Pick grids, centers of which are within the features, accelerate with multiprocessing
-        picked_grids_levels: list[int] = []
-        picked_grids_global_ids: list[int] = []
-        
-        # Batch processing
-        n_cores = mp.cpu_count()
-        total_grids = len(bboxes) // 4
-        points_per_process = max(1000, total_grids // (n_cores * 2))
-        batches = []
-        for i in range(0, total_grids, points_per_process):
-            end_idx = min(i + points_per_process, total_grids)
-            batch_indices = list(range(i, end_idx))
-            batch_bboxes = bboxes[i * 4:end_idx * 4]
-            batch_levels = [active_levels[idx] for idx in batch_indices]
-            batch_global_ids = [active_global_ids[idx] for idx in batch_indices]
-            batches.append((batch_indices, batch_bboxes, batch_levels, batch_global_ids))
-        
-        geometry_wkts = [geom.ExportToWkt() for geom in ogr_geometries]    
-        process_func = partial(_process_grid_batch, geometry_wkts=geometry_wkts)
-        with mp.Pool(processes=min(n_cores, len(batches))) as pool:
-            results = pool.map(process_func, batches)
-            
-            for batch_levels, batch_global_ids in results:
-                picked_grids_levels.extend(batch_levels)
-                picked_grids_global_ids.extend(batch_global_ids)
+@router.post('/redo', response_class=Response, response_description='Returns grids flipped again by the redo in bytes. Format: activated, deactivated and deleted grids one after another, each as [4 bytes for length, followed by level bytes, followed by padding bytes, followed by global id bytes]')
+def redo_edit():
+    """
+    Description
+    --
+    Reapply the last undone edit of the topo, undone edits can no longer be redone after a new edit.  
+    The response has the same format and headers as `/topo/delta-info`, all blocks are empty if there is nothing to redo.
+    """
+    try:
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            changes: GridChanges = topo.redo()
+        return _changes_response(changes)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to redo edit: {str(e)}')
 
-        if not picked_grids_levels:
-            logging.info(f'No active grid centers found within the features from {feature_dir}')
-            return Response(
-                content=grid.MultiGridInfo(levels=[], global_ids=[]).combine_bytes(),
-                media_type='application/octet-stream'
-            )
+@router.get('/branches', response_model=list[str])
+def get_branches():
+    """
+    Get names of all branches of the topo, the checked out branch first.
+    """
+    try:
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            return topo.get_branches()
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to get branches: {str(e)}')
 
-        picked_info = grid.MultiGridInfo(levels=picked_grids_levels, global_ids=picked_grids_global_ids)
-        return Response(
-            content=picked_info.combine_bytes(),
-            media_type='application/octet-stream'
+@router.post('/branches/{branch_name}/{operation}', response_model=base.BaseResponse)
+def operate_branch(branch_name: str, operation: str):
+    """
+    Description
+    --
+    Operate a branch of the topo. Branches share the grids of the main branch and keep only the grids edited on them.  
+    Operations:
+    - create: create a branch of the main branch
+    - checkout: make the branch (or `main`) the target of all following queries and edits
+    - commit: apply the edits of the branch to the main branch and remove the branch
+    - discard: remove the branch without applying its edits
+    """
+    if operation not in ('create', 'checkout', 'commit', 'discard'):
+        raise HTTPException(status_code=400, detail=f'Unsupported operation: {operation}. Must be create, checkout, commit or discard.')
+    
+    try:
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            if operation == 'create':
+                result: TopoSaveInfo = topo.create_branch(branch_name)
+            elif operation == 'checkout':
+                result = topo.checkout_branch(branch_name)
+            elif operation == 'commit':
+                result = topo.commit_branch(branch_name)
+            else:
+                result = topo.discard_branch(branch_name)
+        return base.BaseResponse(
+            success=result.success,
+            message=result.message
         )
-        
+    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'Failed to pick grids by feature: {str(e)}')
-    finally:
-        # Clean up
-        for feature in ogr_features:
-            if feature:
-                feature.Destroy()
-        ogr_features.clear()
-        ogr_geometries.clear()
-        
-        if target_sr:
-            target_sr = None
-        if source_sr:
-            source_sr = None
-        if data_source:
-            data_source = None
+        raise HTTPException(status_code=500, detail=f'Failed to {operation} branch: {str(e)}')
 
 @router.get('/save', response_model=base.BaseResponse)
 def save_grids():
@@ -334,43 +409,61 @@ def save_grids():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Failed to save grid: {str(e)}')
     
+@router.post('/mesh', response_model=base.BaseResponse)
+def export_mesh():
+    """
+    Export the NE (grid) and NS (edge) tables of active grids to binary files that solutions can memory-map.  
+    Files are written in the directory of the current patch, named after GRID_PATCH_NE_FILE_NAME and GRID_PATCH_NS_FILE_NAME.
+    """
+    project_name, patch_name = APP_CONTEXT.get('current_project'), APP_CONTEXT.get('current_patch')
+    if not project_name or not patch_name:
+        raise HTTPException(status_code=404, detail='No grid patch is set as the current resource')
+    patch_dir = Path(settings.GRID_PROJECT_DIR, project_name, patch_name)
+    if not patch_dir.exists():
+        raise HTTPException(status_code=404, detail=f'Grid patch ({patch_name}) belonging to project ({project_name}) not found')
+    
+    try:
+        ne_path = str((patch_dir / settings.GRID_PATCH_NE_FILE_NAME).resolve())
+        ns_path = str((patch_dir / settings.GRID_PATCH_NS_FILE_NAME).resolve())
+        with BT.instance.connect(_get_current_topo_node(), ITopo) as topo:
+            result: TopoSaveInfo = topo.export_mesh(ne_path, ns_path)
+            logging.info(f'Mesh exported: {result}')
+        return base.BaseResponse(
+            success=result.success,
+            message=result.message
+        )
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Failed to export mesh: {str(e)}')
+    
 # Helpers ##################################################
 
 def _get_current_topo_node():
     return f'root/projects/{APP_CONTEXT.get("current_project")}/{APP_CONTEXT.get("current_patch")}/topo'
 
-def _process_grid_batch(batch_data, geometry_wkts):
-    # _ is batch_indices
-    _, batch_boxes, batch_levels, batch_global_ids = batch_data
-    
-    geometries = [ogr.CreateGeometryFromWkt(wkt) for wkt in geometry_wkts]
-    picked_levels = []
-    picked_global_ids = []
-    
-    box_geometry = ogr.Geometry(ogr.wkbPolygon)
-    ring = ogr.Geometry(ogr.wkbLinearRing)
-    for i in range(len(batch_boxes) // 4):
-        bbox = batch_boxes[i * 4:i * 4 + 4]
-        minX, minY, maxX, maxY = bbox
-        ring.Empty()
-        ring.AddPoint(minX, minY)
-        ring.AddPoint(maxX, minY)
-        ring.AddPoint(maxX, maxY)
-        ring.AddPoint(minX, maxY)
-        ring.AddPoint(minX, minY) 
-        
-        box_geometry.Empty()
-        box_geometry.AddGeometry(ring)
-        
-        for geom in geometries:
-            if geom.Intersects(box_geometry) or geom.Contains(box_geometry):
-                picked_levels.append(batch_levels[i])
-                picked_global_ids.append(batch_global_ids[i])
-                break
-    
-    ring.Destroy()
-    box_geometry.Destroy()
-    for geom in geometries:
-        geom.Destroy()
-    
-    return picked_levels, picked_global_ids
+def _changes_response(changes: GridChanges) -> Response:
+    """Encode grid changes as activated, deactivated and deleted grid blocks"""
+    activated = changes.activate & ~changes.deleted
+    deactivated = ~changes.activate & ~changes.deleted
+    content = b''.join(
+        grid.MultiGridInfo(levels=changes.levels[mask], global_ids=changes.global_ids[mask]).combine_bytes()
+        for mask in (activated, deactivated, changes.deleted)
+    )
+    return Response(
+        content=content,
+        media_type='application/octet-stream',
+        headers={
+            'X-Topo-Version': str(changes.version),
+            'X-Topo-Delta-Full': 'true' if changes.full else 'false'
+        }
+    )
+
+def _get_feature_file(feature_dir: str) -> Path:
+    """Validate the path of a feature file to pick grids with"""
+    feature_file = Path(feature_dir)
+    file_extension = feature_file.suffix.lower()
+    if file_extension not in ['.shp', '.geojson']:
+        raise HTTPException(status_code=400, detail=f'Unsupported file type: {file_extension}. Must be .shp or .geojson.')
+    if not feature_file.exists() or not feature_file.is_file():
+        raise HTTPException(status_code=404, detail=f'Feature file not found: {feature_dir}')
+    return feature_file
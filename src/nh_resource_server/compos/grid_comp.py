@@ -1,29 +1,29 @@
 import c_two as cc
 import numpy as np
-from icrms.itopo import ITopo, GridAttribute
+from icrms.itopo import ITopo, GridAttributes
 
 @cc.compo.runtime.connect
-def get_grid_infos(grid: ITopo, level: int, global_ids: list[int]) -> list[GridAttribute]:
+def get_grid_infos(grid: ITopo, level: int, global_ids: list[int]) -> GridAttributes:
     """Method to get information for a set of grids at the same level
     
     [DO NOT CALL DIRECTLY FROM LLM] - Use the flow() function instead
     
-    The complete data includes GridAttribute objects with these properties:
-    - level: grid level in the hierarchy
-    - global_id: unique global identifier
-    - local_id: local identifier
-    - type: grid type
-    - elevation: elevation value
-    - deleted: deletion status flag
-    - activate: activation status flag
-    - min_x, min_y, max_x, max_y: grid boundary coordinates
+    The complete data is a columnar GridAttributes object with these array properties:
+    - levels: grid levels in the hierarchy
+    - global_ids: unique global identifiers
+    - local_ids: local identifiers
+    - types: grid types
+    - elevations: elevation values
+    - deleted: deletion status flags
+    - activate: activation status flags
+    - min_xs, min_ys, max_xs, max_ys: grid boundary coordinates
     
     Args:
         level (int): Level of the grids to fetch (all grids must be at same level)
         global_ids (list[int]): List of global IDs for the target grids
         
     Returns:
-        list[GridAttribute]: List of grid attribute objects containing complete grid information
+        GridAttributes: Columnar grid attributes containing complete grid information
     """
     return grid.get_grid_infos(level, global_ids)
 
@@ -56,7 +56,7 @@ def subdivide_grids(grid: ITopo, levels: list[int], global_ids: list[int]) -> tu
 
 
 @cc.compo.runtime.connect
-def get_active_grid_infos(crm: ITopo) -> tuple[list[int], list[int]]:
+def get_active_grid_infos(crm: ITopo) -> tuple[np.ndarray, np.ndarray]:
     """
     Retrieves information about all active grids in the grid component.
     
@@ -70,10 +70,10 @@ def get_active_grid_infos(crm: ITopo) -> tuple[list[int], list[int]]:
             The grid component interface instance to query.
 
     Returns:
-        tuple[list[int], list[int]]
-            A tuple containing two lists:
-            - The first list contains the global IDs of all active grids
-            - The second list contains the level values of all active grids
+        tuple[np.ndarray, np.ndarray]
+            A tuple containing two arrays:
+            - The first array contains the level values (uint8) of all active grids
+            - The second array contains the global IDs (uint32) of all active grids
     """
     return crm.get_active_grid_infos()
 
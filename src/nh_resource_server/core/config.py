@@ -36,6 +36,7 @@ class Settings(BaseSettings):
 
     # Feature related constants
     FEATURE_RESOURCE_POOL_META_FILE_NAME: str = 'resource_pool.meta.json'
+    PICK_POOL_SIZE: int = 0 # worker processes picking grids by features, 0 for one per CPU
     
     # Grid schema related constants
     GRID_SCHEMA_DIR: str = 'resource/schemas/'
@@ -47,8 +48,18 @@ class Settings(BaseSettings):
     
     # Grid-related constants
     GRID_PATCH_TEMP: str = 'False'
+    GRID_PATCH_STORAGE: str = 'dataframe' # storage engine of the topo CRM: 'dataframe' or 'bitset'
+    GRID_PATCH_LAZY_LOAD: str = 'False' # memory-map the topo file and load levels on demand (bitset storage only)
+    GRID_PATCH_EDIT_LOG: str = 'False' # persist topo edits in an append-only log, compacted into the topo file on save
+    GRID_PATCH_HISTORY_BUDGET: str = '67108864' # memory budget (bytes) of the topo undo / redo history, '0' to disable undo / redo
+    GRID_PATCH_FILE_FORMAT: str = 'arrow' # format the topo file is saved in: 'arrow' or 'segment' (per-level compact segments)
+    GRID_PATCH_COMPRESSION: str = 'none' # compression of topo file segments: 'none', 'zstd' or 'lz4'
+    GRID_PATCH_AUTOSAVE_INTERVAL: str = '0' # seconds between background saves of the topo file, '0' to disable
+    GRID_PATCH_AUTOSAVE_EDITS: str = '0' # number of pending topo edits triggering a background save, '0' to disable
     GRID_PATCH_META_FILE_NAME: str = 'patch.meta.json'
     GRID_PATCH_TOPOLOGY_FILE_NAME: str = 'patch.topo.arrow'
+    GRID_PATCH_NE_FILE_NAME: str = 'patch.ne.arrow' # NE (grid) table exported from the patch topo for solutions
+    GRID_PATCH_NS_FILE_NAME: str = 'patch.ns.arrow' # NS (edge) table exported from the patch topo for solutions
 
     # Solution related constants
     SOLUTION_DIR: str = 'resource/solutions/'
@@ -0,0 +1,185 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from icrms.itopo import GridTopology
+from icrms.isolution import NeData, NsData, ListColumn
+
+# Const ##############################
+
+ARROW_MAGIC = b'ARROW1'
+
+# Sides of a grid, numbered as the NE columns nsl1..nsl4 / isl1..isl4
+SIDE_WEST = 1
+SIDE_EAST = 2
+SIDE_SOUTH = 3
+SIDE_NORTH = 4
+
+# Directions of an edge, as the first value of the NS column ise
+EDGE_HORIZONTAL = 1 # between a bottom and a top grid
+EDGE_VERTICAL = 2   # between a left and a right grid
+
+DEFAULT_ELEVATION = 0.0 # elevation is not part of the topology, filled with this value
+DEFAULT_TYPE = 0        # under_suf of grids and s_type of edges, not part of the topology either
+
+NE_SCHEMA: pa.Schema = pa.schema([
+    ('grid_id', pa.int32()),
+    ('nsl1', pa.int32()),
+    ('nsl2', pa.int32()),
+    ('nsl3', pa.int32()),
+    ('nsl4', pa.int32()),
+    ('isl1', pa.list_(pa.int32())),
+    ('isl2', pa.list_(pa.int32())),
+    ('isl3', pa.list_(pa.int32())),
+    ('isl4', pa.list_(pa.int32())),
+    ('xe', pa.float64()),
+    ('ye', pa.float64()),
+    ('ze', pa.float64()),
+    ('under_suf', pa.int32())
+])
+
+NS_SCHEMA: pa.Schema = pa.schema([
+    ('edge_id', pa.int32()),
+    ('ise', pa.list_(pa.int32(), 5)),
+    ('dis', pa.float64()),
+    ('x_side', pa.float64()),
+    ('y_side', pa.float64()),
+    ('z_side', pa.float64()),
+    ('s_type', pa.int32())
+])
+
+# Mesh Tables ##################################################
+
+def build_mesh_tables(topology: GridTopology, bboxes: np.ndarray) -> tuple[pa.Table, pa.Table]:
+    """Build the NE (grid) and NS (edge) tables of a solution from the topology of active grids
+
+    Grid ids and edge ids are 1-based positions in the topology, 0 standing for no grid.
+    Both tables start with a placeholder row of id 0 (as text NE / NS files are read), so that rows can be indexed by id.
+    NE: edges of each grid are listed per side (1 west, 2 east, 3 south, 4 north), ordered from south to north or from west to east.
+    NS: ise is [direction (1 horizontal, 2 vertical), left grid, right grid, bottom grid, top grid], dis is the length of the edge.
+
+    Args:
+        topology (GridTopology): active grids and their edges
+        bboxes (np.ndarray): (n, 4) bounding boxes of the active grids, as [min_x, min_y, max_x, max_y]
+
+    Returns:
+        tuple[pa.Table, pa.Table]: NE table (NE_SCHEMA) and NS table (NS_SCHEMA)
+    """
+    grid_count = len(topology.levels)
+    edge_count = len(topology.edge_directions)
+    grids_a = np.asarray(topology.edge_grids_a, dtype=np.int64)
+    grids_b = np.asarray(topology.edge_grids_b, dtype=np.int64)
+    vertical = np.asarray(topology.edge_directions) == 0
+    edge_ids = np.arange(1, edge_count + 1, dtype=np.int32)
+    with_placeholder = lambda values: np.concatenate([np.zeros((1, *np.shape(values)[1:]), dtype=np.asarray(values).dtype), values])
+
+    # NS: a vertical edge has a left (west) and a right (east) grid, a horizontal edge a bottom (south) and a top (north) grid
+    ids_a = (grids_a + 1).astype(np.int32)
+    ids_b = (grids_b + 1).astype(np.int32)
+    ise = np.column_stack([
+        np.where(vertical, EDGE_VERTICAL, EDGE_HORIZONTAL).astype(np.int32),
+        np.where(vertical, ids_a, 0),
+        np.where(vertical, ids_b, 0),
+        np.where(vertical, 0, ids_a),
+        np.where(vertical, 0, ids_b)
+    ]).astype(np.int32)
+    lengths = np.where(
+        vertical,
+        topology.edge_max_ys - topology.edge_min_ys,
+        topology.edge_max_xs - topology.edge_min_xs
+    )
+    ns_table = pa.Table.from_arrays([
+        pa.array(with_placeholder(edge_ids)),
+        pa.FixedSizeListArray.from_arrays(pa.array(with_placeholder(ise).ravel()), 5),
+        pa.array(with_placeholder(lengths), type=pa.float64()),
+        pa.array(with_placeholder((topology.edge_min_xs + topology.edge_max_xs) / 2.0), type=pa.float64()),
+        pa.array(with_placeholder((topology.edge_min_ys + topology.edge_max_ys) / 2.0), type=pa.float64()),
+        pa.array(np.full(edge_count + 1, DEFAULT_ELEVATION), type=pa.float64()),
+        pa.array(np.full(edge_count + 1, DEFAULT_TYPE, dtype=np.int32))
+    ], schema=NS_SCHEMA)
+
+    # NE: an edge lies on the east / north side of grid a and on the west / south side of grid b
+    has_a, has_b = grids_a >= 0, grids_b >= 0
+    side_grids = np.concatenate([ids_a[has_a], ids_b[has_b]]).astype(np.int64)
+    side_numbers = np.concatenate([
+        np.where(vertical, SIDE_EAST, SIDE_NORTH)[has_a],
+        np.where(vertical, SIDE_WEST, SIDE_SOUTH)[has_b]
+    ])
+    side_edges = np.concatenate([edge_ids[has_a], edge_ids[has_b]])
+    side_starts = np.where(vertical, topology.edge_min_ys, topology.edge_min_xs)
+    side_starts = np.concatenate([side_starts[has_a], side_starts[has_b]])
+    order = np.lexsort((side_starts, side_numbers, side_grids))
+    side_grids, side_numbers, side_edges = side_grids[order], side_numbers[order], side_edges[order]
+
+    side_counts = []
+    side_lists = []
+    for side in (SIDE_WEST, SIDE_EAST, SIDE_SOUTH, SIDE_NORTH):
+        on_side = side_numbers == side
+        counts = np.bincount(side_grids[on_side], minlength=grid_count + 1).astype(np.int32)
+        offsets = np.zeros(grid_count + 2, dtype=np.int32)
+        np.cumsum(counts, out=offsets[1:])
+        side_counts.append(pa.array(counts))
+        side_lists.append(pa.ListArray.from_arrays(pa.array(offsets), pa.array(side_edges[on_side], type=pa.int32())))
+
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    ne_table = pa.Table.from_arrays([
+        pa.array(np.arange(grid_count + 1, dtype=np.int32)),
+        *side_counts,
+        *side_lists,
+        pa.array(with_placeholder((bboxes[:, 0] + bboxes[:, 2]) / 2.0), type=pa.float64()),
+        pa.array(with_placeholder((bboxes[:, 1] + bboxes[:, 3]) / 2.0), type=pa.float64()),
+        pa.array(np.full(grid_count + 1, DEFAULT_ELEVATION), type=pa.float64()),
+        pa.array(np.full(grid_count + 1, DEFAULT_TYPE, dtype=np.int32))
+    ], schema=NE_SCHEMA)
+
+    return ne_table, ns_table
+
+# Mesh Files ##################################################
+
+def write_mesh_table(table: pa.Table, file_path: str):
+    """Write a mesh table as an Arrow IPC file, replacing the file atomically"""
+    temp_path = f'{file_path}.tmp'
+    with ipc.new_file(temp_path, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(temp_path, file_path)
+
+def is_mesh_file(file_path: str) -> bool:
+    """Tell whether a NE / NS file is a binary mesh file rather than a text file"""
+    with open(file_path, 'rb') as f:
+        return f.read(len(ARROW_MAGIC)) == ARROW_MAGIC
+
+def read_mesh_table(file_path: str) -> pa.Table:
+    """Read a mesh table by memory-mapping its file"""
+    return ipc.open_file(pa.memory_map(file_path, 'r')).read_all()
+
+def read_ne(file_path: str) -> NeData:
+    """Read a binary NE file as read-only NumPy views over the memory-mapped columns, indexed by grid id"""
+    table = read_mesh_table(file_path)
+    return NeData(*[_column_view(table.column(name)) for name in NE_SCHEMA.names])
+
+def read_ns(file_path: str) -> NsData:
+    """Read a binary NS file as read-only NumPy views over the memory-mapped columns, indexed by edge id"""
+    table = read_mesh_table(file_path)
+    return NsData(*[_column_view(table.column(name)) for name in NS_SCHEMA.names])
+
+def ne_from_lists(*columns: list) -> NeData:
+    """Build NE data of the same column types as read_ne from per-row lists (in NE_SCHEMA order), e.g. parsed from a text NE file"""
+    table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, NE_SCHEMA)], schema=NE_SCHEMA)
+    return NeData(*[_column_view(table.column(name)) for name in NE_SCHEMA.names])
+
+def ns_from_lists(*columns: list) -> NsData:
+    """Build NS data of the same column types as read_ns from per-row lists (in NS_SCHEMA order), e.g. parsed from a text NS file"""
+    table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, NS_SCHEMA)], schema=NS_SCHEMA)
+    return NsData(*[_column_view(table.column(name)) for name in NS_SCHEMA.names])
+
+# Helpers ##################################################
+
+def _column_view(column: pa.ChunkedArray) -> np.ndarray | ListColumn:
+    """View a column without copying: primitive columns as arrays, fixed size lists as 2D arrays, lists as ListColumn"""
+    array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    if pa.types.is_fixed_size_list(array.type):
+        return array.flatten().to_numpy().reshape(-1, array.type.list_size)
+    if pa.types.is_list(array.type):
+        return ListColumn(array.offsets.to_numpy(), array.values.to_numpy())
+    return array.to_numpy()
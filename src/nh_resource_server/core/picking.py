@@ -0,0 +1,339 @@
+import logging
+import threading
+import numpy as np
+import multiprocessing as mp
+from pathlib import Path
+from collections import OrderedDict
+from multiprocessing.pool import Pool
+from osgeo import gdal, ogr, osr
+
+from icrms.itopo import ITopo, GridSchema, GridChanges
+
+logger = logging.getLogger(__name__)
+
+# Const ##############################
+
+RASTER_BLOCK_PIXELS = 1 << 26 # max pixels rasterized at once (64 MB of uint8)
+RASTER_TILE_SIZE = 4096 # side (in grids) of the tiles of a level rasterized separately
+PICK_TASK_MIN_SIZE = 10000 # min number of candidate grids per picking task
+FEATURE_CACHE_SIZE = 8 # number of opened feature files cached per process
+PICK_CACHE_SIZE = 16 # number of pick results cached
+
+# Pool ##################################################
+
+# Long-lived worker pool shared by all picking requests, started and closed with the app
+_pool: Pool | None = None
+_pool_processes = 0
+
+# Opened feature files of the current process, keyed by (path, mtime, epsg)
+_feature_cache: OrderedDict[tuple[str, int, int], 'FeatureSet'] = OrderedDict()
+_feature_cache_lock = threading.Lock()
+
+def start_pick_pool(processes: int = 0):
+    """Start the picking worker pool, using one worker per CPU if processes is 0"""
+    global _pool, _pool_processes
+    if _pool is None:
+        processes = processes or mp.cpu_count()
+        _pool = mp.Pool(processes=processes)
+        _pool_processes = processes
+        logger.info(f'Started picking pool with {processes} workers')
+
+def close_pick_pool():
+    global _pool, _pool_processes
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _pool_processes = 0
+
+# Picking ##################################################
+
+def pick_grids(feature_file: Path, schema: GridSchema, levels: np.ndarray, global_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Pick grids intersecting features of a .shp or .geojson file
+
+    Instead of testing each grid against each geometry, features are rasterized onto the regular grid of each level
+    (one pixel per grid, all touched pixels burned), and grids are picked by indexing the raster.  
+    Only candidates within feature envelopes are tested, and only tiles of the level holding them are rasterized.  
+    Candidates of each level are split into one task per pool worker (of at least PICK_TASK_MIN_SIZE grids) of rows of the level,
+    run by the picking pool if it is started, or into a single task run in the current process otherwise.
+
+    Args:
+        feature_file (Path): path of the feature file
+        schema (GridSchema): schema of the grid
+        levels (np.ndarray): levels of candidate grids
+        global_ids (np.ndarray): global ids of candidate grids
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: levels and global ids of the picked grids
+    """
+    feature_path = str(feature_file)
+    mtime = feature_file.stat().st_mtime_ns
+    level_sizes = get_level_sizes(schema.subdivide_rules)
+    
+    # Split candidates into tasks, sorting global ids so that each task covers a narrow band of rows
+    tasks = []
+    task_positions: list[np.ndarray] = []
+    for level in np.unique(levels):
+        level = int(level)
+        positions = np.flatnonzero(levels == level)
+        positions = positions[np.argsort(global_ids[positions], kind='stable')]
+        width, height = level_sizes[level]
+        task_count = max(1, min(_pool_processes, len(positions) // PICK_TASK_MIN_SIZE))
+        for chunk in np.array_split(positions, task_count):
+            tasks.append((feature_path, mtime, schema.epsg, schema.bounds, width, height, global_ids[chunk]))
+            task_positions.append(chunk)
+    
+    if _pool is not None:
+        results = _pool.map(_pick_task, tasks)
+    else:
+        with _feature_cache_lock:
+            results = [_pick_task(task) for task in tasks]
+    
+    picked = np.zeros(len(levels), dtype=np.bool_)
+    for positions, task_picked in zip(task_positions, results):
+        picked[positions] = task_picked
+    return levels[picked], global_ids[picked]
+
+def pick_active_grids(topo: ITopo, topo_node: str, feature_file: Path) -> tuple[np.ndarray, np.ndarray]:
+    """Pick active grids of a topo intersecting features of a .shp or .geojson file, reusing cached results
+
+    Picked grids are cached by (topo node, feature file, feature file mtime and size) along with the topo edit version they were picked at.  
+    A cached result is brought up to date by re-picking only the grids changed since its version.
+
+    Args:
+        topo (ITopo): connected topo CRM
+        topo_node (str): node key of the topo, distinguishing topos sharing a feature file
+        feature_file (Path): path of the feature file
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: levels and global ids of the picked grids
+    """
+    stat = feature_file.stat()
+    cache_key = (topo_node, str(feature_file), stat.st_mtime_ns, stat.st_size)
+    cached = pick_cache.get(cache_key)
+    
+    # Changes since the cached version, or a snapshot of all grids if nothing is cached
+    changes: GridChanges = topo.get_grid_changes(cached.version if cached else -1)
+    if cached is not None and not changes.full and len(changes.levels) == 0:
+        return _decode_keys(cached.keys)
+    
+    schema: GridSchema = topo.get_schema()
+    candidates = changes.activate
+    picked_levels, picked_global_ids = pick_grids(feature_file, schema, changes.levels[candidates], changes.global_ids[candidates])
+    picked_keys = _encode_keys(picked_levels, picked_global_ids)
+    if cached is not None and not changes.full:
+        # Keep cached grids not changed since, and add changed grids picked now
+        unchanged_keys = cached.keys[~np.isin(cached.keys, _encode_keys(changes.levels, changes.global_ids))]
+        picked_keys = np.union1d(unchanged_keys, picked_keys)
+    else:
+        picked_keys = np.sort(picked_keys)
+    
+    pick_cache.put(cache_key, PickResult(changes.version, picked_keys))
+    return _decode_keys(picked_keys)
+
+def get_level_sizes(subdivide_rules: list[list[int]]) -> list[tuple[int, int]]:
+    """Return (width, height) in grids of each level, the same way as the Topo CRM"""
+    level_sizes = [(1, 1)]
+    for rule in subdivide_rules[:-1]:
+        prev_width, prev_height = level_sizes[-1]
+        level_sizes.append((prev_width * rule[0], prev_height * rule[1]))
+    return level_sizes
+
+# Pick Cache ##################################################
+
+class PickResult:
+    """Sorted index keys (level << 32 | global_id) of picked grids and the topo edit version they were picked at"""
+    def __init__(self, version: int, keys: np.ndarray):
+        self.version = version
+        self.keys = keys
+
+class PickCache:
+    """Thread-safe LRU cache of pick results"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.results: OrderedDict[tuple, PickResult] = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key: tuple) -> PickResult | None:
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.results.move_to_end(key)
+            return result
+    
+    def put(self, key: tuple, result: PickResult):
+        with self.lock:
+            # Results of an outdated feature file are never hit again
+            for stale_key in [k for k in self.results if k[:2] == key[:2] and k != key]:
+                del self.results[stale_key]
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.capacity:
+                self.results.popitem(last=False)
+
+pick_cache = PickCache(PICK_CACHE_SIZE)
+
+# Features ##################################################
+
+class FeatureSet:
+    """
+    Opened feature file with the envelopes of its features.  
+    Envelopes let picking skip grids far from any feature with NumPy comparisons before rasterizing.
+    """
+    def __init__(self, data_source: ogr.DataSource):
+        self.data_source = data_source
+        self.layers: list[ogr.Layer] = [data_source.GetLayer(i) for i in range(data_source.GetLayerCount())]
+        
+        envelopes = []
+        for layer in self.layers:
+            layer.ResetReading()
+            feature = layer.GetNextFeature()
+            while feature:
+                geometry = feature.GetGeometryRef()
+                if geometry is not None and not geometry.IsEmpty():
+                    envelopes.append(geometry.GetEnvelope()) # (min_x, max_x, min_y, max_y)
+                feature = layer.GetNextFeature()
+            layer.ResetReading()
+        if not envelopes:
+            raise ValueError(f'No geometries found in feature file: {data_source.GetName()}')
+        self.envelopes = np.array(envelopes, dtype=np.float64)
+
+# Helpers ##################################################
+
+def _encode_keys(levels: np.ndarray, global_ids: np.ndarray) -> np.ndarray:
+    return (levels.astype(np.uint64) << np.uint64(32)) | global_ids.astype(np.uint64)
+
+def _decode_keys(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return (keys >> np.uint64(32)).astype(np.uint8), (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+def _pick_task(task: tuple) -> np.ndarray:
+    """Picking task run by the pool workers, return the mask of picked candidates"""
+    feature_path, mtime, epsg, bounds, width, height, global_ids = task
+    feature_set = _get_feature_set(feature_path, mtime, epsg)
+    return _pick_level(feature_set, bounds, width, height, global_ids)
+
+def _get_feature_set(feature_path: str, mtime: int, epsg: int) -> FeatureSet:
+    """Return the opened feature file from the cache of the current process, opening it if it is not cached or has been modified"""
+    cache_key = (feature_path, mtime, epsg)
+    if cache_key in _feature_cache:
+        _feature_cache.move_to_end(cache_key)
+        return _feature_cache[cache_key]
+    
+    feature_set = FeatureSet(_open_feature_file(Path(feature_path), epsg))
+    _feature_cache[cache_key] = feature_set
+    if len(_feature_cache) > FEATURE_CACHE_SIZE:
+        _feature_cache.popitem(last=False)
+    return feature_set
+
+def _open_feature_file(feature_file: Path, target_epsg: int) -> ogr.DataSource:
+    """Open a feature file and check that all its layers are in the target spatial reference"""
+    data_source = ogr.Open(str(feature_file))
+    if data_source is None:
+        raise ValueError(f'GDAL/OGR could not open feature file: {feature_file}')
+
+    target_sr = osr.SpatialReference()
+    target_sr.ImportFromEPSG(target_epsg)
+    if int(osr.GetPROJVersionMajor()) >= 3:
+        target_sr.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    for i in range(data_source.GetLayerCount()):
+        layer = data_source.GetLayer(i)
+        source_sr = layer.GetSpatialRef()
+        if not source_sr:
+            raise ValueError(f'Layer {i} in {feature_file} has no spatial reference.')
+        if not source_sr.IsSame(target_sr):
+            raise ValueError(f'Provided feature file has different EPSG {source_sr.GetAttrValue("AUTHORITY", 1)} than the target EPSG: {target_epsg}')
+    return data_source
+
+def _pick_level(feature_set: FeatureSet, bounds: list[float], width: int, height: int, global_ids: np.ndarray) -> np.ndarray:
+    """Return a mask of the grids (of the same level) touched by the features"""
+    picked = np.zeros(len(global_ids), dtype=np.bool_)
+    global_ids = global_ids.astype(np.int64)
+    global_xs = global_ids % width
+    global_ys = global_ids // width
+    grid_width = (bounds[2] - bounds[0]) / width
+    grid_height = (bounds[3] - bounds[1]) / height
+
+    # Windows of grids covered by the envelope of each feature, clipped to the grids of the candidates
+    envelopes = feature_set.envelopes
+    x_starts = np.maximum(np.floor((envelopes[:, 0] - bounds[0]) / grid_width).astype(np.int64), global_xs.min())
+    x_stops = np.minimum(np.floor((envelopes[:, 1] - bounds[0]) / grid_width).astype(np.int64) + 1, global_xs.max() + 1)
+    y_starts = np.maximum(np.floor((envelopes[:, 2] - bounds[1]) / grid_height).astype(np.int64), global_ys.min())
+    y_stops = np.minimum(np.floor((envelopes[:, 3] - bounds[1]) / grid_height).astype(np.int64) + 1, global_ys.max() + 1)
+    valid = (x_starts < x_stops) & (y_starts < y_stops)
+    x_starts, x_stops, y_starts, y_stops = x_starts[valid], x_stops[valid], y_starts[valid], y_stops[valid]
+    
+    # Binary search the span of candidates (sorted by row, then column) within each row of each window
+    order = np.argsort(global_ids, kind='stable')
+    sorted_ids = global_ids[order]
+    heights = y_stops - y_starts
+    row_windows = np.repeat(np.arange(len(heights)), heights)
+    rows = y_starts[row_windows] + np.arange(len(row_windows)) - np.repeat(np.cumsum(heights) - heights, heights)
+    span_starts = np.searchsorted(sorted_ids, rows * width + x_starts[row_windows])
+    span_stops = np.searchsorted(sorted_ids, rows * width + x_stops[row_windows])
+    
+    # Candidates within any window
+    coverage = np.bincount(span_starts, minlength=len(sorted_ids) + 1) - np.bincount(span_stops, minlength=len(sorted_ids) + 1)
+    positions = order[np.cumsum(coverage[:-1]) > 0]
+    if len(positions) == 0:
+        return picked
+    
+    # Rasterize all features once per tile of the level holding such candidates, over the extent of the candidates in the tile
+    tile_columns = (width + RASTER_TILE_SIZE - 1) // RASTER_TILE_SIZE
+    tiles = (global_ys[positions] // RASTER_TILE_SIZE) * tile_columns + global_xs[positions] // RASTER_TILE_SIZE
+    tile_order = np.argsort(tiles, kind='stable')
+    positions, tiles = positions[tile_order], tiles[tile_order]
+    for tile_positions in np.split(positions, np.flatnonzero(np.diff(tiles)) + 1):
+        tile_xs, tile_ys = global_xs[tile_positions], global_ys[tile_positions]
+        picked[tile_positions] = _rasterize_window(
+            feature_set.layers, bounds, grid_width, grid_height,
+            int(tile_xs.min()), int(tile_xs.max()) + 1, int(tile_ys.min()), int(tile_ys.max()) + 1,
+            tile_xs, tile_ys
+        )
+
+    return picked
+
+def _rasterize_window(
+    layers: list[ogr.Layer], bounds: list[float], grid_width: float, grid_height: float,
+    x_start: int, x_stop: int, y_start: int, y_stop: int, global_xs: np.ndarray, global_ys: np.ndarray
+) -> np.ndarray:
+    """Rasterize features onto a window of grids and return whether each grid within the window is touched"""
+    touched = np.zeros(len(global_xs), dtype=np.bool_)
+    driver = gdal.GetDriverByName('MEM')
+    window_width = x_stop - x_start
+    block_rows = max(1, RASTER_BLOCK_PIXELS // window_width)
+    
+    # Only read features overlapping the window
+    for layer in layers:
+        layer.SetSpatialFilterRect(
+            bounds[0] + x_start * grid_width, bounds[1] + y_start * grid_height,
+            bounds[0] + x_stop * grid_width, bounds[1] + y_stop * grid_height
+        )
+    
+    # Rasterize the window block by block of rows, raster rows run from north to south
+    try:
+        for block_start in range(y_start, y_stop, block_rows):
+            block_stop = min(block_start + block_rows, y_stop)
+            in_block = (global_ys >= block_start) & (global_ys < block_stop)
+            if not in_block.any():
+                continue
+
+            dataset = driver.Create('', window_width, block_stop - block_start, 1, gdal.GDT_Byte)
+            dataset.SetGeoTransform((
+                bounds[0] + x_start * grid_width, grid_width, 0.0,
+                bounds[1] + block_stop * grid_height, 0.0, -grid_height
+            ))
+            for layer in layers:
+                layer.ResetReading()
+                gdal.RasterizeLayer(dataset, [1], layer, burn_values=[1], options=['ALL_TOUCHED=TRUE'])
+            raster = dataset.GetRasterBand(1).ReadAsArray()
+            dataset = None
+
+            rows = block_stop - 1 - global_ys[in_block]
+            cols = global_xs[in_block] - x_start
+            touched[in_block] = raster[rows, cols] > 0
+    finally:
+        for layer in layers:
+            layer.SetSpatialFilter(None)
+    
+    return touched
@@ -8,6 +8,7 @@ from .api import api_router
 from .core.config import settings
 from .core.mcp_client import MCPClient
 from .core.server import init_working_directory
+from .core.picking import start_pick_pool, close_pick_pool
 from .core.bootstrapping_treeger import BT
 
 @asynccontextmanager
@@ -31,11 +32,13 @@ async def lifespan(app: FastAPI):
     BT.instance.mount_node('hello', 'root.hello')
     
     init_working_directory()
+    start_pick_pool(settings.PICK_POOL_SIZE)
     
     yield
     
     # close_current_project()
     
+    close_pick_pool()
     BT.instance.terminate()
     # await agent_client.cleanup()
 
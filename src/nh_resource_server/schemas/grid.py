@@ -2,7 +2,7 @@ import json
 import math
 import numpy as np
 from pathlib import Path
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ConfigDict, field_validator
 from .base import BaseResponse
 from .schema import ProjectSchema
 from ..core.config import settings, APP_CONTEXT
@@ -83,8 +83,18 @@ class GridMeta(BaseModel):
         return GridMeta.from_patch(project_name, patch_name)
     
 class MultiGridInfo(BaseModel):
-    levels: list[int]
-    global_ids: list[int]
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
+    levels: np.ndarray # uint8
+    global_ids: np.ndarray # uint32
+    
+    @field_validator('levels', mode='before')
+    def check_levels(cls, v):
+        return np.ascontiguousarray(v, dtype=np.uint8)
+    
+    @field_validator('global_ids', mode='before')
+    def check_global_ids(cls, v):
+        return np.ascontiguousarray(v, dtype=np.uint32)
     
     def combine_bytes(self):
         """
@@ -93,14 +103,14 @@ class MultiGridInfo(BaseModel):
         Format: [4 bytes for length, followed by level bytes, followed by global id bytes]
         """
         
-        level_bytes = np.array(self.levels, dtype=np.uint8).tobytes()
-        global_id_bytes = np.array(self.global_ids, dtype=np.uint32).tobytes()
+        level_bytes = self.levels.data
+        global_id_bytes = self.global_ids.data
         
-        level_length = len(level_bytes).to_bytes(4, byteorder='little')
-        padding_size = (4 - (len(level_length) + len(level_bytes)) % 4) % 4
+        level_length = len(self.levels).to_bytes(4, byteorder='little')
+        padding_size = (4 - (len(level_length) + len(self.levels)) % 4) % 4
         padding = b'\x00' * padding_size
         
-        return level_length + level_bytes + padding + global_id_bytes
+        return b''.join((level_length, level_bytes, padding, global_id_bytes))
     
     @staticmethod
     def from_bytes(data: bytes):
@@ -112,17 +122,20 @@ class MultiGridInfo(BaseModel):
         - Next N bytes: level bytes
         - Padding to make the total length a multiple of 4
         - Remaining bytes: global id bytes
+        
+        Levels and global ids are read-only NumPy views over the data, no copy is made.
         """
         
         if len(data) < 8:
             raise ValueError('Data is too short to contain valid MultiGridInfo')
         
         level_length = int.from_bytes(data[:4], byteorder='little')
-        level_bytes = data[4:4 + level_length]
-        global_id_bytes = data[4 + level_length + (4 - (level_length % 4)) % 4:]
+        global_id_offset = 4 + level_length + (4 - (level_length % 4)) % 4
         
-        levels = list(np.frombuffer(level_bytes, dtype=np.uint8))
-        global_ids = list(np.frombuffer(global_id_bytes, dtype=np.uint32))
+        levels = np.frombuffer(data, dtype=np.uint8, count=level_length, offset=4)
+        global_ids = np.frombuffer(data, dtype=np.uint32, offset=global_id_offset)
+        if len(levels) != len(global_ids):
+            raise ValueError(f'Level count ({len(levels)}) does not match global id count ({len(global_ids)})')
         
         return MultiGridInfo(levels=levels, global_ids=global_ids)
 
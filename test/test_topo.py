@@ -0,0 +1,543 @@
+import os
+import sys
+import time
+import struct
+import pytest
+import threading
+import numpy as np
+import c_two as cc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from icrms.itopo import ITopo
+import crms.topo as topo_module
+from crms.topo import Topo, SegmentFile, ChangeTracker, _encode_index_batch, _decode_index_batch
+from src.nh_resource_server.core.mesh import read_mesh_table, read_ne, read_ns, ne_from_lists, ns_from_lists
+from icrms.isolution import ListColumn
+
+EPSG = 4326
+BOUNDS = [0.0, 0.0, 90.0, 60.0]
+FIRST_SIZE = [30.0, 30.0]
+SUBDIVIDE_RULES = [[3, 2], [2, 2], [2, 2], [1, 1]]
+
+class LoopbackClient:
+    """Client calling a CRM in process, through the same transferables as a remote call"""
+    def __init__(self, crm: Topo):
+        self.crm = crm
+
+    def call(self, method_name: str, data: bytes | None = None) -> memoryview:
+        method = getattr(self.crm, method_name)
+        response = memoryview(method.__wrapped__(self.crm, data))
+
+        # Response is the serialized error then the serialized result, each prefixed by its length as a big-endian uint64
+        sub_responses, offset = [], 0
+        while offset < len(response):
+            (length,) = struct.unpack_from('>Q', response, offset)
+            sub_responses.append(response[offset + 8:offset + 8 + length])
+            offset += 8 + length
+
+        err = cc.error.CCError.deserialize(sub_responses[0])
+        if err:
+            raise err
+        return sub_responses[1]
+
+def create_topo(**kwargs) -> Topo:
+    return Topo(EPSG, BOUNDS, FIRST_SIZE, SUBDIVIDE_RULES, **kwargs)
+
+def connect(topo: Topo) -> ITopo:
+    itopo = ITopo()
+    itopo.client = LoopbackClient(topo)
+    return itopo
+
+def grid_set(levels, global_ids) -> set[tuple[int, int]]:
+    return set(zip(np.asarray(levels).tolist(), np.asarray(global_ids).tolist()))
+
+def all_keys(topo: Topo) -> np.ndarray:
+    return np.concatenate([
+        _encode_index_batch(np.full(info['width'] * info['height'], level, dtype=np.uint8), np.arange(info['width'] * info['height'], dtype=np.uint32))
+        for level, info in enumerate(topo.level_info) if level > 0
+    ])
+
+def random_edit(topo: Topo, rng: np.random.Generator):
+    # Pick among active grids sorted by key, so that storages listing them in different orders pick the same grids
+    levels, global_ids = _decode_index_batch(np.sort(topo.store.active_keys()))
+    picked = rng.choice(len(levels), size=min(3, len(levels)), replace=False)
+    op = rng.choice(['subdivide', 'delete', 'recover', 'merge'], p=[0.5, 0.2, 0.15, 0.15])
+    if op == 'subdivide':
+        topo.subdivide_grids(levels[picked], global_ids[picked])
+    elif op == 'delete':
+        topo.delete_grids(levels[picked[:1]], global_ids[picked[:1]])
+    elif op == 'recover':
+        topo.recover_multi_grids(*_decode_index_batch(np.sort(topo.store.deleted_keys())))
+    else:
+        topo.merge_multi_grids(levels[picked], global_ids[picked])
+
+# Transfer ##################################################
+
+def test_grid_infos_methods_through_transfer():
+    topo = create_topo(storage='bitset')
+    itopo = connect(topo)
+
+    levels, global_ids = itopo.get_active_grid_infos()
+    assert grid_set(levels, global_ids) == {(1, i) for i in range(6)}
+
+    child_levels, child_global_ids = itopo.subdivide_grids(np.array([1, 1]), np.array([0, 4]))
+    assert len(child_levels) == 8
+    assert np.all(np.asarray(child_levels) == 2)
+
+    parent_levels, parent_global_ids = itopo.get_parents(child_levels, child_global_ids)
+    assert grid_set(parent_levels, parent_global_ids) == {(1, 0), (1, 4)}
+
+    centers = itopo.get_multi_grid_centers(np.array([1, 1]), np.array([0, 4]))
+    assert centers == [(15.0, 15.0), (45.0, 45.0)]
+    bboxes = itopo.get_multi_grid_bboxes(np.array([1]), np.array([0]))
+    assert np.allclose(bboxes, [0.0, 0.0, 30.0, 30.0])
+
+    itopo.delete_grids(child_levels[:1], child_global_ids[:1])
+    deleted_levels, deleted_global_ids = itopo.get_deleted_grid_infos()
+    assert grid_set(deleted_levels, deleted_global_ids) == grid_set(child_levels[:1], child_global_ids[:1])
+
+    itopo.recover_multi_grids(deleted_levels, deleted_global_ids)
+    assert len(itopo.get_deleted_grid_infos()[0]) == 0
+
+    merged_levels, merged_global_ids = itopo.merge_multi_grids(child_levels[:4], child_global_ids[:4])
+    assert grid_set(merged_levels, merged_global_ids) == {(1, 0)}
+    assert (1, 0) in grid_set(*itopo.get_active_grid_infos())
+
+# Storage ##################################################
+
+def test_bitset_storage_matches_dataframe_storage():
+    rng = np.random.default_rng(1)
+    dataframe_topo, bitset_topo = create_topo(storage='dataframe'), create_topo(storage='bitset')
+    keys = all_keys(bitset_topo)
+    for _ in range(30):
+        state = rng.bit_generator.state
+        random_edit(dataframe_topo, rng)
+        rng.bit_generator.state = state
+        random_edit(bitset_topo, rng)
+
+        assert len(bitset_topo.store) == len(dataframe_topo.store)
+        assert np.array_equal(np.sort(bitset_topo.store.active_keys()), np.sort(dataframe_topo.store.active_keys()))
+        assert np.array_equal(np.sort(bitset_topo.store.deleted_keys()), np.sort(dataframe_topo.store.deleted_keys()))
+        existing = dataframe_topo.store.contains(keys)
+        assert np.array_equal(bitset_topo.store.contains(keys), existing)
+        for bitset_flags, dataframe_flags in zip(bitset_topo.store.get_states(keys[existing]), dataframe_topo.store.get_states(keys[existing])):
+            assert np.array_equal(bitset_flags, dataframe_flags)
+
+# Subdivision ##################################################
+
+@pytest.mark.parametrize('storage', ['dataframe', 'bitset'])
+def test_subdivide_grids_across_levels(storage):
+    topo = create_topo(storage=storage)
+    child_levels, child_global_ids = topo.subdivide_grids(np.array([1]), np.array([0]))
+    parents = [(1, 1), (1, 5), (2, 0), (2, 7)]
+
+    # Duplicated, inactive (already subdivided) and finest level grids are skipped
+    levels = np.array([level for level, _ in parents] + [1, 1, 4])
+    global_ids = np.array([global_id for _, global_id in parents] + [1, 0, 0])
+    levels, global_ids = topo.subdivide_grids(levels, global_ids)
+
+    expected = {
+        (level + 1, child_global_id)
+        for level, global_id in parents
+        for child_global_id in topo._get_grid_children_global_ids(level, global_id)
+    }
+    assert len(levels) == len(expected)
+    assert grid_set(levels, global_ids) == expected
+    active = grid_set(*topo.get_active_grid_infos())
+    assert expected <= active
+    assert not (set(parents) | {(1, 0)}) & active
+
+# History ##################################################
+
+def grid_state(topo: Topo) -> tuple[set, set]:
+    return grid_set(*topo.get_active_grid_infos()), grid_set(*topo.get_deleted_grid_infos())
+
+def test_undo_redo():
+    topo = create_topo(storage='bitset')
+    states = [grid_state(topo)]
+    levels, global_ids = topo.subdivide_grids(np.array([1]), np.array([0]))
+    states.append(grid_state(topo))
+    topo.delete_grids(levels[:2], global_ids[:2])
+    states.append(grid_state(topo))
+
+    changes = topo.undo()
+    assert grid_set(changes.levels, changes.global_ids) == grid_set(levels[:2], global_ids[:2])
+    assert np.all(changes.activate) and not np.any(changes.deleted)
+    assert grid_state(topo) == states[1]
+    topo.undo()
+    assert grid_state(topo) == states[0]
+    assert len(topo.undo().levels) == 0
+
+    topo.redo()
+    assert grid_state(topo) == states[1]
+    topo.redo()
+    assert grid_state(topo) == states[2]
+    assert len(topo.redo().levels) == 0
+
+    # A new edit drops the redo history
+    topo.undo()
+    topo.subdivide_grids(np.array([1]), np.array([1]))
+    assert len(topo.redo().levels) == 0
+
+def test_history_budget_evicts_oldest_edits():
+    # Subdividing a level 1 grid flips 5 keys, kept as 10 bytes each
+    topo = create_topo(storage='bitset', history_budget=120)
+    states = [grid_state(topo)]
+    for global_id in range(3):
+        topo.subdivide_grids(np.array([1]), np.array([global_id]))
+        states.append(grid_state(topo))
+    assert len(topo.history) == 2
+    assert topo.history.nbytes <= 120
+
+    topo.undo()
+    topo.undo()
+    assert grid_state(topo) == states[1]
+    assert len(topo.undo().levels) == 0
+    assert grid_state(topo) == states[1]
+
+    disabled = create_topo(storage='bitset', history_budget=0)
+    disabled.subdivide_grids(np.array([1]), np.array([0]))
+    assert len(disabled.undo().levels) == 0
+
+# Grid File ##################################################
+
+@pytest.mark.parametrize('storage', ['dataframe', 'bitset'])
+@pytest.mark.parametrize('compression', ['none', 'lz4'])
+@pytest.mark.parametrize('lazy_load', [False, True])
+def test_segment_file_round_trip(tmp_path, storage, compression, lazy_load):
+    if lazy_load and storage != 'bitset':
+        pytest.skip('lazy loading needs the bitset storage')
+    grid_file_path = str(tmp_path / 'patch.topo.arrow')
+    topo = create_topo(grid_file_path=grid_file_path, storage=storage, file_format='segment', compression=compression)
+    topo.subdivide_grids(np.array([1, 1]), np.array([0, 4]))
+    topo.delete_grids(np.array([1]), np.array([5]))
+
+    # Grids both active and deleted (e.g. parents re-activated by a merge) keep both flags
+    both_keys = _encode_index_batch(np.array([1, 2], dtype=np.uint8), np.array([4, 1], dtype=np.uint32))
+    topo.store.update(both_keys, activate=True, deleted=True)
+    assert topo.save().success
+    assert SegmentFile.is_segment_file(grid_file_path)
+
+    keys = topo.store.filter_existing(np.concatenate([
+        _encode_index_batch(np.full(info['width'] * info['height'], level, dtype=np.uint8), np.arange(info['width'] * info['height'], dtype=np.uint32))
+        for level, info in enumerate(topo.level_info) if level > 0
+    ]))
+    activates, deleteds = topo.store.get_states(keys)
+
+    loaded = create_topo(grid_file_path=grid_file_path, storage=storage, lazy_load=lazy_load, file_format='segment', compression=compression)
+    assert len(loaded.store) == len(topo.store)
+    loaded_activates, loaded_deleteds = loaded.store.get_states(keys)
+    assert np.array_equal(loaded_activates, activates)
+    assert np.array_equal(loaded_deleteds, deleteds)
+    assert np.all(loaded_activates[np.isin(keys, both_keys)])
+    assert np.all(loaded_deleteds[np.isin(keys, both_keys)])
+
+@pytest.mark.parametrize('file_format', ['arrow', 'segment'])
+def test_autosave_with_concurrent_readers_on_lazy_storage(tmp_path, file_format):
+    grid_file_path = str(tmp_path / 'patch.topo.arrow')
+    topo = create_topo(grid_file_path=grid_file_path, storage='bitset', file_format=file_format)
+    levels, global_ids = topo.subdivide_grids(*topo.get_active_grid_infos())
+    levels, global_ids = topo.subdivide_grids(levels, global_ids)
+    assert topo.save().success
+
+    for i in range(10):
+        lazy = create_topo(grid_file_path=grid_file_path, storage='bitset', lazy_load=True, file_format=file_format, autosave_interval=0.001)
+        stop, errors = threading.Event(), []
+
+        # Readers materialize levels and read the memory-mapped source while autosave materializes all levels and releases it
+        def read():
+            try:
+                while not stop.is_set():
+                    lazy.get_active_grid_infos()
+                    lazy.get_deleted_grid_infos()
+                    len(lazy.store)
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        time.sleep(0.005)
+        lazy.delete_grids(levels[i:i + 1], global_ids[i:i + 1])
+        deadline = time.time() + 5
+        while lazy._pending_edits() > 0 and time.time() < deadline:
+            time.sleep(0.001)
+        stop.set()
+        for reader in readers:
+            reader.join()
+        lazy.terminate()
+
+        assert not errors
+        assert lazy._pending_edits() == 0
+        loaded = create_topo(grid_file_path=grid_file_path, storage='bitset', file_format=file_format)
+        assert grid_set(*loaded.get_deleted_grid_infos()) >= grid_set(levels[:i + 1], global_ids[:i + 1])
+
+def test_segment_file_is_compact_and_read_per_level(tmp_path):
+    sizes = {}
+    for file_format in ('arrow', 'segment'):
+        grid_file_path = str(tmp_path / f'{file_format}.topo.arrow')
+        topo = create_topo(grid_file_path=grid_file_path, storage='bitset', file_format=file_format)
+        levels, global_ids = topo.subdivide_grids(*topo.get_active_grid_infos())
+        levels, global_ids = topo.subdivide_grids(levels, global_ids)
+        topo.delete_grids(levels[:5], global_ids[:5])
+        assert topo.save().success
+        sizes[file_format] = os.path.getsize(grid_file_path)
+    assert sizes['segment'] * 10 < sizes['arrow']
+
+    # Each level is decoded on its own, straight from the level table of the header
+    segments = SegmentFile(grid_file_path)
+    assert segments.levels() == [1, 2, 3]
+    for level in segments.levels():
+        ids, activates, deleteds = segments.read_level(level)
+        assert segments.count(level) == len(ids) == topo.level_info[level]['width'] * topo.level_info[level]['height']
+        keys = _encode_index_batch(np.full(len(ids), level, dtype=np.uint8), ids.astype(np.uint32))
+        stored_activates, stored_deleteds = topo.store.get_states(keys)
+        assert np.array_equal(activates, stored_activates)
+        assert np.array_equal(deleteds, stored_deleteds)
+    segments.close()
+
+def test_lazy_load_materializes_touched_levels(tmp_path):
+    grid_file_path = str(tmp_path / 'patch.topo.arrow')
+    topo = create_topo(grid_file_path=grid_file_path, storage='bitset')
+    levels, global_ids = topo.subdivide_grids(*topo.get_active_grid_infos())
+    topo.subdivide_grids(levels[:4], global_ids[:4])
+    assert topo.save().success
+
+    lazy = create_topo(grid_file_path=grid_file_path, storage='bitset', lazy_load=True)
+    assert sorted(lazy.store.source_counts) == [1, 2, 3]
+    assert not lazy.store.present
+    assert len(lazy.store) == len(topo.store)
+
+    # Reads are served from the mapped file without materializing levels
+    assert np.array_equal(lazy.store.active_keys(), np.sort(topo.store.active_keys()))
+    assert not lazy.store.present
+
+    # Touching a level only materializes that level
+    level_keys = _encode_index_batch(np.full(2, 2, dtype=np.uint8), global_ids[:2])
+    for lazy_flags, flags in zip(lazy.store.get_states(level_keys), topo.store.get_states(level_keys)):
+        assert np.array_equal(lazy_flags, flags)
+    assert sorted(lazy.store.present) == [2]
+    assert sorted(lazy.store.source_counts) == [1, 3]
+
+    # Edits materialize the levels they touch, saving materializes the rest and releases the mapped file before replacing it
+    lazy.delete_grids(levels[4:5], global_ids[4:5])
+    assert lazy.save().success
+    assert not lazy.store.source_counts and lazy.store.source_file is None
+    loaded = create_topo(grid_file_path=grid_file_path, storage='bitset')
+    assert grid_set(*loaded.get_active_grid_infos()) == grid_set(*lazy.get_active_grid_infos())
+    assert (2, int(global_ids[4])) in grid_set(*loaded.get_deleted_grid_infos())
+
+# Topology ##################################################
+
+def test_topology_without_active_grids(tmp_path):
+    topo = create_topo()
+    topo.delete_grids(*topo.get_active_grid_infos())
+    assert len(topo.get_active_grid_infos()[0]) == 0
+
+    topology = topo.get_topology()
+    assert len(topology.levels) == 0
+    assert len(topology.edge_directions) == 0
+
+    ne_path, ns_path = str(tmp_path / 'ne.arrow'), str(tmp_path / 'ns.arrow')
+    info = topo.export_mesh(ne_path, ns_path)
+    assert info.success, info.message
+    # Only the placeholder rows of id 0
+    assert read_mesh_table(ne_path).num_rows == 1
+    assert read_mesh_table(ns_path).num_rows == 1
+
+def test_mesh_files_read_as_column_views(tmp_path):
+    topo = create_topo()
+    topo.subdivide_grids(np.array([1]), np.array([0]))
+    topology = topo.get_topology()
+    grid_count, edge_count = len(topology.levels), len(topology.edge_directions)
+
+    ne_path, ns_path = str(tmp_path / 'ne.arrow'), str(tmp_path / 'ns.arrow')
+    assert topo.export_mesh(ne_path, ns_path).success
+    ne, ns = read_ne(ne_path), read_ns(ns_path)
+
+    # Columns are views over the mapped files, indexed by 1-based ids
+    assert isinstance(ne.xe_list, np.ndarray) and not ne.xe_list.flags.owndata
+    assert len(ne.grid_id_list) == grid_count + 1 and len(ne.isl1_list) == grid_count + 1
+    assert ns.ise_list.shape == (edge_count + 1, 5)
+    assert np.array_equal(ne.grid_id_list, np.arange(grid_count + 1))
+    assert np.array_equal(ns.edge_id_list, np.arange(edge_count + 1))
+
+    # Each edge is listed on the sides of the grids it borders
+    for edge_id in range(1, edge_count + 1):
+        direction, left, right, bottom, top = ns.ise_list[edge_id].tolist()
+        sides = [(left, ne.isl2_list), (right, ne.isl1_list)] if direction == 2 else [(bottom, ne.isl4_list), (top, ne.isl3_list)]
+        for grid_id, side_lists in sides:
+            if grid_id != 0:
+                assert edge_id in side_lists[grid_id]
+    for side_counts, side_lists in ((ne.nsl1_list, ne.isl1_list), (ne.nsl4_list, ne.isl4_list)):
+        assert all(side_counts[i] == len(side_lists[i]) for i in range(grid_count + 1))
+
+def test_mesh_columns_from_lists_match_binary_files(tmp_path):
+    topo = create_topo()
+    topo.subdivide_grids(np.array([1]), np.array([0]))
+    ne_path, ns_path = str(tmp_path / 'ne.arrow'), str(tmp_path / 'ns.arrow')
+    assert topo.export_mesh(ne_path, ns_path).success
+    ne, ns = read_ne(ne_path), read_ns(ns_path)
+
+    # Columns parsed from text files come as the same types as columns read from binary files
+    ne_parsed = ne_from_lists(*[
+        [row.tolist() for row in column] if isinstance(column, ListColumn) else column.tolist()
+        for column in vars(ne).values()
+    ])
+    ns_parsed = ns_from_lists(*[column.tolist() for column in vars(ns).values()])
+    for name, column in vars(ne).items():
+        parsed = getattr(ne_parsed, name)
+        assert type(parsed) is type(column)
+        if isinstance(column, ListColumn):
+            assert np.array_equal(parsed.offsets, column.offsets) and np.array_equal(parsed.values, column.values)
+        else:
+            assert parsed.dtype == column.dtype and np.array_equal(parsed, column)
+    for name, column in vars(ns).items():
+        parsed = getattr(ns_parsed, name)
+        assert parsed.dtype == column.dtype and np.array_equal(parsed, column)
+
+def test_topology_leaves_out_grids_covered_by_active_ancestors():
+    topo = create_topo()
+    child_levels, child_global_ids = topo.subdivide_grids(np.array([1]), np.array([0]))
+    # Recovering the parent while its children are still active makes them overlap
+    topo.recover_multi_grids([1], [0])
+    active = grid_set(*topo.get_active_grid_infos())
+    assert (1, 0) in active and grid_set(child_levels, child_global_ids) <= active
+
+    topology = topo.get_topology()
+    assert grid_set(topology.levels, topology.global_ids) == {(1, i) for i in range(6)}
+    # 3 x 2 grids of the same size share 7 inner edges and have 10 boundary edges
+    assert len(topology.edge_directions) == 17
+
+# Changes ##################################################
+
+def test_change_tracker_merges_edits_and_forgets_old_ones():
+    tracker = ChangeTracker(base_version=100, max_keys=4)
+    v1 = tracker.mark(np.array([3, 1], dtype=np.uint64))
+    v2 = tracker.mark(np.array([1, 2], dtype=np.uint64))
+    assert tracker.mark(np.empty(0, dtype=np.uint64)) == v2
+    assert tracker.changed_since(100).tolist() == [1, 2, 3]
+    assert tracker.changed_since(v1).tolist() == [1, 2]
+    assert len(tracker.changed_since(v2)) == 0
+
+    # Going over max_keys forgets the oldest edit
+    v3 = tracker.mark(np.array([5], dtype=np.uint64))
+    assert len(tracker) == 3
+    assert not tracker.tracks(100) and tracker.tracks(v1)
+    assert tracker.changed_since(v1).tolist() == [1, 2, 5]
+    assert tracker.tracks(v3) and not tracker.tracks(v3 + 1)
+
+def test_grid_changes_fall_back_to_full_refresh():
+    topo = create_topo()
+    topo.changes.max_keys = 8
+    version = topo.changes.version
+    topo.subdivide_grids(np.array([1]), np.array([0]))
+    changes = topo.get_grid_changes(version)
+    assert not changes.full
+    assert grid_set(changes.levels, changes.global_ids) == {(1, 0)} | {(2, i) for i in (0, 1, 6, 7)}
+
+    # Once the edit is forgotten, callers synchronized before it get all active and deleted grids
+    topo.subdivide_grids(np.array([1]), np.array([1]))
+    changes = topo.get_grid_changes(version)
+    assert changes.full
+    assert grid_set(changes.levels, changes.global_ids) == grid_set(*topo.get_active_grid_infos()) | grid_set(*topo.get_deleted_grid_infos())
+    assert not topo.get_grid_changes(topo.changes.version).full
+
+# Branches ##################################################
+
+def test_branch_commit_and_discard(tmp_path):
+    grid_file_path = str(tmp_path / 'patch.topo.arrow')
+    topo = create_topo(grid_file_path=grid_file_path, storage='bitset')
+    assert topo.save().success
+    main_grids = grid_set(*topo.get_active_grid_infos())
+
+    assert topo.create_branch('draft').success
+    assert topo.checkout_branch('draft').success
+    topo.subdivide_grids(np.array([1]), np.array([0]))
+    draft_grids = grid_set(*topo.get_active_grid_infos())
+    assert draft_grids != main_grids
+
+    # Checking out and editing a branch leaves the main branch clean
+    assert topo.checkout_branch('main').success
+    assert grid_set(*topo.get_active_grid_infos()) == main_grids
+    assert topo._pending_edits() == 0
+    assert topo.save().message == 'No changes to save'
+
+    assert topo.create_branch('scrap').success
+    assert topo.checkout_branch('scrap').success
+    topo.delete_grids(np.array([1]), np.array([5]))
+    assert topo.discard_branch('scrap').success
+    assert topo.get_branches() == ['main', 'draft']
+    assert grid_set(*topo.get_active_grid_infos()) == main_grids
+
+    assert topo.commit_branch('draft').success
+    assert topo.get_branches() == ['main']
+    assert grid_set(*topo.get_active_grid_infos()) == draft_grids
+    assert topo._pending_edits() == 1
+    assert topo.save().success
+
+    loaded = create_topo(grid_file_path=grid_file_path, storage='bitset')
+    assert grid_set(*loaded.get_active_grid_infos()) == draft_grids
+
+    # The commit is a single edit of the main branch
+    assert topo.undo() is not None
+    assert grid_set(*topo.get_active_grid_infos()) == main_grids
+
+def test_stale_branch_is_not_committed():
+    topo = create_topo(storage='bitset')
+    assert topo.create_branch('draft').success
+    assert topo.checkout_branch('draft').success
+    topo.delete_grids(np.array([1]), np.array([0]))
+    assert topo.checkout_branch('main').success
+    topo.subdivide_grids(np.array([1]), np.array([0]))
+    main_grids = grid_set(*topo.get_active_grid_infos())
+
+    result = topo.commit_branch('draft')
+    assert not result.success
+    assert 'stale' in result.message
+    assert topo.get_branches() == ['main', 'draft']
+    assert grid_set(*topo.get_active_grid_infos()) == main_grids
+
+# Edit Log ##################################################
+
+def test_edit_log_replay_and_compaction(tmp_path, monkeypatch):
+    grid_file_path = str(tmp_path / 'patch.topo.arrow')
+    log_path = tmp_path / 'patch.topo.log'
+    topo = create_topo(grid_file_path=grid_file_path, storage='bitset', edit_log=True)
+    assert topo.save().success
+    grid_file_size = os.path.getsize(grid_file_path)
+
+    # Edits are appended to the log, saving leaves the grid file as is
+    levels, global_ids = topo.subdivide_grids(np.array([1, 1]), np.array([0, 4]))
+    topo.delete_grids(levels[:2], global_ids[:2])
+    topo.undo()
+    topo.merge_multi_grids(levels[4:], global_ids[4:])
+    assert 'edit log' in topo.save().message
+    assert topo.edit_log.record_count == 4
+    assert os.path.getsize(grid_file_path) == grid_file_size
+    state = (grid_set(*topo.get_active_grid_infos()), grid_set(*topo.get_deleted_grid_infos()))
+
+    # Logged edits are replayed on load, a torn record left by a crash is dropped
+    with open(log_path, 'ab') as f:
+        f.write(b'\x03\x05\x00\x00\x00\x01\x02')
+    replayed = create_topo(grid_file_path=grid_file_path, storage='bitset', edit_log=True)
+    assert (grid_set(*replayed.get_active_grid_infos()), grid_set(*replayed.get_deleted_grid_infos())) == state
+    assert replayed.edit_log.record_count == 4
+    stale_log = log_path.read_bytes()
+
+    # Past the threshold, saving compacts the log into a new generation of the grid file
+    monkeypatch.setattr(topo_module, 'EDIT_LOG_COMPACT_THRESHOLD', 1)
+    generation = replayed.generation
+    assert replayed.save().success
+    assert replayed.generation == generation + 1
+    assert replayed.edit_log.record_count == 0
+    assert replayed.edit_log.read_generation() == replayed.generation
+
+    # A log of an older generation is not replayed again over the compacted grid file
+    replayed.edit_log.close()
+    log_path.write_bytes(stale_log)
+    compacted = create_topo(grid_file_path=grid_file_path, storage='bitset', edit_log=True)
+    assert (grid_set(*compacted.get_active_grid_infos()), grid_set(*compacted.get_deleted_grid_infos())) == state
+    assert compacted.edit_log.record_count == 0
+    for logged in (topo, compacted):
+        logged.edit_log.close()